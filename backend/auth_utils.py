@@ -1,23 +1,82 @@
 import jwt
+import hmac
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
 from passlib.context import CryptContext
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor; hashes with any other cost are transparently rehashed on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+# Max password hashes/verifications running at once (bcrypt releases the GIL)
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', str(os.cpu_count() or 2)))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 
+# Password work runs here instead of on the event loop
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="password-hash")
+_password_slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+_password_stats = {"waiting": 0, "running": 0, "completed": 0, "max_waiting": 0}
+
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'vasool-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Bearer token for the internal metrics endpoint; without one the endpoint is not served
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def _run_password_work(fn: Callable, *args):
+    """Run CPU-heavy password work on the bounded pool, tracking queue depth"""
+    _password_stats["waiting"] += 1
+    _password_stats["max_waiting"] = max(_password_stats["max_waiting"], _password_stats["waiting"])
+    try:
+        await _password_slots.acquire()
+    finally:
+        _password_stats["waiting"] -= 1
+    
+    _password_stats["running"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_password_executor, fn, *args)
+    finally:
+        _password_stats["running"] -= 1
+        _password_stats["completed"] += 1
+        _password_slots.release()
+
+async def hash_password_async(password: str) -> str:
+    return await _run_password_work(pwd_context.hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password off the event loop
+    
+    Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated
+    scheme or cost and should be replaced.
+    """
+    return await _run_password_work(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def get_password_pool_metrics() -> Dict:
+    return {
+        **_password_stats,
+        "concurrency": PASSWORD_HASH_CONCURRENCY,
+        "bcrypt_rounds": BCRYPT_ROUNDS
+    }
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -37,4 +96,11 @@ def decode_token(token: str) -> dict:
 def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)) -> dict:
     token = credentials.credentials
     payload = decode_token(token)
-    return payload
\ No newline at end of file
+    return payload
+
+def require_metrics_token(credentials: Optional[HTTPAuthorizationCredentials] = Security(HTTPBearer(auto_error=False))):
+    """Only callers presenting METRICS_TOKEN (user tokens are not accepted)"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
\ No newline at end of file
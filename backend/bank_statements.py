@@ -0,0 +1,234 @@
+"""
+Bank statement parsers
+Turn uploaded CSV, OFX/QFX and ISO 20022 camt.053 statements into uniform lines:
+{line_id, date (YYYY-MM-DD), amount (credits positive), description, reference, counterparty}
+"""
+
+import csv
+import hashlib
+import io
+import re
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Dict, List, Optional
+
+STATEMENT_FORMATS = ("csv", "ofx", "camt")
+
+# Normalized CSV header -> field; first matching column wins
+CSV_COLUMNS = {
+    "date": ("date", "transactiondate", "txndate", "trandate", "valuedate", "postingdate", "bookingdate", "valuedt"),
+    "description": ("description", "narration", "particulars", "details", "transactiondetails", "remarks", "memo"),
+    "reference": ("reference", "referenceno", "refno", "ref", "chqrefno", "chequeno", "utr", "transactionid"),
+    "amount": ("amount", "transactionamount", "amt"),
+    "credit": ("credit", "credits", "deposit", "deposits", "depositamt", "creditamount", "cr"),
+    "debit": ("debit", "debits", "withdrawal", "withdrawals", "withdrawalamt", "debitamount", "dr"),
+    "counterparty": ("counterparty", "payer", "name", "beneficiary", "remitter"),
+}
+
+# Day-first formats are tried before month-first ones
+DATE_FORMATS = (
+    "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y",
+    "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d %b %y", "%m/%d/%Y", "%Y%m%d",
+)
+
+
+class StatementParseError(ValueError):
+    """The upload is not a statement we can read"""
+
+
+def _normalize_header(value: str) -> str:
+    return re.sub(r"[^a-z]", "", (value or "").lower())
+
+
+def parse_amount(value: Optional[str]) -> Optional[float]:
+    """Parse "1,234.50", "(1,234.50)", "1234.50 Cr", "₹ 1,234" and friends"""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    negative = text.startswith("(") and text.endswith(")") or text.startswith("-")
+    lowered = text.lower()
+    if lowered.endswith("dr"):
+        negative = True
+    cleaned = re.sub(r"[^0-9.]", "", text)
+    if not cleaned or cleaned == ".":
+        return None
+    try:
+        amount = float(cleaned)
+    except ValueError:
+        return None
+    return -amount if negative else amount
+
+
+def parse_date(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    text = value.strip()[:20]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    # Timestamps: try the date part alone
+    head = re.split(r"[ T]", text)[0]
+    if head != text:
+        return parse_date(head)
+    return None
+
+
+def _with_line_ids(lines: List[Dict]) -> List[Dict]:
+    """Stable ids so re-uploading an overlapping statement does not duplicate lines"""
+    seen: Dict[str, int] = {}
+    for line in lines:
+        basis = line.get("reference") or ""
+        basis = f"{line['date']}|{line['amount']:.2f}|{line['description']}|{basis}"
+        occurrence = seen.get(basis, 0)
+        seen[basis] = occurrence + 1
+        line["line_id"] = hashlib.sha1(f"{basis}|{occurrence}".encode()).hexdigest()
+    return lines
+
+
+def parse_csv(content: bytes) -> List[Dict]:
+    text = content.decode("utf-8-sig", errors="replace")
+    rows = list(csv.reader(io.StringIO(text)))
+
+    # Bank exports often start with account details; the header is the first row naming a date column
+    header_index = None
+    columns: Dict[str, int] = {}
+    for index, row in enumerate(rows[:50]):
+        normalized = [_normalize_header(cell) for cell in row]
+        found = {}
+        for field, aliases in CSV_COLUMNS.items():
+            position = next((normalized.index(alias) for alias in aliases if alias in normalized), None)
+            if position is not None:
+                found[field] = position
+        if "date" in found and ("amount" in found or "credit" in found):
+            header_index, columns = index, found
+            break
+    if header_index is None:
+        raise StatementParseError("CSV needs a date column and an amount or credit column")
+
+    def cell(row: List[str], field: str) -> str:
+        position = columns.get(field)
+        return row[position].strip() if position is not None and position < len(row) else ""
+
+    lines = []
+    for row in rows[header_index + 1:]:
+        date = parse_date(cell(row, "date"))
+        if date is None:
+            continue
+        if "amount" in columns:
+            amount = parse_amount(cell(row, "amount"))
+        else:
+            credit = parse_amount(cell(row, "credit")) or 0.0
+            debit = parse_amount(cell(row, "debit")) or 0.0
+            amount = abs(credit) - abs(debit)
+        if not amount:
+            continue
+        lines.append({
+            "date": date,
+            "amount": amount,
+            "description": cell(row, "description"),
+            "reference": cell(row, "reference"),
+            "counterparty": cell(row, "counterparty"),
+        })
+    return _with_line_ids(lines)
+
+
+def parse_ofx(content: bytes) -> List[Dict]:
+    """OFX 1.x (SGML, unclosed tags) and 2.x (XML) statement transactions"""
+    text = content.decode("utf-8", errors="replace")
+
+    def tag(block: str, name: str) -> str:
+        match = re.search(rf"<{name}>([^<\r\n]*)", block, re.IGNORECASE)
+        return match.group(1).strip() if match else ""
+
+    lines = []
+    for block in re.findall(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|</BANKTRANLIST>)", text, re.IGNORECASE | re.DOTALL):
+        date = parse_date(tag(block, "DTPOSTED")[:8])
+        amount = parse_amount(tag(block, "TRNAMT"))
+        if date is None or not amount:
+            continue
+        lines.append({
+            "date": date,
+            "amount": amount,
+            "description": tag(block, "MEMO") or tag(block, "NAME"),
+            "reference": tag(block, "REFNUM") or tag(block, "CHECKNUM") or tag(block, "FITID"),
+            "counterparty": tag(block, "NAME"),
+        })
+    if not lines and "<OFX" not in text.upper():
+        raise StatementParseError("Not an OFX statement")
+    return _with_line_ids(lines)
+
+
+def _local(element: ET.Element) -> str:
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _find(element: ET.Element, path: str) -> Optional[ET.Element]:
+    """Namespace-agnostic descendant lookup by a "A/B/C" local-name path"""
+    current = [element]
+    for name in path.split("/"):
+        current = [child for parent in current for child in parent.iter() if _local(child) == name and child is not parent]
+        if not current:
+            return None
+    return current[0]
+
+
+def _text(element: ET.Element, *paths: str) -> str:
+    for path in paths:
+        found = _find(element, path)
+        if found is not None and (found.text or "").strip():
+            return found.text.strip()
+    return ""
+
+
+def parse_camt(content: bytes) -> List[Dict]:
+    """ISO 20022 camt.053/camt.054 booked entries"""
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError as e:
+        raise StatementParseError(f"Invalid camt XML: {e}")
+
+    lines = []
+    for entry in (el for el in root.iter() if _local(el) == "Ntry"):
+        amount = parse_amount(_text(entry, "Amt"))
+        date = parse_date(_text(entry, "BookgDt/Dt", "BookgDt/DtTm", "ValDt/Dt", "ValDt/DtTm"))
+        if amount is None or date is None:
+            continue
+        if _text(entry, "CdtDbtInd") == "DBIT":
+            amount = -abs(amount)
+        lines.append({
+            "date": date,
+            "amount": amount,
+            "description": _text(entry, "Ustrd", "AddtlTxInf", "AddtlNtryInf"),
+            "reference": _text(entry, "EndToEndId", "AcctSvcrRef", "NtryRef"),
+            "counterparty": _text(entry, "Dbtr/Nm", "Cdtr/Nm"),
+        })
+    return _with_line_ids(lines)
+
+
+def detect_format(filename: str, content: bytes) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ofx", ".qfx")):
+        return "ofx"
+    if name.endswith(".xml") or name.endswith(".camt") or name.endswith(".053"):
+        return "camt"
+    if name.endswith(".csv"):
+        return "csv"
+    head = content[:2048].lstrip().upper()
+    if b"OFXHEADER" in head or b"<OFX" in head:
+        return "ofx"
+    if head.startswith(b"<?XML") or b"CAMT" in head:
+        return "camt"
+    return "csv"
+
+
+def parse_statement(filename: str, content: bytes, statement_format: Optional[str] = None) -> Dict:
+    """Parse an uploaded statement into {"format": ..., "lines": [...]}"""
+    statement_format = statement_format or detect_format(filename, content)
+    parser = {"csv": parse_csv, "ofx": parse_ofx, "camt": parse_camt}.get(statement_format)
+    if parser is None:
+        raise StatementParseError(f"Unsupported statement format: {statement_format}")
+    return {"format": statement_format, "lines": parser(content)}
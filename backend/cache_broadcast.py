@@ -0,0 +1,125 @@
+"""
+Cross-process cache invalidation
+Zoho response and integration caches live in each process, so a change applied in
+one process (a webhook drain or mirror sync in the worker) is stamped per user in
+cache_invalidations. Every process polls the stamps and drops its own cached
+entries for those users within CACHE_BROADCAST_INTERVAL seconds.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from database import init_db
+
+logger = logging.getLogger(__name__)
+
+# How often each process looks for invalidations made elsewhere (seconds)
+CACHE_BROADCAST_INTERVAL = float(os.environ.get('CACHE_BROADCAST_INTERVAL', '2'))
+# Stamps written this close together may become visible out of order, so each poll
+# looks back this far (seconds); already applied stamps are skipped
+CACHE_BROADCAST_OVERLAP = 5
+# Stamps older than this are dropped by a TTL index (seconds)
+CACHE_BROADCAST_RETENTION = 60 * 60
+
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_invalidators: List[Callable[[str], None]] = []
+_task: Optional[asyncio.Task] = None
+_since: Optional[datetime] = None
+_applied: Dict[str, datetime] = {}
+_stats = {"sent": 0, "received": 0, "polls": 0, "errors": 0}
+
+
+def register_invalidator(invalidate: Callable[[str], None]):
+    """Add a per-process cache to drop a user's entries from when any process invalidates them"""
+    _invalidators.append(invalidate)
+
+
+def _invalidate_locally(user_id: str):
+    for invalidate in _invalidators:
+        invalidate(user_id)
+
+
+async def broadcast_invalidation(user_id: str):
+    """Drop a user's cached data here now and in every other process on its next poll"""
+    _invalidate_locally(user_id)
+    db = init_db()
+    await db.cache_invalidations.update_one(
+        {"_id": user_id},
+        {
+            "$currentDate": {"at": True},
+            "$set": {
+                "origin": PROCESS_ID,
+                "expires_at": datetime.utcnow() + timedelta(seconds=CACHE_BROADCAST_RETENTION),
+            },
+        },
+        upsert=True
+    )
+    _stats["sent"] += 1
+
+
+async def poll_invalidations() -> int:
+    """Apply invalidations other processes stamped since the last poll; returns how many"""
+    global _since
+    db = init_db()
+    _stats["polls"] += 1
+    if _since is None:
+        # A new process has nothing cached yet; start from the newest stamp
+        latest = await db.cache_invalidations.find_one({}, {"at": 1}, sort=[("at", -1)])
+        _since = latest["at"] if latest else datetime.utcnow()
+        return 0
+
+    applied = 0
+    window_start = _since - timedelta(seconds=CACHE_BROADCAST_OVERLAP)
+    async for stamp in db.cache_invalidations.find({"at": {"$gt": window_start}}, {"at": 1, "origin": 1}):
+        _since = max(_since, stamp["at"])
+        if _applied.get(stamp["_id"]) == stamp["at"]:
+            continue
+        _applied[stamp["_id"]] = stamp["at"]
+        if stamp.get("origin") == PROCESS_ID:
+            continue
+        _invalidate_locally(stamp["_id"])
+        applied += 1
+
+    for user_id in [user_id for user_id, at in _applied.items() if at <= window_start]:
+        del _applied[user_id]
+    _stats["received"] += applied
+    return applied
+
+
+async def _run():
+    while True:
+        try:
+            await poll_invalidations()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning(f"Cache invalidation poll failed: {str(e)}")
+        await asyncio.sleep(CACHE_BROADCAST_INTERVAL)
+
+
+def start_cache_broadcast():
+    """Start polling for invalidations (FastAPI startup hook, worker start)"""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_run())
+
+
+async def stop_cache_broadcast():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def get_cache_broadcast_metrics() -> Dict:
+    return {**_stats, "tracked": len(_applied)}
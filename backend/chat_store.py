@@ -0,0 +1,196 @@
+"""
+Bucketed chat message storage
+Session metadata stays in chat_sessions; messages live in fixed-size buckets in
+chat_message_buckets, addressed by a per-session sequence number, so each turn
+writes O(1) data and history reads touch only the buckets they return
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database import init_db
+
+CHAT_BUCKET_SIZE = int(os.environ.get('CHAT_BUCKET_SIZE', '50'))
+CHAT_HISTORY_DEFAULT_LIMIT = 50
+CHAT_HISTORY_MAX_LIMIT = 200
+
+
+def _bucket_of(seq: int) -> int:
+    return seq // CHAT_BUCKET_SIZE
+
+
+async def _write_to_buckets(db, user_id: str, session_id: str, messages: List[Dict]):
+    """Push sequenced messages into their buckets (one upsert per bucket touched)"""
+    by_bucket: Dict[int, List[Dict]] = {}
+    for msg in messages:
+        by_bucket.setdefault(_bucket_of(msg["seq"]), []).append(msg)
+
+    now = datetime.utcnow()
+    for bucket, bucket_messages in by_bucket.items():
+        await db.chat_message_buckets.update_one(
+            {"user_id": user_id, "session_id": session_id, "bucket": bucket},
+            {
+                "$push": {"messages": {"$each": bucket_messages}},
+                "$inc": {"count": len(bucket_messages)},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        )
+
+
+async def migrate_legacy_session(user_id: str, session_id: str) -> int:
+    """Move a pre-bucket session's embedded messages array into buckets
+
+    Buckets are written first, keyed by sequence number so a retried or concurrent
+    migration rewrites the same messages; only then are the array removed and
+    message_count set. Appends refuse sessions that still hold the array, so no new
+    message can take a sequence number before the migrated ones.
+    """
+    db = init_db()
+    legacy = await db.chat_sessions.find_one(
+        {"user_id": user_id, "session_id": session_id, "messages": {"$exists": True}},
+        {"messages": 1, "message_count": 1}
+    )
+    if not legacy:
+        return 0
+
+    first_seq = legacy.get("message_count", 0)
+    messages = [
+        {"seq": first_seq + i, "sender": msg["sender"], "message": msg["message"], "timestamp": msg["timestamp"]}
+        for i, msg in enumerate(legacy.get("messages") or [])
+    ]
+
+    by_bucket: Dict[int, List[Dict]] = {}
+    for msg in messages:
+        by_bucket.setdefault(_bucket_of(msg["seq"]), []).append(msg)
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "session_id": session_id, "bucket": bucket},
+            [
+                {"$set": {"messages": {"$concatArrays": [
+                    {"$filter": {
+                        "input": {"$ifNull": ["$messages", []]},
+                        "cond": {"$not": [{"$in": ["$$this.seq", [msg["seq"] for msg in bucket_messages]]}]}
+                    }},
+                    {"$literal": bucket_messages}
+                ]}}},
+                {"$set": {
+                    "count": {"$size": "$messages"},
+                    "updated_at": now,
+                    "created_at": {"$ifNull": ["$created_at", now]}
+                }}
+            ],
+            upsert=True
+        )
+        for bucket, bucket_messages in by_bucket.items()
+    ]
+    if operations:
+        await db.chat_message_buckets.bulk_write(operations, ordered=False)
+
+    await db.chat_sessions.update_one(
+        {"user_id": user_id, "session_id": session_id, "messages": {"$exists": True}},
+        {"$set": {"message_count": first_seq + len(messages)}, "$unset": {"messages": ""}}
+    )
+    return len(messages)
+
+
+async def append_messages(user_id: str, session_id: str, messages: List[Dict]) -> List[Dict]:
+    """Append messages to a session, returning them with their assigned sequence numbers"""
+    db = init_db()
+    now = datetime.utcnow()
+    while True:
+        # Bucketed sessions take their sequence numbers in one round trip; a legacy
+        # session (still holding its messages array) or a new one misses the filter
+        session = await db.chat_sessions.find_one_and_update(
+            {"user_id": user_id, "session_id": session_id, "messages": {"$exists": False}},
+            {"$inc": {"message_count": len(messages)}, "$set": {"updated_at": now}},
+            projection={"message_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if session is not None:
+            break
+
+        existing = await db.chat_sessions.find_one(
+            {"user_id": user_id, "session_id": session_id},
+            {"_id": 1, "messages": {"$slice": 0}}
+        )
+        if existing is not None:
+            if "messages" in existing:
+                await migrate_legacy_session(user_id, session_id)
+            continue
+        try:
+            await db.chat_sessions.insert_one({
+                "user_id": user_id,
+                "session_id": session_id,
+                "message_count": len(messages),
+                "created_at": now,
+                "updated_at": now
+            })
+        except DuplicateKeyError:
+            # Created concurrently: append to it
+            continue
+        session = {"message_count": len(messages)}
+        break
+
+    first_seq = session["message_count"] - len(messages)
+    sequenced = [{**msg, "seq": first_seq + i} for i, msg in enumerate(messages)]
+    await _write_to_buckets(db, user_id, session_id, sequenced)
+    return sequenced
+
+
+async def get_messages(
+    user_id: str,
+    session_id: str,
+    before: Optional[int] = None,
+    limit: int = CHAT_HISTORY_DEFAULT_LIMIT
+) -> Tuple[List[Dict], Optional[int]]:
+    """Load up to `limit` messages older than sequence `before` (newest page when omitted)
+
+    Returns the messages oldest-first and the cursor for the next older page, or None
+    when the start of the session has been reached.
+    """
+    db = init_db()
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_LIMIT))
+    if before is None:
+        # The empty slice only says whether a legacy messages array is still present
+        session = await db.chat_sessions.find_one(
+            {"user_id": user_id, "session_id": session_id},
+            {"message_count": 1, "messages": {"$slice": 0}}
+        )
+        if not session:
+            return [], None
+        if "messages" in session:
+            await migrate_legacy_session(user_id, session_id)
+            session = await db.chat_sessions.find_one(
+                {"user_id": user_id, "session_id": session_id},
+                {"message_count": 1}
+            )
+        before = session.get("message_count", 0)
+
+    if before <= 0:
+        return [], None
+
+    newest_bucket = _bucket_of(before - 1)
+    oldest_bucket = _bucket_of(max(0, before - limit))
+    cursor = db.chat_message_buckets.find(
+        {
+            "user_id": user_id,
+            "session_id": session_id,
+            "bucket": {"$gte": oldest_bucket, "$lte": newest_bucket}
+        },
+        {"messages": 1}
+    )
+
+    messages = []
+    async for bucket in cursor:
+        messages.extend(msg for msg in bucket.get("messages", []) if msg["seq"] < before)
+    messages.sort(key=lambda msg: msg["seq"])
+    messages = messages[-limit:]
+
+    next_before = messages[0]["seq"] if messages and messages[0]["seq"] > 0 else None
+    return messages, next_before
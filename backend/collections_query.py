@@ -0,0 +1,309 @@
+"""
+Paginated collections queries
+Pages of unpaid and overdue invoices filtered by customer and minimum balance and
+sorted by balance, days overdue or due date, with opaque keyset cursors. Served by
+indexed queries on the local mirror when it is fresh, otherwise from an in-memory
+invoice snapshot kept per tenant for COLLECTIONS_SNAPSHOT_TTL; either way a response
+holds at most `limit` invoices per list, while the totals cover the whole filtered set.
+
+Both backends order missing sort values (no due date) the way Mongo does: before
+every value ascending, after every value descending.
+"""
+
+import base64
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_broadcast import register_invalidator
+from invoice_snapshot import InvoiceSnapshot, invoice_balance, is_overdue
+from models import CollectionsData, InvoiceItem
+from zoho_api_helper import get_mirror_integration, iter_invoices
+from singleflight import SingleFlight
+from zoho_mirror import UNPAID_INVOICE_FILTER, mirror_collection, overdue_invoice_expr, overdue_invoice_filter
+
+COLLECTIONS_DEFAULT_LIMIT = 50
+COLLECTIONS_MAX_LIMIT = 200
+# Without a fresh mirror, one pull of a tenant's unpaid invoices serves its pages for
+# this long (seconds); at most COLLECTIONS_SNAPSHOT_TENANTS snapshots are kept
+COLLECTIONS_SNAPSHOT_TTL = float(os.environ.get('COLLECTIONS_SNAPSHOT_TTL', '60'))
+COLLECTIONS_SNAPSHOT_TENANTS = int(os.environ.get('COLLECTIONS_SNAPSHOT_TENANTS', '256'))
+
+# sort name -> (invoice field, default order); most overdue first means earliest due date first
+COLLECTION_SORTS = {
+    "balance": ("balance", "desc"),
+    "days_overdue": ("due_date", "asc"),
+    "due_date": ("due_date", "asc"),
+}
+
+INVOICE_FIELDS = {
+    "_id": 0, "zoho_id": 1, "invoice_id": 1, "invoice_number": 1, "customer_id": 1,
+    "customer_name": 1, "total": 1, "balance": 1, "due_date": 1, "status": 1,
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value: Any, invoice_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, invoice_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, invoice_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return value, str(invoice_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def days_overdue(due_date: str, clamp: bool) -> Optional[int]:
+    if not due_date:
+        return None
+    try:
+        due = datetime.fromisoformat(due_date.replace('Z', '+00:00'))
+        if clamp and due >= datetime.utcnow():
+            return 0
+        return (datetime.utcnow() - due).days
+    except (ValueError, TypeError):
+        return None
+
+
+def invoice_item(inv: Dict, status: str, clamp: bool) -> InvoiceItem:
+    due_date = inv.get('due_date', '')
+    return InvoiceItem(
+        id=inv.get('invoice_id', ''),
+        invoice_number=inv.get('invoice_number', 'N/A'),
+        customer_name=inv.get('customer_name', 'Unknown'),
+        amount=float(inv.get('total', 0)),
+        balance=float(inv.get('balance', 0)),
+        due_date=due_date,
+        status=status,
+        days_overdue=days_overdue(due_date, clamp)
+    )
+
+
+def _sort_value(inv: Dict, field: str):
+    """The value a row is ordered and paged by; None when the field is missing or null"""
+    return invoice_balance(inv) if field == "balance" else inv.get(field)
+
+
+def _order_key(value: Any, invoice_id: str) -> Tuple:
+    # Missing values sort first, as null does in Mongo
+    return ((0,) if value is None else (1, value), invoice_id)
+
+
+class CollectionsQuery:
+    """Validated list parameters shared by the mirror and snapshot backends"""
+
+    def __init__(
+        self,
+        limit: int = COLLECTIONS_DEFAULT_LIMIT,
+        sort: str = "balance",
+        order: Optional[str] = None,
+        customer: Optional[str] = None,
+        min_balance: Optional[float] = None,
+        cursor: Optional[str] = None,
+        overdue_cursor: Optional[str] = None,
+    ):
+        self.limit = max(1, min(limit, COLLECTIONS_MAX_LIMIT))
+        self.field, default_order = COLLECTION_SORTS[sort]
+        self.descending = (order or default_order) == "desc"
+        self.customer = customer.strip() if customer and customer.strip() else None
+        self.min_balance = min_balance
+        self.cursors = {
+            "unpaid": self._cursor(cursor),
+            "overdue": self._cursor(overdue_cursor),
+        }
+
+    def _cursor(self, cursor: Optional[str]) -> Optional[Tuple[Any, str]]:
+        if not cursor:
+            return None
+        value, invoice_id = decode_cursor(cursor)
+        # A cursor from a different sort would compare values of another type
+        expected = (int, float) if self.field == "balance" else (str, type(None))
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise InvalidCursor("Cursor does not belong to this sort")
+        return value, invoice_id
+
+    # Snapshot backend
+
+    def matches(self, inv: Dict) -> bool:
+        if self.min_balance is not None and invoice_balance(inv) < self.min_balance:
+            return False
+        if self.customer:
+            name = (inv.get("customer_name") or "").lower()
+            if inv.get("customer_id") != self.customer and not name.startswith(self.customer.lower()):
+                return False
+        return True
+
+    def sort_key(self, inv: Dict) -> Tuple:
+        return _order_key(_sort_value(inv, self.field), inv.get("invoice_id", ""))
+
+    def page(self, ordered: List[Dict], which: str) -> Tuple[List[Dict], Optional[str]]:
+        """One page of invoices already sorted by sort_key in this query's order"""
+        after = self.cursors[which]
+        if after is not None:
+            after = _order_key(*after)
+            ordered = [inv for inv in ordered if (self.sort_key(inv) < after if self.descending else self.sort_key(inv) > after)]
+        return self._finish(ordered[:self.limit + 1], lambda inv: (_sort_value(inv, self.field), inv.get("invoice_id", "")))
+
+    # Mirror backend
+
+    def mongo_filter(self, base: Dict) -> Dict:
+        query = dict(base)
+        if self.min_balance is not None:
+            query["balance"] = {**query.get("balance", {}), "$gte": self.min_balance}
+        if self.customer:
+            customer = {"$or": [
+                {"customer_id": self.customer},
+                {"customer_name": {"$regex": f"^{re.escape(self.customer)}", "$options": "i"}},
+            ]}
+            # The overdue filter carries its own $or
+            query = {"$and": [query, customer]} if "$or" in query else {**query, **customer}
+        return query
+
+    async def mongo_page(self, query: Dict, which: str) -> Tuple[List[Dict], Optional[str]]:
+        direction = -1 if self.descending else 1
+        after = self.cursors[which]
+        if after is not None:
+            value, last_id = after
+            op = "$lt" if self.descending else "$gt"
+            if value is None:
+                # Rows without the field come first ascending and last descending
+                after_rows = [{self.field: None, "zoho_id": {op: last_id}}]
+                if not self.descending:
+                    after_rows.append({self.field: {"$ne": None}})
+            else:
+                after_rows = [{self.field: {op: value}}, {self.field: value, "zoho_id": {op: last_id}}]
+                if self.descending:
+                    after_rows.append({self.field: None})
+            query = {"$and": [query, {"$or": after_rows}]}
+        cursor = mirror_collection("invoices").find(query, INVOICE_FIELDS)
+        cursor = cursor.sort([(self.field, direction), ("zoho_id", direction)]).limit(self.limit + 1)
+        rows = await cursor.to_list(length=self.limit + 1)
+        return self._finish(rows, lambda inv: (_sort_value(inv, self.field), inv.get("zoho_id") or inv.get("invoice_id", "")))
+
+    def _finish(self, rows: List[Dict], key) -> Tuple[List[Dict], Optional[str]]:
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        return rows, encode_cursor(*key(rows[-1]))
+
+
+def _collections_data(unpaid_page, overdue_page, totals: Dict, refreshed_at: Optional[datetime]) -> CollectionsData:
+    (unpaid, next_cursor), (overdue, next_overdue_cursor) = unpaid_page, overdue_page
+    return CollectionsData(
+        unpaid_invoices=[invoice_item(inv, inv.get('status', 'unpaid'), clamp=True) for inv in unpaid],
+        overdue_invoices=[invoice_item(inv, 'overdue', clamp=False) for inv in overdue],
+        total_unpaid=totals["unpaid_total"],
+        total_overdue=totals["overdue_total"],
+        unpaid_count=totals["unpaid_count"],
+        overdue_count=totals["overdue_count"],
+        next_cursor=next_cursor,
+        next_overdue_cursor=next_overdue_cursor,
+        refreshed_at=refreshed_at
+    )
+
+
+async def _from_mirror(user_id: str, integration: Dict, params: CollectionsQuery) -> CollectionsData:
+    tenant = {"user_id": user_id, "organization_id": integration.get("organization_id")}
+    unpaid_query = params.mongo_filter({**tenant, **UNPAID_INVOICE_FILTER})
+    # Overdue by due date as well as by status, which only changes in the mirror on a sync
+    overdue_query = params.mongo_filter({**tenant, **overdue_invoice_filter()})
+
+    totals = {"unpaid_total": 0.0, "unpaid_count": 0, "overdue_total": 0.0, "overdue_count": 0}
+    is_overdue = overdue_invoice_expr()
+    async for row in mirror_collection("invoices").aggregate([
+        {"$match": unpaid_query},
+        {"$group": {
+            "_id": None,
+            "unpaid_total": {"$sum": "$balance"},
+            "unpaid_count": {"$sum": 1},
+            "overdue_total": {"$sum": {"$cond": [is_overdue, "$balance", 0]}},
+            "overdue_count": {"$sum": {"$cond": [is_overdue, 1, 0]}},
+        }},
+    ]):
+        totals.update({k: v for k, v in row.items() if k != "_id"})
+
+    return _collections_data(
+        await params.mongo_page(unpaid_query, "unpaid"),
+        await params.mongo_page(overdue_query, "overdue"),
+        totals,
+        integration.get("mirror_synced_at")
+    )
+
+
+class _SnapshotEntry:
+    """A tenant's unpaid invoices with each sort order computed once"""
+
+    def __init__(self, snapshot: InvoiceSnapshot):
+        self.snapshot = snapshot
+        self.loaded_at = time.monotonic()
+        self._orders: Dict[Tuple[str, bool], List[Dict]] = {}
+
+    def ordered(self, params: CollectionsQuery) -> List[Dict]:
+        order = (params.field, params.descending)
+        if order not in self._orders:
+            self._orders[order] = sorted(self.snapshot.unpaid(), key=params.sort_key, reverse=params.descending)
+        return self._orders[order]
+
+
+_snapshots: "OrderedDict[str, _SnapshotEntry]" = OrderedDict()
+_snapshot_loads = SingleFlight()
+
+
+def invalidate_collections_snapshot(user_id: str):
+    _snapshots.pop(user_id, None)
+
+
+register_invalidator(invalidate_collections_snapshot)
+
+
+async def _unpaid_snapshot(user_id: str, refresh: bool) -> _SnapshotEntry:
+    entry = _snapshots.get(user_id)
+    if entry is not None and not refresh and time.monotonic() - entry.loaded_at < COLLECTIONS_SNAPSHOT_TTL:
+        _snapshots.move_to_end(user_id)
+        return entry
+
+    async def load() -> _SnapshotEntry:
+        entry = _SnapshotEntry(InvoiceSnapshot(
+            [inv async for inv in iter_invoices(user_id, status="unpaid", raise_errors=True, use_cache=not refresh)],
+            status="unpaid"
+        ))
+        _snapshots[user_id] = entry
+        _snapshots.move_to_end(user_id)
+        while len(_snapshots) > COLLECTIONS_SNAPSHOT_TENANTS:
+            _snapshots.popitem(last=False)
+        return entry
+
+    return await _snapshot_loads.do((user_id, refresh), load)
+
+
+async def _from_snapshot(user_id: str, params: CollectionsQuery, refresh: bool) -> CollectionsData:
+    entry = await _unpaid_snapshot(user_id, refresh)
+    snapshot = entry.snapshot
+    unpaid = [inv for inv in entry.ordered(params) if params.matches(inv)]
+    today = datetime.utcnow().date()
+    overdue = [inv for inv in unpaid if is_overdue(inv, today)]
+    totals = {
+        "unpaid_total": snapshot.total_balance(unpaid),
+        "unpaid_count": len(unpaid),
+        "overdue_total": snapshot.total_balance(overdue),
+        "overdue_count": len(overdue),
+    }
+    return _collections_data(params.page(unpaid, "unpaid"), params.page(overdue, "overdue"), totals, snapshot.loaded_at)
+
+
+async def query_collections(user_id: str, params: CollectionsQuery, refresh: bool = False) -> CollectionsData:
+    """One page of collections for a production integration (raises ZohoAPIError when Zoho fails)"""
+    integration = None if refresh else await get_mirror_integration(user_id)
+    if integration:
+        return await _from_mirror(user_id, integration, params)
+    return await _from_snapshot(user_id, params, refresh)
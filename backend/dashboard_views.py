@@ -0,0 +1,302 @@
+"""
+Materialized dashboard views
+Each dashboard tab's response is built from Zoho data once and stored per tenant in
+dashboard_views, keyed by (user_id, view), so a dashboard read is one indexed
+document fetch. Views are rebuilt after mirror syncs, on ?refresh=true, and in the
+background once they are older than DASHBOARD_VIEW_MAX_AGE. Collections are
+paginated queries instead (see collections_query).
+
+Zoho webhooks bump a view's version; a view built from an older version is stale.
+Tenants whose changes arrive by webhook keep their views for
+DASHBOARD_VIEW_PUSH_MAX_AGE instead, since polling is only a safety net for them.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Union
+
+from pydantic import BaseModel
+
+from analytics_engine import compute_analytics
+from database import init_db
+from dso_engine import apply_payments, get_dso_summary
+from models import (
+    DashboardAnalytics, ActivityItem,
+    AnalyticsData, MonthlyMetric, AgingBucket, CustomerCollectionTime,
+    ReconciliationData, ReconciliationItem
+)
+from reconciliation_engine import get_reconciliation_summary
+from singleflight import SingleFlight
+from zoho_api_helper import (
+    get_dashboard_summary, get_user_zoho_credentials,
+    get_invoices, get_payments,
+    fetch_concurrently, FanOutResult, ZohoAPIError, ZOHO_LEDGER_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Views older than this are served once more while a rebuild runs in the background (seconds)
+DASHBOARD_VIEW_MAX_AGE = int(os.environ.get('DASHBOARD_VIEW_MAX_AGE', '900'))
+# Same, for tenants receiving Zoho webhooks (seconds)
+DASHBOARD_VIEW_PUSH_MAX_AGE = int(os.environ.get('DASHBOARD_VIEW_PUSH_MAX_AGE', '21600'))
+
+_builds = SingleFlight()
+
+
+def raise_if_all_failed(fetched: FanOutResult):
+    """Surface a Zoho outage as an error naming the failed fetches instead of an empty view"""
+    if fetched.all_failed:
+        raise ZohoAPIError("dashboard", f"All Zoho fetches failed: {', '.join(fetched.failed_sources)}")
+
+
+async def build_analytics(user_id: str, integration: Dict) -> DashboardAnalytics:
+    zoho_data = await get_dashboard_summary(user_id)
+
+    # Convert to dashboard format
+    activities = []
+    for idx, payment in enumerate(zoho_data.get("recent_payments", [])):
+        activities.append(ActivityItem(
+            id=str(idx),
+            title=f"Payment received - {payment.get('payment_number', 'N/A')}",
+            description=payment.get('customer_name', 'Customer'),
+            timestamp=datetime.fromisoformat(payment.get('date', datetime.utcnow().isoformat())),
+            amount=float(payment.get('amount', 0))
+        ))
+
+    # Add overdue invoice notifications
+    for idx, invoice in enumerate(zoho_data.get("top_overdue_invoices", [])[:3]):
+        activities.append(ActivityItem(
+            id=f"overdue_{idx}",
+            title=f"Overdue Invoice - {invoice.get('invoice_number', 'N/A')}",
+            description=f"{invoice.get('customer_name', 'Customer')} - {invoice.get('due_date', 'N/A')}",
+            timestamp=datetime.fromisoformat(invoice.get('due_date', datetime.utcnow().isoformat())),
+            amount=float(invoice.get('balance', 0))
+        ))
+
+    # Calculate recovery rate
+    total_invoices = zoho_data.get("total_invoices", 1)
+    overdue_invoices = zoho_data.get("overdue_invoices", 0)
+    recovery_rate = ((total_invoices - overdue_invoices) / total_invoices * 100) if total_invoices > 0 else 0
+
+    return DashboardAnalytics(
+        total_outstanding=zoho_data.get("total_outstanding", 0),
+        recovery_rate=round(recovery_rate, 1),
+        active_accounts=total_invoices,
+        recent_activity=activities[:10],
+        failed_sources=zoho_data.get("failed_sources", [])
+    )
+
+
+async def build_analytics_trends(user_id: str, integration: Dict) -> AnalyticsData:
+    # Pull each ledger once; all aggregation happens on columnar frames
+    fetched = await fetch_concurrently({
+        "payments": get_payments(user_id, raise_errors=True, all_pages=True),
+        "invoices": get_invoices(user_id, raise_errors=True, all_pages=True),
+    }, timeout=ZOHO_LEDGER_TIMEOUT)
+    raise_if_all_failed(fetched)
+    invoices = fetched.get("invoices", [])
+    payments = fetched.get("payments", [])
+    analytics = await asyncio.to_thread(compute_analytics, invoices, payments)
+
+    # Days-to-pay statistics are kept up to date by mirror syncs; the first
+    # build for a tenant seeds them from the ledgers just fetched
+    organization_id = integration.get("organization_id")
+    dso = await get_dso_summary(user_id, organization_id)
+    if dso is None and "invoices" in fetched.results and payments:
+        await apply_payments(user_id, organization_id, payments, invoices)
+        dso = await get_dso_summary(user_id, organization_id)
+
+    return AnalyticsData(
+        monthly_trends=[MonthlyMetric(**m) for m in analytics["monthly_trends"]],
+        total_collected=analytics["total_collected"],
+        total_outstanding=analytics["total_outstanding"],
+        collection_efficiency=analytics["collection_efficiency"],
+        average_collection_time=round(dso["weighted_dso"] or 0) if dso else 0,
+        median_collection_time=dso["median_days"] if dso else None,
+        customer_collection_times=[
+            CustomerCollectionTime(**c) for c in (dso["customers"] if dso else [])
+        ],
+        aging_buckets=[AgingBucket(**b) for b in analytics["aging_buckets"]],
+        failed_sources=fetched.failed_sources
+    )
+
+
+def _statement_item(line: Dict) -> ReconciliationItem:
+    match = line.get("match") or {}
+    return ReconciliationItem(
+        id=line["line_id"],
+        date=line.get("date", ''),
+        description=line.get("description") or line.get("counterparty") or "Bank credit",
+        amount=float(line.get("amount", 0)),
+        status=line["status"],
+        invoice_ref=match.get("ref"),
+        match_method=match.get("method")
+    )
+
+
+async def build_reconciliation(user_id: str, integration: Dict) -> ReconciliationData:
+    # Uploaded bank statements are matched by reconciliation_engine
+    summary = await get_reconciliation_summary(user_id)
+    if summary is not None:
+        return ReconciliationData(
+            matched_items=[_statement_item(line) for line in summary["matched"]],
+            unmatched_items=[_statement_item(line) for line in summary["unmatched"]],
+            total_matched=summary["total_matched"],
+            total_unmatched=summary["total_unmatched"]
+        )
+
+    # No statement uploaded yet: list recorded Zoho payments
+    fetched = await fetch_concurrently({
+        "payments": get_payments(user_id, raise_errors=True),
+    })
+    raise_if_all_failed(fetched)
+    payments = fetched.get("payments", [])
+
+    matched_items = []
+    unmatched_items = []
+
+    # For now, mark all payments as matched
+    for idx, payment in enumerate(payments):
+        matched_items.append(ReconciliationItem(
+            id=payment.get('payment_id', str(idx)),
+            date=payment.get('date', ''),
+            description=f"Payment from {payment.get('customer_name', 'Unknown')}",
+            amount=float(payment.get('amount', 0)),
+            status="matched",
+            invoice_ref=(payment.get('invoice_numbers') or '').split(',')[0].strip() or None
+        ))
+
+    return ReconciliationData(
+        matched_items=matched_items[:20],  # Limit to 20
+        unmatched_items=unmatched_items,
+        total_matched=sum(item.amount for item in matched_items),
+        total_unmatched=0
+    )
+
+
+# view name -> (response model, builder)
+VIEWS = {
+    "analytics": (DashboardAnalytics, build_analytics),
+    "analytics_trends": (AnalyticsData, build_analytics_trends),
+    "reconciliation": (ReconciliationData, build_reconciliation),
+}
+
+
+def view_max_age(integration: Dict) -> int:
+    if integration.get("webhook_received_at"):
+        return DASHBOARD_VIEW_PUSH_MAX_AGE
+    return DASHBOARD_VIEW_MAX_AGE
+
+
+async def refresh_view(user_id: str, view: str, integration: Optional[Dict] = None) -> BaseModel:
+    """Build a view from Zoho data and store it; partial builds are returned but not stored"""
+    model_cls, builder = VIEWS[view]
+    integration = integration or await get_user_zoho_credentials(user_id)
+    if not integration or integration.get("mode") != "production":
+        raise ZohoAPIError("dashboard", "No production Zoho Books integration")
+
+    # Changes reported while this build runs bump the version past built_version
+    db = init_db()
+    current = await db.dashboard_views.find_one({"user_id": user_id, "view": view}, {"version": 1})
+    built_version = (current or {}).get("version", 0)
+
+    data = await builder(user_id, integration)
+    data.refreshed_at = datetime.utcnow()
+    if not getattr(data, "failed_sources", None):
+        await db.dashboard_views.update_one(
+            {"user_id": user_id, "view": view},
+            {"$set": {
+                "organization_id": integration.get("organization_id"),
+                "data": data.model_dump(),
+                "refreshed_at": data.refreshed_at,
+                "built_version": built_version,
+                "max_age": view_max_age(integration),
+                "stale": False,
+            }},
+            upsert=True
+        )
+    return data
+
+
+def _refresh_in_background(user_id: str, view: str):
+    key = (user_id, view)
+    if key in _builds:
+        return
+
+    async def run():
+        try:
+            await refresh_view(user_id, view)
+        except Exception as e:
+            logger.error(f"Dashboard view {view} rebuild failed for user {user_id}: {str(e)}")
+
+    _builds.start(key, run)
+
+
+def _is_outdated(doc: Dict) -> bool:
+    """Zoho reported a change since the view was built"""
+    return bool(doc.get("stale")) or doc.get("version", 0) > doc.get("built_version", 0)
+
+
+def _is_expired(doc: Dict) -> bool:
+    return datetime.utcnow() - doc["refreshed_at"] > timedelta(seconds=doc.get("max_age", DASHBOARD_VIEW_MAX_AGE))
+
+
+async def get_view(
+    user_id: str,
+    view: str,
+    integration: Optional[Dict] = None,
+    refresh: bool = False,
+    validate: bool = True,
+) -> Union[BaseModel, Dict]:
+    """Read a materialized view, building it first when missing, outdated or when refresh is requested
+
+    A view built before a reported change is rebuilt before it is returned; one that
+    is merely past its max age is still returned (with its refreshed_at) while a
+    rebuild runs in the background. With validate=False a stored view is returned as
+    the dict it was dumped to from its validated model.
+    """
+    model_cls, _ = VIEWS[view]
+    if not refresh:
+        db = init_db()
+        doc = await db.dashboard_views.find_one({"user_id": user_id, "view": view}, {"_id": 0, "organization_id": 0})
+        if doc and _is_outdated(doc):
+            try:
+                return await _builds.do((user_id, view), lambda: refresh_view(user_id, view, integration))
+            except Exception as e:
+                # Zoho unavailable: the previous numbers beat an error page
+                logger.error(f"Dashboard view {view} rebuild failed for user {user_id}: {str(e)}")
+        elif doc and _is_expired(doc):
+            _refresh_in_background(user_id, view)
+        if doc:
+            return model_cls.model_validate(doc["data"]) if validate else doc["data"]
+
+    # Concurrent first loads and refreshes share one build
+    return await _builds.do((user_id, view), lambda: refresh_view(user_id, view, integration))
+
+
+async def refresh_all_views(user_id: str) -> Dict[str, bool]:
+    """Rebuild every view for a user (after a mirror sync); returns which ones succeeded"""
+    integration = await get_user_zoho_credentials(user_id)
+    outcome = {}
+    for view in VIEWS:
+        try:
+            await _builds.do((user_id, view), lambda view=view: refresh_view(user_id, view, integration))
+            outcome[view] = True
+        except Exception as e:
+            logger.error(f"Dashboard view {view} rebuild failed for user {user_id}: {str(e)}")
+            outcome[view] = False
+    return outcome
+
+
+async def mark_views_stale(user_id: str):
+    """Bump a user's view versions so their next read rebuilds them (Zoho data changed)"""
+    db = init_db()
+    await db.dashboard_views.update_many({"user_id": user_id}, {"$inc": {"version": 1}})
+
+
+async def clear_views(user_id: str):
+    """Drop a user's views (on disconnect)"""
+    db = init_db()
+    await db.dashboard_views.delete_many({"user_id": user_id})
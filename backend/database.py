@@ -1,15 +1,134 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from typing import Dict, Optional
 import os
+import threading
+import time
+
+# Connection pool settings (per process; multiply by uvicorn workers when sizing)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')  # e.g. "zstd,snappy,zlib"
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+
+# Checkout wait buckets (ms) for the pool metrics histogram
+CHECKOUT_WAIT_BUCKETS_MS = (1, 10, 100, 1000)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Collects connection checkout waits; pymongo emits these from its worker threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "checked_out": 0,
+            "connections_open": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+        self._wait_histogram = {f"<{bound}ms": 0 for bound in CHECKOUT_WAIT_BUCKETS_MS}
+        self._wait_histogram[f">={CHECKOUT_WAIT_BUCKETS_MS[-1]}ms"] = 0
+
+    def _record_wait(self) -> float:
+        started = getattr(self._local, "checkout_started", None)
+        self._local.checkout_started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = self._record_wait()
+        bucket = next((f"<{bound}ms" for bound in CHECKOUT_WAIT_BUCKETS_MS if wait_ms < bound),
+                      f">={CHECKOUT_WAIT_BUCKETS_MS[-1]}ms")
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["checked_out"] += 1
+            self._stats["total_wait_ms"] += wait_ms
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+            self._wait_histogram[bucket] += 1
+
+    def connection_check_out_failed(self, event):
+        self._record_wait()
+        with self._lock:
+            self._stats["checkout_failures"] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._stats["checked_out"] -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._stats["connections_open"] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._stats["connections_open"] -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            histogram = dict(self._wait_histogram)
+        checkouts = stats["checkouts"]
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / checkouts, 3) if checkouts else 0.0
+        stats["total_wait_ms"] = round(stats["total_wait_ms"], 3)
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 3)
+        stats["wait_histogram"] = histogram
+        return stats
+
+
+pool_metrics = PoolMetricsListener()
+
+# The one client per process; every module goes through init_db()/get_client()
+_client: Optional[AsyncIOMotorClient] = None
+
+
+def _client_options() -> Dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [pool_metrics],
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def get_client() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        mongo_url = os.environ.get('MONGO_URL')
+        if not mongo_url:
+            raise ValueError("MONGO_URL environment variable not set")
+        _client = AsyncIOMotorClient(mongo_url, **_client_options())
+    return _client
+
 
 # Get MongoDB connection
 def get_database():
-    mongo_url = os.environ.get('MONGO_URL')
-    if not mongo_url:
-        raise ValueError("MONGO_URL environment variable not set")
-    
-    client = AsyncIOMotorClient(mongo_url)
     db_name = os.environ.get('DB_NAME', 'vasool_db')
-    return client[db_name]
+    return get_client()[db_name]
 
 # Initialize database
 db = None
@@ -19,3 +138,21 @@ def init_db():
     if db is None:
         db = get_database()
     return db
+
+def close_db():
+    """Close the shared client (FastAPI shutdown hook)"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
+
+def get_pool_metrics() -> Dict:
+    return {
+        **pool_metrics.snapshot(),
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "wait_queue_timeout_ms": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS or None,
+        "read_preference": MONGO_READ_PREFERENCE,
+    }
@@ -0,0 +1,273 @@
+"""
+MongoDB index manager
+Declarative index specs per collection, applied idempotently on startup and
+from the command line:
+
+    python db_indexes.py diff
+    python db_indexes.py apply [--drop-extra]
+"""
+
+import asyncio
+import logging
+import sys
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# OAuth handshakes older than these are useless and are removed by Mongo's TTL monitor
+OAUTH_STATE_TTL_SECONDS = 60 * 10
+OAUTH_CREDENTIALS_TTL_SECONDS = 60 * 60
+# Applied webhook events are kept a week for debugging
+WEBHOOK_EVENT_TTL_SECONDS = 60 * 60 * 24 * 7
+# Finished jobs are kept a week as a run history
+JOB_HISTORY_TTL_SECONDS = 60 * 60 * 24 * 7
+# Finished sync runs and their tenant checkpoints are kept a month
+SYNC_RUN_TTL_SECONDS = 60 * 60 * 24 * 30
+
+
+def index(name: str, keys: List, **options) -> Dict:
+    return {"name": name, "keys": keys, "options": options}
+
+
+# collection -> indexes it must have (the default _id index is implicit)
+INDEX_SPECS: Dict[str, List[Dict]] = {
+    "users": [
+        index("email_unique", [("email", ASCENDING)], unique=True),
+    ],
+    "integrations": [
+        index("user_type_status", [("user_id", ASCENDING), ("type", ASCENDING), ("status", ASCENDING)]),
+        index("type_mode_status_token_expiry", [
+            ("type", ASCENDING), ("mode", ASCENDING), ("status", ASCENDING), ("token_expires_at", ASCENDING)
+        ]),
+    ],
+    "chat_sessions": [
+        index("user_session", [("user_id", ASCENDING), ("session_id", ASCENDING)], unique=True),
+    ],
+    "chat_message_buckets": [
+        index("session_bucket", [("user_id", ASCENDING), ("session_id", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "oauth_states": [
+        index("state", [("state", ASCENDING)]),
+        index("created_at_ttl", [("created_at", ASCENDING)], expireAfterSeconds=OAUTH_STATE_TTL_SECONDS),
+    ],
+    "user_oauth_credentials": [
+        index("user_state", [("user_id", ASCENDING), ("state", ASCENDING)]),
+        index("created_at_ttl", [("created_at", ASCENDING)], expireAfterSeconds=OAUTH_CREDENTIALS_TTL_SECONDS),
+    ],
+    "zoho_invoices": [
+        index("tenant_zoho_id", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("zoho_id", ASCENDING)], unique=True),
+        index("tenant_date", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("date", DESCENDING), ("zoho_id", DESCENDING)]),
+        index("tenant_status_balance", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("status", ASCENDING), ("balance", DESCENDING)]),
+        # Collections pages: keyset on (sort field, zoho_id)
+        index("tenant_balance_page", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("balance", DESCENDING), ("zoho_id", DESCENDING)]),
+        index("tenant_due_date_page", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("due_date", ASCENDING), ("zoho_id", ASCENDING)]),
+        index("tenant_status_due_date_page", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("status", ASCENDING), ("due_date", ASCENDING), ("zoho_id", ASCENDING)]),
+        index("tenant_synced_at", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("synced_at", ASCENDING)]),
+    ],
+    "zoho_payments": [
+        index("tenant_zoho_id", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("zoho_id", ASCENDING)], unique=True),
+        index("tenant_date", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("date", DESCENDING), ("zoho_id", DESCENDING)]),
+        index("tenant_synced_at", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("synced_at", ASCENDING)]),
+    ],
+    "zoho_contacts": [
+        index("tenant_zoho_id", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("zoho_id", ASCENDING)], unique=True),
+        index("tenant_name", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("contact_name", ASCENDING), ("zoho_id", ASCENDING)]),
+        index("tenant_synced_at", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("synced_at", ASCENDING)]),
+    ],
+    "dashboard_views": [
+        index("user_view", [("user_id", ASCENDING), ("view", ASCENDING)], unique=True),
+    ],
+    "bank_statements": [
+        index("user_uploaded_at", [("user_id", ASCENDING), ("uploaded_at", DESCENDING)]),
+    ],
+    "bank_statement_lines": [
+        index("user_line", [("user_id", ASCENDING), ("line_id", ASCENDING)], unique=True),
+        index("user_status_date", [("user_id", ASCENDING), ("status", ASCENDING), ("date", DESCENDING), ("line_id", ASCENDING)]),
+    ],
+    "zoho_webhook_events": [
+        index("user_pending", [("user_id", ASCENDING), ("processed_at", ASCENDING), ("received_at", ASCENDING)]),
+        index("processed_at_ttl", [("processed_at", ASCENDING)], expireAfterSeconds=WEBHOOK_EVENT_TTL_SECONDS),
+    ],
+    "jobs": [
+        index("claim", [("status", ASCENDING), ("priority", DESCENDING), ("run_at", ASCENDING)]),
+        index("lease", [("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+        index("queued_key_unique", [("queued_key", ASCENDING)], unique=True,
+              partialFilterExpression={"queued_key": {"$type": "string"}}),
+        index("finished_at_ttl", [("finished_at", ASCENDING)], expireAfterSeconds=JOB_HISTORY_TTL_SECONDS),
+    ],
+    "job_schedules": [
+        index("name_unique", [("name", ASCENDING)], unique=True),
+        index("next_run_at", [("next_run_at", ASCENDING)]),
+    ],
+    "sync_runs": [
+        index("started_at", [("started_at", DESCENDING)]),
+        index("job_id", [("job_id", ASCENDING)], sparse=True),
+        index("finished_at_ttl", [("finished_at", ASCENDING)], expireAfterSeconds=SYNC_RUN_TTL_SECONDS),
+    ],
+    "sync_run_tenants": [
+        index("run_status_attempts", [("run_id", ASCENDING), ("status", ASCENDING), ("attempts", ASCENDING)]),
+        # Tenant rows carry their own finished_at per attempt, so they expire with the run
+        index("run_finished_at_ttl", [("run_finished_at", ASCENDING)], expireAfterSeconds=SYNC_RUN_TTL_SECONDS),
+    ],
+    "cache_invalidations": [
+        index("at", [("at", ASCENDING)]),
+        index("expires_at_ttl", [("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "zoho_rate_windows": [
+        # Minute and day windows carry the time they stop mattering
+        index("expires_at_ttl", [("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "dso_stats": [
+        index("tenant", [("user_id", ASCENDING), ("organization_id", ASCENDING)], unique=True),
+    ],
+    "dso_contributions": [
+        index("tenant_payment", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("payment_id", ASCENDING)], unique=True),
+        index("tenant_seen_at", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("seen_at", ASCENDING)]),
+        # Contributions changed but not yet folded into dso_stats
+        index("tenant_pending", [("user_id", ASCENDING), ("organization_id", ASCENDING), ("pending.batch", ASCENDING)],
+              partialFilterExpression={"pending": {"$exists": True}}),
+    ],
+}
+
+# Unique indexes that writes rely on for correctness (upserts and leases that must
+# collide instead of creating a second document): startup refuses to run without them
+REQUIRED_INDEXES = {
+    "chat_sessions": ["user_session"],
+    "chat_message_buckets": ["session_bucket"],
+    "jobs": ["queued_key_unique"],
+    "job_schedules": ["name_unique"],
+    "dso_stats": ["tenant"],
+    "dso_contributions": ["tenant_payment"],
+}
+
+# Options compared when deciding whether an existing index matches its spec
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+def _normalize_keys(keys) -> List:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+def _matches(spec: Dict, existing: Dict) -> bool:
+    if _normalize_keys(spec["keys"]) != _normalize_keys(existing.get("key", [])):
+        return False
+    for option in COMPARED_OPTIONS:
+        if spec["options"].get(option) != existing.get(option):
+            # Mongo reports unique/sparse only when true
+            if option in ("unique", "sparse") and not spec["options"].get(option) and not existing.get(option):
+                continue
+            return False
+    return True
+
+
+async def diff_indexes(db) -> Dict[str, Dict[str, List[str]]]:
+    """Compare INDEX_SPECS against the database
+
+    Returns {collection: {"missing": [...], "changed": [...], "extra": [...]}} for
+    collections that are out of date.
+    """
+    report = {}
+    for collection, specs in INDEX_SPECS.items():
+        existing = await db[collection].index_information()
+        missing, changed = [], []
+        for spec in specs:
+            current = existing.get(spec["name"])
+            if current is None:
+                missing.append(spec["name"])
+            elif not _matches(spec, current):
+                changed.append(spec["name"])
+
+        wanted = {spec["name"] for spec in specs} | {"_id_"}
+        extra = sorted(name for name in existing if name not in wanted)
+
+        if missing or changed or extra:
+            report[collection] = {"missing": missing, "changed": changed, "extra": extra}
+    return report
+
+
+async def apply_indexes(db, drop_extra: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """Bring the database in line with INDEX_SPECS; safe to run repeatedly"""
+    report = await diff_indexes(db)
+    for collection, changes in report.items():
+        specs = {spec["name"]: spec for spec in INDEX_SPECS[collection]}
+
+        # Changed indexes are rebuilt under the same name
+        for name in changes["changed"]:
+            await db[collection].drop_index(name)
+        if drop_extra:
+            for name in changes["extra"]:
+                await db[collection].drop_index(name)
+
+        to_create = [
+            IndexModel(specs[name]["keys"], name=name, **specs[name]["options"])
+            for name in changes["missing"] + changes["changed"]
+        ]
+        if to_create:
+            await db[collection].create_indexes(to_create)
+            logger.info(f"Created indexes on {collection}: {', '.join(m.document['name'] for m in to_create)}")
+    return report
+
+
+async def ensure_indexes(db):
+    """Startup hook: create missing indexes without failing app startup"""
+    try:
+        await apply_indexes(db)
+    except Exception as e:
+        logger.error(f"Index bootstrap failed: {str(e)}")
+
+
+async def verify_required_indexes(db):
+    """Raise when an index listed in REQUIRED_INDEXES is missing or differs from its spec"""
+    problems = []
+    for collection, names in REQUIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        specs = {spec["name"]: spec for spec in INDEX_SPECS[collection]}
+        for name in names:
+            current = existing.get(name)
+            if current is None:
+                problems.append(f"{collection}.{name} is missing")
+            elif not _matches(specs[name], current):
+                problems.append(f"{collection}.{name} differs from its spec")
+    if problems:
+        raise RuntimeError(f"Required indexes are not in place ({'; '.join(problems)}); run python db_indexes.py apply")
+
+
+def _print_report(report: Dict, applied: bool):
+    if not report:
+        print("✅ All indexes are up to date")
+        return
+    for collection, changes in report.items():
+        print(f"{collection}:")
+        for kind in ("missing", "changed", "extra"):
+            for name in changes[kind]:
+                print(f"  {kind:<8} {name}")
+    if applied:
+        print("\n✅ Missing and changed indexes applied")
+
+
+async def _main(argv: List[str]) -> int:
+    from pathlib import Path
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    from database import init_db
+
+    if not argv or argv[0] not in ("diff", "apply"):
+        print(__doc__)
+        return 2
+
+    db = init_db()
+    if argv[0] == "diff":
+        report = await diff_indexes(db)
+        _print_report(report, applied=False)
+        return 1 if report else 0
+
+    report = await apply_indexes(db, drop_extra="--drop-extra" in argv)
+    _print_report(report, applied=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
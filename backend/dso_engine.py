@@ -0,0 +1,371 @@
+"""
+Collection time (DSO) engine
+Joins customer payments to the invoices they settle and keeps per-tenant running
+days-to-pay statistics: amount-weighted DSO plus day histograms (overall and per
+customer) from which medians and percentiles are read. Each payment's contribution
+is stored, so a new or changed payment updates the totals with one $inc instead of
+a pass over the full history. Contributions are written first and then folded into
+the totals under a per-tenant lease held on the dso_stats document.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database import init_db
+
+logger = logging.getLogger(__name__)
+
+# Histogram bins are whole days; anything slower lands in the last bin
+DSO_HISTOGRAM_MAX_DAYS = 365
+DSO_TOP_CUSTOMERS = 10
+
+# One writer per tenant at a time (seconds a lease lasts, and how often a waiter retries);
+# the holder renews it while it works, and a waiter gives up after DSO_LEASE_WAIT_SECONDS
+DSO_LEASE_SECONDS = 60
+DSO_LEASE_POLL_INTERVAL = 0.2
+DSO_LEASE_WAIT_SECONDS = 120
+# Recently applied batch ids kept on dso_stats so a resumed batch is not counted twice
+DSO_APPLIED_BATCHES = 50
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def invoice_date_index(invoices: Iterable[Dict]) -> Dict[str, date]:
+    """invoice_id and invoice_number -> invoice date"""
+    index = {}
+    for inv in invoices:
+        issued = _parse_date(inv.get("date"))
+        if issued is None:
+            continue
+        for key in (inv.get("invoice_id"), inv.get("invoice_number")):
+            if key:
+                index[key] = issued
+    return index
+
+
+def applied_invoices(payment: Dict) -> List[Tuple[str, Optional[float]]]:
+    """(invoice id or number, amount applied) pairs a payment settles
+
+    Payment detail records carry an `invoices` list with amount_applied; list records
+    only have `invoice_numbers` (a comma-separated string), whose amounts are None.
+    """
+    if payment.get("invoices"):
+        return [
+            (inv.get("invoice_id") or inv.get("invoice_number"), float(inv.get("amount_applied", 0) or 0))
+            for inv in payment["invoices"]
+        ]
+    numbers = payment.get("invoice_numbers") or []
+    if isinstance(numbers, str):
+        numbers = numbers.split(",")
+    return [(number.strip(), None) for number in numbers if number and number.strip()]
+
+
+def payment_contribution(payment: Dict, invoice_dates: Dict[str, date]) -> List[List]:
+    """[days_to_pay, amount] for each invoice the payment settles that we can date
+
+    Without per-invoice amounts the payment is split evenly across its invoices.
+    """
+    paid_on = _parse_date(payment.get("date"))
+    if paid_on is None:
+        return []
+    matched = [(ref, amount) for ref, amount in applied_invoices(payment) if ref in invoice_dates]
+    if not matched:
+        return []
+    even_share = float(payment.get("amount", 0) or 0) / len(matched)
+    return [
+        [max(0, (paid_on - invoice_dates[ref]).days), even_share if amount is None else amount]
+        for ref, amount in matched
+    ]
+
+
+def _add_increments(inc: Dict[str, float], customer_id: str, applications: List[List], sign: int):
+    for days, amount in applications:
+        bin_key = str(min(days, DSO_HISTOGRAM_MAX_DAYS))
+        for prefix in ("totals", f"customers.{customer_id}"):
+            inc[f"{prefix}.amount"] += sign * amount
+            inc[f"{prefix}.weighted_days"] += sign * days * amount
+            inc[f"{prefix}.count"] += sign
+            inc[f"{prefix}.histogram.{bin_key}"] += sign
+
+
+async def _invoice_dates_from_mirror(user_id: str, organization_id: Optional[str], payments: List[Dict]) -> Dict[str, date]:
+    refs = {ref for payment in payments for ref, _ in applied_invoices(payment)}
+    if not refs:
+        return {}
+    db = init_db()
+    cursor = db.zoho_invoices.find(
+        {
+            "user_id": user_id,
+            "organization_id": organization_id,
+            "$or": [{"invoice_id": {"$in": list(refs)}}, {"invoice_number": {"$in": list(refs)}}],
+        },
+        {"_id": 0, "invoice_id": 1, "invoice_number": 1, "date": 1}
+    )
+    return invoice_date_index([inv async for inv in cursor])
+
+
+@asynccontextmanager
+async def _tenant_lease(db, tenant: Dict):
+    """Hold the tenant's dso_stats document for one writer at a time, across processes
+
+    Raises TimeoutError when another writer keeps it for DSO_LEASE_WAIT_SECONDS.
+    """
+    owner = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + DSO_LEASE_WAIT_SECONDS
+    while True:
+        now = datetime.utcnow()
+        try:
+            # A live lease fails the filter, so the upsert collides with it on the unique index
+            await db.dso_stats.update_one(
+                {**tenant, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=DSO_LEASE_SECONDS)}},
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            if loop.time() >= give_up_at:
+                raise TimeoutError(f"DSO lease for user {tenant['user_id']} still held after {DSO_LEASE_WAIT_SECONDS}s")
+            await asyncio.sleep(DSO_LEASE_POLL_INTERVAL)
+
+    async def keep_lease():
+        while True:
+            await asyncio.sleep(DSO_LEASE_SECONDS / 3)
+            result = await db.dso_stats.update_one(
+                {**tenant, "lease_owner": owner},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=DSO_LEASE_SECONDS)}}
+            )
+            if result.modified_count == 0:
+                logger.warning(f"DSO lease for user {tenant['user_id']} was lost")
+                return
+
+    heartbeat = asyncio.create_task(keep_lease())
+    try:
+        yield
+    finally:
+        heartbeat.cancel()
+        await db.dso_stats.update_one(
+            {**tenant, "lease_owner": owner},
+            {"$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+
+
+async def _settle(db, tenant: Dict) -> int:
+    """Fold pending contribution changes into dso_stats; returns how many were folded
+
+    A changed contribution keeps its previous value in `pending` until its batch's
+    increment has been applied. Each batch's $inc is guarded by applied_batches, so a
+    writer that died between the two steps is completed, never double counted.
+    """
+    pending = [
+        doc async for doc in db.dso_contributions.find(
+            {**tenant, "pending": {"$exists": True}},
+            {"_id": 0, "customer_id": 1, "applications": 1, "pending": 1}
+        )
+    ]
+    if not pending:
+        return 0
+
+    by_batch: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for doc in pending:
+        before = doc["pending"]
+        inc = by_batch[before["batch"]]
+        if before.get("applications"):
+            _add_increments(inc, before["customer_id"], before["applications"], -1)
+        _add_increments(inc, doc["customer_id"], doc["applications"], 1)
+
+    now = datetime.utcnow()
+    for batch, inc in by_batch.items():
+        update = {
+            "$set": {"updated_at": now},
+            "$push": {"applied_batches": {"$each": [batch], "$slice": -DSO_APPLIED_BATCHES}},
+        }
+        if inc:
+            update["$inc"] = dict(inc)
+        await db.dso_stats.update_one({**tenant, "applied_batches": {"$ne": batch}}, update)
+
+    batches = list(by_batch)
+    await db.dso_contributions.delete_many({**tenant, "pending.batch": {"$in": batches}, "deleted": True})
+    await db.dso_contributions.update_many(
+        {**tenant, "pending.batch": {"$in": batches}},
+        {"$unset": {"pending": ""}}
+    )
+    return len(pending)
+
+
+async def apply_payments(
+    user_id: str,
+    organization_id: Optional[str],
+    payments: List[Dict],
+    invoices: Optional[Iterable[Dict]] = None
+) -> int:
+    """Fold a batch of payments into the tenant's running statistics; returns how many changed
+
+    Safe to call repeatedly with the same payments: each one's previous contribution
+    is subtracted before its new one is added. Invoice dates come from `invoices`
+    when given, otherwise from the mirror.
+    """
+    payments = [p for p in payments if p.get("payment_id")]
+    if not payments:
+        return 0
+
+    if invoices is not None:
+        invoice_dates = invoice_date_index(invoices)
+    else:
+        invoice_dates = await _invoice_dates_from_mirror(user_id, organization_id, payments)
+
+    db = init_db()
+    tenant = {"user_id": user_id, "organization_id": organization_id}
+    async with _tenant_lease(db, tenant):
+        await _settle(db, tenant)
+        previous = {
+            doc["payment_id"]: doc
+            async for doc in db.dso_contributions.find(
+                {**tenant, "payment_id": {"$in": [p["payment_id"] for p in payments]}},
+                {"_id": 0, "payment_id": 1, "customer_id": 1, "applications": 1, "version": 1}
+            )
+        }
+
+        now = datetime.utcnow()
+        batch = uuid.uuid4().hex
+        names = {}
+        writes = []
+        for payment in payments:
+            customer_id = payment.get("customer_id") or "unknown"
+            applications = payment_contribution(payment, invoice_dates)
+            old = previous.get(payment["payment_id"])
+            if old and old["customer_id"] == customer_id and old["applications"] == applications:
+                continue
+            names[f"customers.{customer_id}.name"] = payment.get("customer_name", "")
+            version = old.get("version") if old else None
+            writes.append(UpdateOne(
+                # Compare-and-set on the version read above; a new payment must still be absent
+                {**tenant, "payment_id": payment["payment_id"], "version": version},
+                {"$set": {
+                    "customer_id": customer_id,
+                    "applications": applications,
+                    "version": (version or 0) + 1,
+                    "pending": {
+                        "batch": batch,
+                        "customer_id": old["customer_id"] if old else None,
+                        "applications": old["applications"] if old else [],
+                    },
+                    "updated_at": now,
+                }},
+                upsert=True
+            ))
+
+        if writes:
+            try:
+                await db.dso_contributions.bulk_write(writes, ordered=False)
+            except BulkWriteError as e:
+                # Lost a compare-and-set (only if the lease was lost despite renewal); those
+                # payments keep the other writer's contribution
+                logger.warning(f"DSO update for user {user_id} skipped {len(e.details.get('writeErrors', []))} payment(s) changed concurrently")
+            changed = await _settle(db, tenant)
+            if names:
+                await db.dso_stats.update_one(tenant, {"$set": names})
+        else:
+            changed = 0
+
+        # Mark everything in the batch as still present in Zoho (see prune_payments)
+        await db.dso_contributions.update_many(
+            {**tenant, "payment_id": {"$in": [p["payment_id"] for p in payments]}},
+            {"$set": {"seen_at": now}}
+        )
+    return changed
+
+
+async def _subtract_payments(user_id: str, organization_id: Optional[str], query: Dict) -> int:
+    db = init_db()
+    tenant = {"user_id": user_id, "organization_id": organization_id}
+    async with _tenant_lease(db, tenant):
+        await _settle(db, tenant)
+        # Mark for deletion with the current value as the one to subtract; _settle
+        # applies the decrement and then deletes them
+        batch = uuid.uuid4().hex
+        await db.dso_contributions.update_many(
+            {**tenant, **query},
+            [{"$set": {
+                "pending": {"batch": batch, "customer_id": "$customer_id", "applications": "$applications"},
+                "applications": [],
+                "deleted": True,
+            }}]
+        )
+        return await _settle(db, tenant)
+
+
+async def prune_payments(user_id: str, organization_id: Optional[str], seen_since: datetime) -> int:
+    """After a full sync, subtract payments that were not seen by it (deleted in Zoho)"""
+    return await _subtract_payments(user_id, organization_id, {"seen_at": {"$lt": seen_since}})
+
+
+async def remove_payments(user_id: str, organization_id: Optional[str], payment_ids: List[str]) -> int:
+    """Subtract specific payments (deleted in Zoho, reported by webhook)"""
+    if not payment_ids:
+        return 0
+    return await _subtract_payments(user_id, organization_id, {"payment_id": {"$in": payment_ids}})
+
+
+async def clear_dso(user_id: str):
+    """Drop a user's statistics (on disconnect)"""
+    db = init_db()
+    await db.dso_stats.delete_many({"user_id": user_id})
+    await db.dso_contributions.delete_many({"user_id": user_id})
+
+
+def histogram_percentile(histogram: Dict[str, int], fraction: float) -> Optional[int]:
+    """Day value below which `fraction` of the counted payments fall"""
+    bins = sorted((int(days), count) for days, count in histogram.items() if count > 0)
+    total = sum(count for _, count in bins)
+    if not total:
+        return None
+    target = fraction * total
+    running = 0
+    for days, count in bins:
+        running += count
+        if running >= target:
+            return days
+    return bins[-1][0]
+
+
+def _summarize(stats: Dict) -> Dict:
+    amount = stats.get("amount", 0)
+    histogram = stats.get("histogram", {})
+    return {
+        "weighted_dso": round(stats.get("weighted_days", 0) / amount, 1) if amount > 0 else None,
+        "median_days": histogram_percentile(histogram, 0.5),
+        "p90_days": histogram_percentile(histogram, 0.9),
+        "payments": int(stats.get("count", 0)),
+        "amount": amount,
+    }
+
+
+async def get_dso_summary(user_id: str, organization_id: Optional[str]) -> Optional[Dict]:
+    """Weighted DSO, median/p90 days to pay and the largest customers' medians, or None if never computed"""
+    db = init_db()
+    stats = await db.dso_stats.find_one({"user_id": user_id, "organization_id": organization_id})
+    if not stats or not stats.get("totals", {}).get("count"):
+        return None
+
+    customers = [
+        {"customer_id": customer_id, "customer_name": data.get("name", ""), **_summarize(data)}
+        for customer_id, data in (stats.get("customers") or {}).items()
+        if data.get("count", 0) > 0
+    ]
+    customers.sort(key=lambda c: c["amount"], reverse=True)
+    return {**_summarize(stats["totals"]), "customers": customers[:DSO_TOP_CUSTOMERS]}
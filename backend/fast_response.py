@@ -0,0 +1,66 @@
+"""
+Fast JSON responses
+orjson-rendered responses that FastAPI sends as they are. Routes returning a Response
+skip FastAPI's response_model pass (validate the return value again, jsonable_encoder,
+json.dumps), so handlers return models they already validated, or stored view dicts
+that were dumped from validated models, through respond(). Pydantic models are
+serialized by pydantic-core directly. Each response reports its serialization time in
+a Server-Timing header.
+
+Opt in with FAST_JSON_RESPONSES=true; otherwise respond() returns its argument and
+FastAPI validates and encodes it as before.
+"""
+
+import os
+import time
+from typing import Any, Dict
+
+import orjson
+import pydantic_core
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', 'false').lower() in ('1', 'true', 'yes')
+
+_stats = {"responses": 0, "bytes": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+
+class FastJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also renders Pydantic models and reports serialization time"""
+
+    def __init__(self, content: Any, *args, **kwargs):
+        self.serialize_ms = 0.0
+        super().__init__(content, *args, **kwargs)
+        self.headers["Server-Timing"] = f"serialize;dur={self.serialize_ms:.2f}"
+
+    def render(self, content: Any) -> bytes:
+        started = time.perf_counter()
+        if isinstance(content, BaseModel):
+            body = pydantic_core.to_json(content)
+        else:
+            body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        self.serialize_ms = (time.perf_counter() - started) * 1000
+
+        _stats["responses"] += 1
+        _stats["bytes"] += len(body)
+        _stats["total_ms"] += self.serialize_ms
+        _stats["max_ms"] = max(_stats["max_ms"], self.serialize_ms)
+        return body
+
+
+def respond(content: Any) -> Any:
+    """Send already validated content without FastAPI's second validation pass (when enabled)"""
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(content)
+    return content
+
+
+def get_serialization_metrics() -> Dict:
+    responses = _stats["responses"]
+    return {
+        **_stats,
+        "total_ms": round(_stats["total_ms"], 2),
+        "max_ms": round(_stats["max_ms"], 2),
+        "avg_ms": round(_stats["total_ms"] / responses, 3) if responses else 0.0,
+        "enabled": FAST_JSON_RESPONSES,
+    }
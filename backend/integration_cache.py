@@ -0,0 +1,100 @@
+"""
+Integration document cache
+Request-scoped memo plus a short-TTL process-wide cache of each user's active
+Zoho Books integration, so hot paths do not hit Mongo on every helper call
+"""
+
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from cache_broadcast import register_invalidator
+from database import init_db
+from singleflight import SingleFlight
+
+INTEGRATION_CACHE_TTL = float(os.environ.get('INTEGRATION_CACHE_TTL', '30'))
+
+# Per-request memo: user_id -> integration document (or None)
+_request_scope: ContextVar[Optional[Dict[str, Optional[Dict]]]] = ContextVar('integration_request_scope', default=None)
+
+# Process-wide cache: user_id -> (expires_at, integration document or None)
+_cache: Dict[str, Tuple[float, Optional[Dict]]] = {}
+# Bumped on invalidation so loads started before it are not stored
+_generations: Dict[str, int] = {}
+_loads = SingleFlight()
+_stats = {"request_hits": 0, "process_hits": 0, "loads": 0, "invalidations": 0}
+
+
+async def _load(user_id: str) -> Optional[Dict]:
+    db = init_db()
+    return await db.integrations.find_one({
+        "user_id": user_id,
+        "type": "zohobooks",
+        "status": "active"
+    })
+
+
+async def get_integration(user_id: str, fresh: bool = False) -> Optional[Dict]:
+    """Get the user's active Zoho Books integration
+
+    fresh=True always reads Mongo (token refresh compares against the stored token).
+    Returned documents are shared and must be treated as read-only.
+    """
+    scope = _request_scope.get()
+
+    if not fresh:
+        if scope is not None and user_id in scope:
+            _stats["request_hits"] += 1
+            return scope[user_id]
+        cached = _cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            _stats["process_hits"] += 1
+            if scope is not None:
+                scope[user_id] = cached[1]
+            return cached[1]
+
+    generation = _generations.get(user_id, 0)
+    _stats["loads"] += 1
+    integration = await _loads.do(("fresh" if fresh else "cached", user_id), lambda: _load(user_id))
+
+    if _generations.get(user_id, 0) == generation:
+        _cache[user_id] = (time.monotonic() + INTEGRATION_CACHE_TTL, integration)
+        if scope is not None:
+            scope[user_id] = integration
+    return integration
+
+
+def invalidate_integration(user_id: str):
+    """Forget the cached integration (callback, disconnect, demo-connect, token refresh, sync)"""
+    _generations[user_id] = _generations.get(user_id, 0) + 1
+    _cache.pop(user_id, None)
+    _loads.forget(lambda key: key[1] == user_id)
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.pop(user_id, None)
+    _stats["invalidations"] += 1
+
+
+register_invalidator(invalidate_integration)
+
+
+def get_integration_cache_metrics() -> Dict:
+    return {**_stats, "entries": len(_cache)}
+
+
+class IntegrationScopeMiddleware:
+    """ASGI middleware giving each HTTP request its own integration memo"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
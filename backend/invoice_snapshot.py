@@ -0,0 +1,111 @@
+"""
+Invoice snapshot
+One pull of a user's invoices with in-memory indexes by status, customer and due
+date, so callers answer "all / unpaid / overdue / for this customer / due before"
+from the same data instead of issuing one Zoho call per question
+"""
+
+import bisect
+import heapq
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+# Same rule as the mirror's UNPAID_INVOICE_FILTER and Zoho's "unpaid" list filter
+CLOSED_INVOICE_STATUSES = ("draft", "void", "paid")
+
+
+def parse_due_date(value: Optional[str]) -> Optional[date]:
+    """Parse Zoho's "YYYY-MM-DD" due dates (tolerating a trailing time part)"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def invoice_balance(inv: Dict) -> float:
+    return float(inv.get("balance", 0) or 0)
+
+
+def is_unpaid(inv: Dict) -> bool:
+    return invoice_balance(inv) > 0 and inv.get("status") not in CLOSED_INVOICE_STATUSES
+
+
+def is_overdue(inv: Dict, today: Optional[date] = None) -> bool:
+    """Unpaid and past its due date; mirrored invoices keep the status they were synced with
+    after the due date passes, so the date decides as well as Zoho's "overdue" status"""
+    if not is_unpaid(inv):
+        return False
+    if inv.get("status") == "overdue":
+        return True
+    due = parse_due_date(inv.get("due_date"))
+    return due is not None and due < (today or datetime.utcnow().date())
+
+
+class InvoiceSnapshot:
+    """Invoices from a single fetch, with indexed views
+
+    `status` records the filter the snapshot was loaded with (None = every invoice);
+    views narrower than that filter are derived locally. Records keep their source
+    order (newest first) in every view.
+    """
+
+    def __init__(self, invoices: Iterable[Dict], status: Optional[str] = None):
+        self.invoices: List[Dict] = list(invoices)
+        self.status = status
+        self.loaded_at = datetime.utcnow()
+
+        self._by_status: Dict[str, List[int]] = {}
+        self._by_customer: Dict[str, List[int]] = {}
+        self._unpaid: List[int] = []
+        # (due_date, position) pairs sorted by due date, for range queries
+        self._due: List[tuple] = []
+
+        for pos, inv in enumerate(self.invoices):
+            self._by_status.setdefault(inv.get("status", ""), []).append(pos)
+            for key in (inv.get("customer_id"), (inv.get("customer_name") or "").lower()):
+                if key:
+                    self._by_customer.setdefault(key, []).append(pos)
+            if is_unpaid(inv):
+                self._unpaid.append(pos)
+            due = parse_due_date(inv.get("due_date"))
+            if due is not None:
+                self._due.append((due, pos))
+        self._due.sort()
+
+    def __len__(self) -> int:
+        return len(self.invoices)
+
+    def _pick(self, positions: Iterable[int]) -> List[Dict]:
+        return [self.invoices[pos] for pos in positions]
+
+    def with_status(self, status: str) -> List[Dict]:
+        """Invoices with the given Zoho status ("unpaid" means any open balance)"""
+        if status == "unpaid":
+            return self.unpaid()
+        return self._pick(self._by_status.get(status, []))
+
+    def unpaid(self) -> List[Dict]:
+        return self._pick(self._unpaid)
+
+    def overdue(self) -> List[Dict]:
+        today = datetime.utcnow().date()
+        return self._pick(pos for pos in self._unpaid if is_overdue(self.invoices[pos], today))
+
+    def for_customer(self, customer: str) -> List[Dict]:
+        """Invoices for a customer id or (case-insensitive) customer name"""
+        positions = self._by_customer.get(customer) or self._by_customer.get(customer.lower(), [])
+        return self._pick(positions)
+
+    def due_between(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+        """Invoices due in [start, end), ordered by due date; either bound may be open"""
+        lo = bisect.bisect_left(self._due, (start,)) if start else 0
+        hi = bisect.bisect_left(self._due, (end,)) if end else len(self._due)
+        return self._pick(pos for _, pos in self._due[lo:hi])
+
+    def total_balance(self, invoices: Optional[List[Dict]] = None) -> float:
+        return sum(invoice_balance(inv) for inv in (self.invoices if invoices is None else invoices))
+
+    def top_by_balance(self, n: int, invoices: Optional[List[Dict]] = None) -> List[Dict]:
+        return heapq.nlargest(n, self.invoices if invoices is None else invoices, key=invoice_balance)
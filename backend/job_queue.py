@@ -0,0 +1,429 @@
+"""
+MongoDB-backed job queue
+Jobs live in the jobs collection and are claimed by workers with a lease that is
+renewed while the handler runs; a worker that dies simply lets its lease expire and
+the job is picked up again. Failed jobs are retried with exponential backoff up to
+max_attempts. Claims go by priority, then run_at (jobs can be scheduled for later),
+and skip tenants already running JOB_TENANT_CONCURRENCY jobs.
+
+A job with a key is deduplicated while queued (enqueueing it again returns the
+queued job) and never runs twice at once; a retried or released job whose key was
+queued again meanwhile is merged into that job. Recurring jobs are declared in
+job_schedules and enqueued by whichever worker finds them due first.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import init_db
+
+logger = logging.getLogger(__name__)
+
+# A claimed job is reclaimable once its lease lapses without renewal (seconds)
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+# Jobs one worker process runs at once
+JOB_WORKER_CONCURRENCY = int(os.environ.get('JOB_WORKER_CONCURRENCY', '4'))
+# Running jobs per tenant across all workers (soft: concurrent claims can briefly exceed it)
+JOB_TENANT_CONCURRENCY = int(os.environ.get('JOB_TENANT_CONCURRENCY', '2'))
+# Idle workers look for new jobs this often (seconds)
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_DELAY = 30
+JOB_RETRY_MAX_DELAY = 60 * 60
+
+# Job types (handlers are registered in worker.py)
+MIRROR_SYNC = "mirror_sync"
+WEBHOOK_EVENTS = "webhook_events"
+RECONCILE = "reconcile"
+SYNC_ALL = "sync_all"
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+JobHandler = Callable[[Dict], Awaitable[Optional[Dict]]]
+
+
+async def enqueue_job(
+    job_type: str,
+    user_id: Optional[str] = None,
+    payload: Optional[Dict] = None,
+    priority: int = PRIORITY_NORMAL,
+    run_at: Optional[datetime] = None,
+    key: Optional[str] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+) -> str:
+    """Queue a job and return its id (the already queued job's id for a duplicate key)"""
+    db = init_db()
+    now = datetime.utcnow()
+    job = {
+        "type": job_type,
+        "user_id": user_id,
+        "payload": payload or {},
+        "priority": priority,
+        "run_at": run_at or now,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "created_at": now,
+    }
+    if key:
+        job["key"] = key
+        job["queued_key"] = key  # unique while queued; removed on claim
+    try:
+        result = await db.jobs.insert_one(job)
+        return str(result.inserted_id)
+    except DuplicateKeyError:
+        existing = await db.jobs.find_one({"queued_key": key}, {"_id": 1})
+        if existing is None:
+            # Claimed between the insert and the lookup: queue a follow-up
+            return await enqueue_job(job_type, user_id, payload, priority, run_at, key, max_attempts)
+        return str(existing["_id"])
+
+
+async def merge_queued_payload(job_id: str, payload: Dict) -> bool:
+    """Widen a still-queued job's payload when a duplicate enqueue asked for more"""
+    db = init_db()
+    result = await db.jobs.update_one(
+        {"_id": ObjectId(job_id), "status": "queued"},
+        {"$set": {f"payload.{name}": value for name, value in payload.items()}}
+    )
+    return result.modified_count == 1
+
+
+async def _running_jobs(now: datetime) -> List[Dict]:
+    db = init_db()
+    return await db.jobs.aggregate([
+        {"$match": {"status": "running", "lease_expires_at": {"$gt": now}}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}, "keys": {"$push": "$key"}}},
+    ]).to_list(length=None)
+
+
+async def claim_job(worker_id: str, job_types: List[str], job_id: Optional[ObjectId] = None) -> Optional[Dict]:
+    """Lease the next runnable job for this worker (or that job, when it is runnable), or None"""
+    db = init_db()
+    now = datetime.utcnow()
+    running = await _running_jobs(now)
+    busy_tenants = [group["_id"] for group in running if group["_id"] and group["count"] >= JOB_TENANT_CONCURRENCY]
+    running_keys = [key for group in running for key in group["keys"] if key]
+
+    query = {"status": "queued", "run_at": {"$lte": now}, "type": {"$in": job_types}}
+    if job_id is not None:
+        query["_id"] = job_id
+    if busy_tenants:
+        query["user_id"] = {"$nin": busy_tenants}
+    if running_keys:
+        query["key"] = {"$nin": running_keys}
+    return await db.jobs.find_one_and_update(
+        query,
+        {
+            "$set": {
+                "status": "running",
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "started_at": now,
+            },
+            "$inc": {"attempts": 1},
+            "$unset": {"queued_key": ""},
+        },
+        sort=[("priority", -1), ("run_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def renew_lease(job: Dict, worker_id: str) -> bool:
+    db = init_db()
+    result = await db.jobs.update_one(
+        {"_id": job["_id"], "status": "running", "lease_owner": worker_id},
+        {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}}
+    )
+    return result.modified_count == 1
+
+
+async def _keep_lease(job: Dict, worker_id: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        if not await renew_lease(job, worker_id):
+            logger.warning(f"Job {job['_id']} ({job['type']}) lost its lease")
+            return
+
+
+async def complete_job(job: Dict, worker_id: str, result: Optional[Dict] = None):
+    db = init_db()
+    await db.jobs.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {"$set": {"status": "done", "result": result, "finished_at": datetime.utcnow()},
+         "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1))) * random.uniform(0.5, 1.5)
+
+
+async def _requeue(job: Dict, owned: Dict, update: Dict, inc: Optional[Dict] = None) -> bool:
+    """Put a claimed job back in the queue, taking its queued_key back
+
+    If the same key was queued again while this job ran, that job already covers
+    this one's work: this job's payload is merged into it and this one is marked
+    merged. Returns False when the job was no longer held as `owned` describes.
+    """
+    db = init_db()
+    now = datetime.utcnow()
+    fields = {**update, "status": "queued"}
+    if job.get("key"):
+        fields["queued_key"] = job["key"]
+    change = {"$set": fields, "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+    if inc:
+        change["$inc"] = inc
+    try:
+        result = await db.jobs.update_one({"_id": job["_id"], **owned}, change)
+        return result.modified_count == 1
+    except DuplicateKeyError:
+        pass
+
+    queued = await db.jobs.find_one_and_update(
+        {"queued_key": job["key"], "status": "queued"},
+        {
+            # Merged payload flags only ever widen the queued run (e.g. full=True)
+            "$set": {f"payload.{name}": value for name, value in (job.get("payload") or {}).items() if value},
+            "$max": {"priority": job.get("priority", PRIORITY_NORMAL)},
+        },
+        projection={"_id": 1}
+    )
+    if queued is None:
+        # The duplicate was claimed meanwhile; try again with the key free
+        return await _requeue(job, owned, update, inc)
+    result = await db.jobs.update_one(
+        {"_id": job["_id"], **owned},
+        {"$set": {"status": "merged", "merged_into": queued["_id"], "finished_at": now, **update},
+         "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+    )
+    return result.modified_count == 1
+
+
+async def fail_job(job: Dict, worker_id: str, error: str):
+    """Requeue with backoff, or mark failed once max_attempts is reached"""
+    db = init_db()
+    now = datetime.utcnow()
+    if job["attempts"] < job.get("max_attempts", JOB_MAX_ATTEMPTS):
+        await _requeue(
+            job, {"lease_owner": worker_id},
+            {"run_at": now + timedelta(seconds=retry_delay(job["attempts"])), "last_error": error}
+        )
+        return
+    await db.jobs.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {"$set": {"status": "failed", "finished_at": now, "last_error": error},
+         "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+    )
+
+
+async def release_job(job: Dict, worker_id: str):
+    """Hand an interrupted job back without counting the attempt (worker shutdown)"""
+    await _requeue(job, {"lease_owner": worker_id}, {}, inc={"attempts": -1})
+
+
+async def requeue_expired_leases() -> int:
+    """Return jobs whose worker stopped renewing its lease to the queue (or fail them)"""
+    db = init_db()
+    now = datetime.utcnow()
+    expired = {"status": "running", "lease_expires_at": {"$lt": now}}
+    failed = await db.jobs.update_many(
+        {**expired, "$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+        {"$set": {"status": "failed", "finished_at": now, "last_error": "Lease expired"},
+         "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+    )
+    # One at a time: each takes its queued_key back, which may collide with a newer duplicate
+    requeued = 0
+    async for job in db.jobs.find(expired, {"_id": 1, "key": 1, "payload": 1, "priority": 1}):
+        if await _requeue(job, expired, {"last_error": "Lease expired"}):
+            requeued += 1
+    return failed.modified_count + requeued
+
+
+async def run_job_inline(job_id: str, handler: JobHandler, worker_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+    """Claim a queued job and run it in this process instead of waiting for a worker slot
+
+    For jobs that fan out into other jobs (sync_all): waiting on the pool from inside a
+    job holds a slot the queued work needs. The job is claimed like any other, so its
+    key still never runs twice at once; if a worker claimed it first (or it was merged),
+    this waits for that run instead. Returns the job after its attempt (queued again
+    with last_error when it failed and has attempts left), or None on timeout.
+    """
+    db = init_db()
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + timeout if timeout is not None else None
+    current = ObjectId(job_id)
+    while True:
+        job = await db.jobs.find_one({"_id": current}, {"type": 1, "status": 1, "merged_into": 1})
+        if job is None:
+            return None
+        if job["status"] == "merged":
+            current = job["merged_into"]
+            continue
+        if job["status"] != "queued":
+            remaining = give_up_at - loop.time() if give_up_at is not None else None
+            return await wait_for_job(str(current), timeout=remaining)
+        job = await claim_job(worker_id, [job["type"]], job_id=current)
+        if job is not None:
+            break
+        # Still queued: its key is running elsewhere or a retry is not due yet
+        if give_up_at is not None and loop.time() >= give_up_at:
+            return None
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    heartbeat = asyncio.create_task(_keep_lease(job, worker_id))
+    try:
+        await complete_job(job, worker_id, await handler(job))
+    except asyncio.CancelledError:
+        await release_job(job, worker_id)
+        raise
+    except Exception as e:
+        logger.error(f"Job {job['_id']} ({job['type']}) failed on attempt {job['attempts']}: {str(e)}")
+        await fail_job(job, worker_id, str(e))
+    finally:
+        heartbeat.cancel()
+    return await db.jobs.find_one({"_id": job["_id"]}, {"status": 1, "result": 1, "last_error": 1, "merged_into": 1})
+
+
+async def wait_for_job(job_id: str, timeout: Optional[float] = None, poll_interval: float = JOB_POLL_INTERVAL) -> Optional[Dict]:
+    """Wait until a job (or the job it was merged into) is done or failed; None on timeout"""
+    db = init_db()
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + timeout if timeout is not None else None
+    current = ObjectId(job_id)
+    while True:
+        job = await db.jobs.find_one({"_id": current}, {"status": 1, "result": 1, "last_error": 1, "merged_into": 1})
+        if job is None:
+            return None
+        if job["status"] == "merged":
+            current = job["merged_into"]
+            continue
+        if job["status"] in ("done", "failed"):
+            return job
+        if give_up_at is not None and loop.time() >= give_up_at:
+            return None
+        await asyncio.sleep(poll_interval)
+
+
+async def ensure_schedule(name: str, job_type: str, interval: int, payload: Optional[Dict] = None, priority: int = PRIORITY_LOW):
+    """Declare a recurring job (first run is due immediately); safe to call on every start"""
+    db = init_db()
+    await db.job_schedules.update_one(
+        {"name": name},
+        {"$set": {"type": job_type, "interval": interval, "payload": payload or {}, "priority": priority},
+         "$setOnInsert": {"next_run_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def drop_schedule(name: str):
+    db = init_db()
+    await db.job_schedules.delete_one({"name": name})
+
+
+async def enqueue_due_schedules() -> int:
+    db = init_db()
+    enqueued = 0
+    while True:
+        now = datetime.utcnow()
+        # Advancing next_run_at first means only one worker enqueues each run
+        schedule = await db.job_schedules.find_one_and_update(
+            {"next_run_at": {"$lte": now}},
+            [{"$set": {"next_run_at": {"$add": [now, {"$multiply": ["$interval", 1000]}]}}}]
+        )
+        if schedule is None:
+            return enqueued
+        await enqueue_job(
+            schedule["type"],
+            payload=schedule.get("payload"),
+            priority=schedule.get("priority", PRIORITY_LOW),
+            key=f"schedule:{schedule['name']}"
+        )
+        enqueued += 1
+
+
+async def get_queue_metrics() -> Dict:
+    db = init_db()
+    counts: Dict[str, Dict[str, int]] = {}
+    async for row in db.jobs.aggregate([
+        {"$match": {"status": {"$in": ["queued", "running"]}}},
+        {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}},
+    ]):
+        counts.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+    return counts
+
+
+class JobWorker:
+    """Claims and runs jobs for the registered handlers until stopped"""
+
+    def __init__(self, handlers: Dict[str, JobHandler], concurrency: int = JOB_WORKER_CONCURRENCY, worker_id: Optional[str] = None):
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[Any, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self.stats = {"claimed": 0, "completed": 0, "failed": 0}
+
+    async def run(self):
+        while not self._stopping:
+            try:
+                await requeue_expired_leases()
+                await enqueue_due_schedules()
+                while len(self._running) < self.concurrency and not self._stopping:
+                    job = await claim_job(self.worker_id, list(self.handlers))
+                    if job is None:
+                        break
+                    self.stats["claimed"] += 1
+                    self._running[job["_id"]] = asyncio.create_task(self._execute(job))
+            except Exception as e:
+                logger.error(f"Job worker {self.worker_id} poll failed: {str(e)}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Dict):
+        heartbeat = asyncio.create_task(_keep_lease(job, self.worker_id))
+        try:
+            result = await self.handlers[job["type"]](job)
+            await complete_job(job, self.worker_id, result)
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            await release_job(job, self.worker_id)
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['_id']} ({job['type']}) failed on attempt {job['attempts']}: {str(e)}")
+            await fail_job(job, self.worker_id, str(e))
+            self.stats["failed"] += 1
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job["_id"], None)
+            # A slot freed up: claim the next job without waiting for the poll
+            self._wakeup.set()
+
+    async def stop(self, grace: float = 30.0):
+        """Stop claiming, give running jobs `grace` seconds, then hand the rest back"""
+        self._stopping = True
+        self._wakeup.set()
+        tasks = list(self._running.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=grace)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def metrics(self) -> Dict:
+        return {**self.stats, "worker_id": self.worker_id, "running": len(self._running)}
@@ -40,6 +40,7 @@ class MessageItem(BaseModel):
 
 class ChatHistory(BaseModel):
     messages: List[MessageItem]
+    next_before: Optional[str] = None  # cursor for the next older page
 
 # Demo & Contact Models
 class DemoRequest(BaseModel):
@@ -70,6 +71,8 @@ class DashboardAnalytics(BaseModel):
     recovery_rate: float
     active_accounts: int
     recent_activity: List[ActivityItem]
+    failed_sources: List[str] = []  # Zoho sub-fetches that failed (partial data)
+    refreshed_at: Optional[datetime] = None  # when the stored dashboard view was built
 
 # Collections Tab Models
 class InvoiceItem(BaseModel):
@@ -85,8 +88,14 @@ class InvoiceItem(BaseModel):
 class CollectionsData(BaseModel):
     unpaid_invoices: List[InvoiceItem]
     overdue_invoices: List[InvoiceItem]
-    total_unpaid: float
+    total_unpaid: float  # over every invoice matching the filters, not just this page
     total_overdue: float
+    unpaid_count: int = 0
+    overdue_count: int = 0
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page of unpaid invoices
+    next_overdue_cursor: Optional[str] = None  # pass as ?overdue_cursor= for the next page of overdue invoices
+    failed_sources: List[str] = []  # Zoho sub-fetches that failed (partial data)
+    refreshed_at: Optional[datetime] = None  # when the stored dashboard view was built
 
 # Analytics Tab Models
 class MonthlyMetric(BaseModel):
@@ -94,12 +103,29 @@ class MonthlyMetric(BaseModel):
     collected: float
     outstanding: float
 
+class AgingBucket(BaseModel):
+    label: str  # "Current", "1-30 days", ...
+    count: int
+    amount: float
+
+class CustomerCollectionTime(BaseModel):
+    customer_id: str
+    customer_name: str
+    median_days: Optional[int] = None
+    weighted_dso: Optional[float] = None
+    payments: int
+
 class AnalyticsData(BaseModel):
     monthly_trends: List[MonthlyMetric]
     total_collected: float
     total_outstanding: float
     collection_efficiency: float
-    average_collection_time: int  # days
+    average_collection_time: int  # days (amount-weighted DSO)
+    median_collection_time: Optional[int] = None  # days
+    customer_collection_times: List[CustomerCollectionTime] = []
+    aging_buckets: List[AgingBucket] = []
+    failed_sources: List[str] = []  # Zoho sub-fetches that failed (partial data)
+    refreshed_at: Optional[datetime] = None  # when the stored dashboard view was built
 
 # Reconciliation Tab Models  
 class ReconciliationItem(BaseModel):
@@ -109,9 +135,19 @@ class ReconciliationItem(BaseModel):
     amount: float
     status: str  # "matched", "unmatched", "pending"
     invoice_ref: Optional[str] = None
+    match_method: Optional[str] = None  # "amount+reference", "amount" or "fuzzy" for bank statement matches
 
 class ReconciliationData(BaseModel):
     matched_items: List[ReconciliationItem]
     unmatched_items: List[ReconciliationItem]
     total_matched: float
-    total_unmatched: float
\ No newline at end of file
+    total_unmatched: float
+    refreshed_at: Optional[datetime] = None  # when the stored dashboard view was built
+
+class StatementUploadResult(BaseModel):
+    statement_id: str
+    filename: str
+    format: str  # "csv", "ofx" or "camt"
+    lines: int
+    new_lines: int
+    job_id: str  # reconcile job; results appear in /reconciliation once it finishes
\ No newline at end of file
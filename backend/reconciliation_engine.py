@@ -0,0 +1,429 @@
+"""
+Bank reconciliation engine
+Matches bank statement credits to Zoho payments (already recorded receipts) and
+open invoices (receipts not yet recorded in Zoho). Candidates are indexed by amount
+in cents (date ordered) and by normalized reference/customer tokens, so each statement
+line costs a few hash lookups, a binary search by date and a fuzzy pass over at most
+RECON_FUZZY_MAX_CANDIDATES candidates, however often an amount repeats.
+"""
+
+import asyncio
+import os
+import re
+import uuid
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from pymongo import UpdateOne
+from bank_statements import parse_statement
+from database import init_db
+from job_queue import enqueue_job, RECONCILE, PRIORITY_HIGH
+from zoho_api_helper import get_payments, load_invoice_snapshot
+
+# A statement line may be up to this many days away from the payment it matches
+RECON_DATE_WINDOW_DAYS = int(os.environ.get('RECON_DATE_WINDOW_DAYS', '7'))
+RECON_FUZZY_MAX_CANDIDATES = int(os.environ.get('RECON_FUZZY_MAX_CANDIDATES', '50'))
+# Fuzzy matches may differ in amount by this fraction (bank charges, rounding)
+RECON_AMOUNT_TOLERANCE = float(os.environ.get('RECON_AMOUNT_TOLERANCE', '0.01'))
+# Tokens shared by more candidates than this (overall, or at one amount) say nothing
+# about a match and are not indexed
+RECON_MAX_TOKEN_FREQUENCY = 200
+
+STOPWORDS = {
+    "neft", "rtgs", "imps", "upi", "ach", "trf", "transfer", "payment", "paid", "received",
+    "from", "ref", "the", "and", "for", "ltd", "pvt", "private", "limited", "inc", "llp",
+    "corp", "company", "bank", "credit", "inb", "invoice", "inv",
+}
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def to_cents(amount) -> int:
+    return int(round(float(amount or 0) * 100))
+
+
+def _to_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def tokenize(*texts: Optional[str]) -> Set[str]:
+    """Lowercase alphanumeric tokens worth comparing
+
+    Document numbers are also indexed without separators and leading zeros, so
+    "INV-000123" on an invoice meets "INV000123" or "123" in a bank narration.
+    """
+    tokens = set()
+    for text in texts:
+        if not text:
+            continue
+        lowered = text.lower()
+        for token in TOKEN_RE.findall(lowered):
+            if token in STOPWORDS:
+                continue
+            if token.isdigit():
+                token = token.lstrip("0") or "0"
+                if len(token) >= 3:
+                    tokens.add(token)
+            elif len(token) >= 3:
+                tokens.add(token)
+        compact = "".join(TOKEN_RE.findall(lowered))
+        if any(ch.isdigit() for ch in compact) and 4 <= len(compact) <= 30:
+            tokens.add(compact)
+    return tokens
+
+
+class Candidate:
+    __slots__ = ("kind", "id", "ref", "cents", "date", "tokens", "customer")
+
+    def __init__(self, kind: str, id: str, ref: str, cents: int, on: Optional[date], tokens: Set[str], customer: str):
+        self.kind = kind
+        self.id = id
+        self.ref = ref
+        self.cents = cents
+        self.date = on
+        self.tokens = tokens
+        self.customer = customer
+
+
+def payment_candidate(payment: Dict) -> Candidate:
+    return Candidate(
+        "payment",
+        payment.get("payment_id", ""),
+        payment.get("invoice_numbers") or payment.get("payment_number", ""),
+        to_cents(payment.get("amount")),
+        _to_date(payment.get("date")),
+        tokenize(payment.get("reference_number"), payment.get("payment_number"),
+                 payment.get("invoice_numbers"), payment.get("customer_name")),
+        payment.get("customer_name", ""),
+    )
+
+
+def invoice_candidate(invoice: Dict) -> Candidate:
+    return Candidate(
+        "invoice",
+        invoice.get("invoice_id", ""),
+        invoice.get("invoice_number", ""),
+        to_cents(invoice.get("balance")),
+        _to_date(invoice.get("date")),
+        tokenize(invoice.get("invoice_number"), invoice.get("reference_number"), invoice.get("customer_name")),
+        invoice.get("customer_name", ""),
+    )
+
+
+class DateBucket:
+    """Candidates ordered by date; claimed ones are dropped as lookups meet them"""
+
+    __slots__ = ("days", "candidates", "undated")
+
+    def __init__(self):
+        self.days: List[int] = []
+        self.candidates: List[Candidate] = []
+        self.undated: List[Candidate] = []
+
+    def add(self, candidate: Candidate):
+        if candidate.date is None:
+            self.undated.append(candidate)
+        else:
+            self.candidates.append(candidate)
+
+    def sort(self):
+        self.candidates.sort(key=lambda candidate: candidate.date)
+        self.days = [candidate.date.toordinal() for candidate in self.candidates]
+
+    def nearest(self, used: Set[tuple], day: int, earliest: int, latest: int) -> Optional[Candidate]:
+        """Available candidate dated closest to `day` inside [earliest, latest] (undated ones count as same-day)"""
+        while self.undated and (self.undated[-1].kind, self.undated[-1].id) in used:
+            self.undated.pop()
+
+        days, candidates = self.days, self.candidates
+        i = bisect_left(days, day)
+        while i < len(days) and (candidates[i].kind, candidates[i].id) in used:
+            del days[i], candidates[i]
+        while i > 0 and (candidates[i - 1].kind, candidates[i - 1].id) in used:
+            del days[i - 1], candidates[i - 1]
+            i -= 1
+
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(days) and earliest <= days[j] <= latest:
+                if best is None or abs(days[j] - day) < abs(days[best] - day):
+                    best = j
+        if best is not None and (days[best] == day or not self.undated):
+            return candidates[best]
+        return self.undated[-1] if self.undated else None
+
+
+class MatchIndex:
+    """Candidates by exact amount (date ordered, and by token) and by token, each used by at most one statement line"""
+
+    def __init__(self, candidates: Iterable[Candidate]):
+        self.by_amount: Dict[int, Dict[str, DateBucket]] = defaultdict(lambda: {"payment": DateBucket(), "invoice": DateBucket()})
+        self.by_amount_token: Dict[tuple, List[Candidate]] = defaultdict(list)
+        self.by_token: Dict[str, List[Candidate]] = defaultdict(list)
+        for candidate in candidates:
+            if candidate.cents <= 0 or not candidate.id:
+                continue
+            self.by_amount[candidate.cents][candidate.kind].add(candidate)
+            for token in candidate.tokens:
+                self.by_amount_token[(candidate.cents, token)].append(candidate)
+                self.by_token[token].append(candidate)
+        for buckets in self.by_amount.values():
+            for bucket in buckets.values():
+                bucket.sort()
+        for key in [k for k, found in self.by_amount_token.items() if len(found) > RECON_MAX_TOKEN_FREQUENCY]:
+            del self.by_amount_token[key]
+        for token in [t for t, found in self.by_token.items() if len(found) > RECON_MAX_TOKEN_FREQUENCY]:
+            del self.by_token[token]
+        self.used: Set[tuple] = set()
+
+    def claim(self, candidate: Candidate):
+        self.used.add((candidate.kind, candidate.id))
+
+    def available(self, candidate: Candidate) -> bool:
+        return (candidate.kind, candidate.id) not in self.used
+
+    def nearest(self, cents: int, line_date: date) -> Optional[Candidate]:
+        """Closest-dated available payment of this amount in the window, else the closest open invoice"""
+        buckets = self.by_amount.get(cents)
+        if buckets is None:
+            return None
+        day = line_date.toordinal()
+        return (
+            buckets["payment"].nearest(self.used, day, day - RECON_DATE_WINDOW_DAYS, day + RECON_DATE_WINDOW_DAYS)
+            or buckets["invoice"].nearest(self.used, day, 0, day + RECON_DATE_WINDOW_DAYS)
+        )
+
+
+def _days_apart(line_date: date, candidate: Candidate) -> Optional[int]:
+    """Distance in days if the candidate is inside the line's date window, else None"""
+    if candidate.date is None:
+        return 0
+    gap = abs((line_date - candidate.date).days)
+    if candidate.kind == "invoice":
+        # An unrecorded receipt can settle any invoice issued before it
+        return gap if candidate.date <= line_date + timedelta(days=RECON_DATE_WINDOW_DAYS) else None
+    return gap if gap <= RECON_DATE_WINDOW_DAYS else None
+
+
+def _score(shared: int, candidate: Candidate, gap: int) -> tuple:
+    # Shared reference tokens dominate; recorded payments beat open invoices; closer dates win ties
+    return shared, candidate.kind == "payment", -gap
+
+
+def _line_key(line: Dict):
+    line_date = _to_date(line.get("date"))
+    cents = to_cents(line.get("amount"))
+    tokens = tokenize(line.get("description"), line.get("reference"), line.get("counterparty"))
+    return line_date, cents, tokens
+
+
+def _claim(index: MatchIndex, candidate: Candidate, method: str, confidence: str) -> Dict:
+    index.claim(candidate)
+    return {
+        "kind": candidate.kind,
+        "id": candidate.id,
+        "ref": candidate.ref,
+        "customer": candidate.customer,
+        "method": method,
+        "confidence": confidence,
+    }
+
+
+def match_exact(line: Dict, index: MatchIndex) -> Optional[Dict]:
+    """Same amount in cents, inside the date window; shared tokens break ties
+
+    Only candidates sharing a token with the line are scored one by one; otherwise the
+    closest-dated candidate of the amount is looked up, so repeated amounts stay cheap.
+    """
+    line_date, cents, tokens = _line_key(line)
+    shared = Counter()
+    for token in tokens:
+        for candidate in index.by_amount_token.get((cents, token), ()):
+            shared[candidate] += 1
+
+    best = None
+    for candidate, count in shared.items():
+        if not index.available(candidate):
+            continue
+        gap = _days_apart(line_date, candidate)
+        if gap is None:
+            continue
+        score = _score(count, candidate, gap)
+        if best is None or score > best[0]:
+            best = (score, candidate)
+    if best is not None:
+        return _claim(index, best[1], "amount+reference", "high")
+
+    candidate = index.nearest(cents, line_date)
+    if candidate is None:
+        return None
+    return _claim(index, candidate, "amount", "medium")
+
+
+def match_fuzzy(line: Dict, index: MatchIndex) -> Optional[Dict]:
+    """Candidates sharing the most tokens with the line (bounded), amount within tolerance"""
+    line_date, cents, tokens = _line_key(line)
+    shared = Counter()
+    for token in tokens:
+        for candidate in index.by_token.get(token, ()):
+            shared[candidate] += 1
+    tolerance = max(100, int(cents * RECON_AMOUNT_TOLERANCE))
+    best = None
+    for candidate, count in shared.most_common(RECON_FUZZY_MAX_CANDIDATES):
+        if not index.available(candidate) or abs(candidate.cents - cents) > tolerance:
+            continue
+        gap = _days_apart(line_date, candidate)
+        if gap is None:
+            continue
+        score = _score(count, candidate, gap)
+        if best is None or score > best[0]:
+            best = (score, candidate)
+    if best is None:
+        return None
+    return _claim(index, best[1], "fuzzy", "low")
+
+
+def match_lines(lines: List[Dict], payments: Iterable[Dict], invoices: Iterable[Dict], exclude: Set[tuple] = frozenset()) -> Dict[str, Optional[Dict]]:
+    """line_id -> match (or None) for every dated credit line; `exclude` holds (kind, id) already reconciled
+
+    Every line gets its exact-amount chance before any fuzzy match can claim a candidate.
+    """
+    index = MatchIndex([payment_candidate(p) for p in payments] + [invoice_candidate(inv) for inv in invoices])
+    index.used.update(exclude)
+    credits = sorted(
+        (line for line in lines if to_cents(line.get("amount")) > 0 and _to_date(line.get("date"))),
+        key=lambda line: line.get("date", "")
+    )
+    matches = {line["line_id"]: match_exact(line, index) for line in credits}
+    for line in credits:
+        if matches[line["line_id"]] is None:
+            matches[line["line_id"]] = match_fuzzy(line, index)
+    return matches
+
+
+async def store_statement(user_id: str, organization_id: Optional[str], filename: str, statement_format: str, lines: List[Dict]) -> Dict:
+    """Save parsed lines (re-uploaded lines are kept as they are) and the statement record"""
+    db = init_db()
+    statement_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "line_id": line["line_id"]},
+            {"$setOnInsert": {
+                **line,
+                "user_id": user_id,
+                "organization_id": organization_id,
+                "statement_id": statement_id,
+                "status": "unmatched" if line["amount"] > 0 else "ignored",
+                "match": None,
+                "uploaded_at": now,
+            }},
+            upsert=True
+        )
+        for line in lines
+    ]
+    new_lines = 0
+    if operations:
+        result = await db.bank_statement_lines.bulk_write(operations, ordered=False)
+        new_lines = result.upserted_count
+
+    statement = {
+        "statement_id": statement_id,
+        "user_id": user_id,
+        "organization_id": organization_id,
+        "filename": filename,
+        "format": statement_format,
+        "lines": len(lines),
+        "new_lines": new_lines,
+        "uploaded_at": now,
+    }
+    await db.bank_statements.insert_one(dict(statement))
+    return statement
+
+
+async def reconcile_user(user_id: str, organization_id: Optional[str]) -> Dict:
+    """Match every unmatched credit line for a user against Zoho payments and open invoices"""
+    db = init_db()
+    lines = [
+        line async for line in db.bank_statement_lines.find(
+            {"user_id": user_id, "status": "unmatched"},
+            {"_id": 0, "line_id": 1, "date": 1, "amount": 1, "description": 1, "reference": 1, "counterparty": 1}
+        )
+    ]
+    if not lines:
+        return {"matched": 0, "unmatched": 0}
+
+    payments, snapshot = await asyncio.gather(
+        get_payments(user_id, raise_errors=True, all_pages=True),
+        load_invoice_snapshot(user_id, status="unpaid", raise_errors=True),
+    )
+    exclude = {
+        (doc["match"]["kind"], doc["match"]["id"])
+        async for doc in db.bank_statement_lines.find({"user_id": user_id, "status": "matched"}, {"_id": 0, "match": 1})
+    }
+
+    matches = await asyncio.to_thread(match_lines, lines, payments, snapshot.unpaid(), exclude)
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "line_id": line_id, "status": "unmatched"},
+            {"$set": {"status": "matched", "match": match, "matched_at": now}}
+        )
+        for line_id, match in matches.items() if match
+    ]
+    if operations:
+        await db.bank_statement_lines.bulk_write(operations, ordered=False)
+    return {"matched": len(operations), "unmatched": len(matches) - len(operations)}
+
+
+async def ingest_statement(user_id: str, organization_id: Optional[str], filename: str, content: bytes) -> Dict:
+    """Parse and store an uploaded statement and queue its reconciliation (raises StatementParseError)"""
+    parsed = parse_statement(filename, content)
+    statement = await store_statement(user_id, organization_id, filename, parsed["format"], parsed["lines"])
+    job_id = await enqueue_job(
+        RECONCILE, user_id, {"organization_id": organization_id},
+        priority=PRIORITY_HIGH, key=f"{RECONCILE}:{user_id}"
+    )
+    return {**statement, "job_id": job_id}
+
+
+async def get_reconciliation_summary(user_id: str, limit: int = 20) -> Optional[Dict]:
+    """Latest matched and unmatched credit lines plus totals, or None if no statement was uploaded"""
+    db = init_db()
+    totals = {
+        doc["_id"]: doc
+        async for doc in db.bank_statement_lines.aggregate([
+            {"$match": {"user_id": user_id, "status": {"$in": ["matched", "unmatched"]}}},
+            {"$group": {"_id": "$status", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        ])
+    }
+    if not totals:
+        return None
+
+    projection = {"_id": 0, "line_id": 1, "date": 1, "amount": 1, "description": 1, "counterparty": 1, "status": 1, "match": 1}
+
+    async def latest(status: str) -> List[Dict]:
+        cursor = db.bank_statement_lines.find({"user_id": user_id, "status": status}, projection)
+        return await cursor.sort([("date", -1), ("line_id", 1)]).to_list(length=limit)
+
+    matched, unmatched = await asyncio.gather(latest("matched"), latest("unmatched"))
+    return {
+        "matched": matched,
+        "unmatched": unmatched,
+        "total_matched": totals.get("matched", {}).get("amount", 0.0),
+        "total_unmatched": totals.get("unmatched", {}).get("amount", 0.0),
+    }
+
+
+async def clear_reconciliation(user_id: str):
+    """Drop a user's statements and lines (on disconnect)"""
+    db = init_db()
+    await db.bank_statements.delete_many({"user_id": user_id})
+    await db.bank_statement_lines.delete_many({"user_id": user_id})
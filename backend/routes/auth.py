@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends
 from models import UserSignup, UserLogin, LoginResponse, UserResponse, StandardResponse
-from auth_utils import hash_password, verify_password, create_access_token, get_current_user
+from auth_utils import hash_password_async, verify_password_async, create_access_token, get_current_user
 from database import init_db
 from datetime import datetime
 from bson import ObjectId
@@ -17,7 +17,7 @@ async def signup(user_data: UserSignup):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash password and create user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     user_dict = {
         "name": user_data.name,
         "email": user_data.email,
@@ -43,9 +43,17 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Verify password
-    if not verify_password(credentials.password, user["password"]):
+    valid, new_hash = await verify_password_async(credentials.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Upgrade hashes made with an outdated cost factor
+    if new_hash:
+        await db.users.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"password": new_hash, "updated_at": datetime.utcnow()}}
+        )
+    
     # Create access token
     token_data = {
         "user_id": str(user["_id"]),
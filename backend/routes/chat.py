@@ -1,19 +1,23 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from models import ChatMessage, ChatResponse, ChatHistory, MessageItem
 from auth_utils import get_current_user
-from database import init_db
+from chat_store import append_messages, get_messages, CHAT_HISTORY_DEFAULT_LIMIT, CHAT_HISTORY_MAX_LIMIT
 from datetime import datetime
 from dotenv import load_dotenv
+from typing import AsyncIterator, Optional
 import uuid
 import os
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from openai import AsyncOpenAI
 from zoho_api_helper import (
     get_user_zoho_credentials, 
-    get_invoices, 
+    load_invoice_snapshot,
     get_customers,
     get_outstanding_receivables,
     search_invoices_by_customer,
-    get_payments
+    get_payments,
+    fetch_concurrently
 )
 import json
 
@@ -22,16 +26,35 @@ load_dotenv()
 
 router = APIRouter(prefix="/api/chat", tags=["Chat"])
 
-async def get_zoho_context(user_id: str) -> str:
+CHAT_MODEL = "gpt-5-nano"
+FALLBACK_RESPONSE = "I'm here to help you with collections management. Could you please rephrase your question or provide more details?"
+
+# Zoho data that is not back within this many seconds is left out of the prompt
+CHAT_ZOHO_DEADLINE = float(os.environ.get('CHAT_ZOHO_DEADLINE', '8'))
+
+# Recent messages loaded as context for each new turn
+CHAT_CONTEXT_MESSAGES = 20
+
+# Newest invoices read per turn (one Zoho page), so a chat turn never walks the whole ledger
+CHAT_INVOICE_LIMIT = 200
+
+# One pooled OpenAI client per process for streamed turns, closed on app shutdown
+_openai_client: Optional[AsyncOpenAI] = None
+
+def get_openai_client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+    return _openai_client
+
+async def close_openai_client():
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+
+def get_zoho_context(integration: Optional[dict]) -> str:
     """Get Zoho Books integration context for the user"""
-    db = init_db()
-    
-    integration = await db.integrations.find_one({
-        "user_id": user_id,
-        "type": "zohobooks",
-        "status": "active"
-    })
-    
     if integration and integration.get("mode") == "production":
         # User has REAL Zoho Books connected
         return f"User has Zoho Books connected (Email: {integration.get('email', 'N/A')}). You have access to their REAL accounting data via API. You can analyze actual invoices, payments, customers, and financial reports."
@@ -40,9 +63,10 @@ async def get_zoho_context(user_id: str) -> str:
     
     return "User does not have any accounting software connected yet."
 
-async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
+async def fetch_zoho_data_for_query(user_id: str, query: str, integration: Optional[dict] = None) -> str:
     """Fetch relevant Zoho Books data based on user's question"""
-    integration = await get_user_zoho_credentials(user_id)
+    if integration is None:
+        integration = await get_user_zoho_credentials(user_id)
     
     if not integration or integration.get("mode") != "production":
         return "No real Zoho Books data available."
@@ -50,20 +74,47 @@ async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
     query_lower = query.lower()
     context = []
     
+    # Build the fetch plan from query keywords, then run it concurrently
+    wants_invoices = any(word in query_lower for word in ['invoice', 'bill', 'latest', 'recent', 'all', 'show', 'list'])
+    wants_customers = any(word in query_lower for word in ['customer', 'client', 'account', 'contact'])
+    wants_payments = any(word in query_lower for word in ['payment', 'paid', 'received', 'collection'])
+    wants_summary = any(word in query_lower for word in ['receivable', 'summary', 'total', 'outstanding'])
+    
+    plan = {}
+    if wants_invoices:
+        # Newest page only; questions about open invoices only read unpaid ones,
+        # and the overdue view is derived from the same pull
+        status = "unpaid" if any(word in query_lower for word in ['overdue', 'unpaid', 'due', 'pending']) else None
+        plan["invoices"] = load_invoice_snapshot(user_id, status=status, raise_errors=True, limit=CHAT_INVOICE_LIMIT)
+    if wants_customers:
+        plan["customers"] = get_customers(user_id, raise_errors=True)
+    if wants_payments:
+        plan["payments"] = get_payments(user_id, raise_errors=True)
+    if wants_summary:
+        plan["receivables"] = get_outstanding_receivables(user_id, raise_errors=True)
+    
+    if not plan:
+        return "I've checked your Zoho Books account. Please ask specific questions about invoices, customers, payments, or outstanding amounts."
+    
     try:
-        # Fetch relevant data based on query keywords
+        # Sources that miss the per-turn deadline are left out of the prompt
+        fetched = await fetch_concurrently(plan, timeout=CHAT_ZOHO_DEADLINE)
+        
         # Check for invoice-related queries
-        if any(word in query_lower for word in ['invoice', 'bill', 'latest', 'recent', 'all', 'show', 'list']):
-            # Fetch ALL invoices (not just overdue) for general queries
-            all_invoices = await get_invoices(user_id)  # Get all invoices
-            unpaid_invoices = await get_invoices(user_id, status="unpaid")
-            overdue_invoices = await get_invoices(user_id, status="overdue")
+        if "invoices" in fetched.results:
+            snapshot = fetched.get("invoices")
+            all_invoices = snapshot.invoices
+            overdue_invoices = snapshot.overdue()
             
             if all_invoices:
                 # Sort by date to get latest invoices
                 sorted_invoices = sorted(all_invoices, key=lambda x: x.get('date', ''), reverse=True)[:10]
-                context.append(f"Total Invoices: {len(all_invoices)}")
-                context.append(f"Unpaid: {len(unpaid_invoices)}, Overdue: {len(overdue_invoices)}")
+                scope = "Unpaid Invoices" if snapshot.status == "unpaid" else "Invoices"
+                if len(all_invoices) >= CHAT_INVOICE_LIMIT:
+                    context.append(f"{scope} (latest {CHAT_INVOICE_LIMIT} only): {len(all_invoices)}")
+                else:
+                    context.append(f"Total {scope}: {len(all_invoices)}")
+                context.append(f"Unpaid: {len(snapshot.unpaid())}, Overdue: {len(overdue_invoices)}")
                 context.append("\nRecent Invoices:")
                 for inv in sorted_invoices[:5]:
                     status_text = inv.get('status', 'N/A')
@@ -78,8 +129,8 @@ async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
                     context.append(f"- Invoice #{inv.get('invoice_number')}: {inv.get('customer_name')} - ₹{inv.get('balance')} (Due: {inv.get('due_date')})")
         
         # Check for customer-related queries
-        if any(word in query_lower for word in ['customer', 'client', 'account', 'contact']):
-            customers = await get_customers(user_id)
+        if "customers" in fetched.results:
+            customers = fetched.get("customers")
             if customers:
                 context.append(f"\nTotal Customers: {len(customers)}")
                 context.append("Top Customers by Outstanding:")
@@ -91,8 +142,8 @@ async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
                 context.append("No customers found in your Zoho Books account.")
         
         # Check for payment-related queries
-        if any(word in query_lower for word in ['payment', 'paid', 'received', 'collection']):
-            payments = await get_payments(user_id)
+        if "payments" in fetched.results:
+            payments = fetched.get("payments")
             if payments:
                 context.append(f"\nTotal Payments: {len(payments)}")
                 context.append("Recent Payments:")
@@ -102,11 +153,13 @@ async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
                 context.append("No payments found.")
         
         # Check for summary/total queries
-        if any(word in query_lower for word in ['receivable', 'summary', 'total', 'outstanding']):
-            receivables = await get_outstanding_receivables(user_id)
-            if receivables:
-                context.append(f"\nOutstanding Receivables Summary:")
-                context.append(f"- Total Outstanding: ₹{receivables.get('total_outstanding', 0)}")
+        receivables = fetched.get("receivables")
+        if receivables:
+            context.append(f"\nOutstanding Receivables Summary:")
+            context.append(f"- Total Outstanding: ₹{receivables.get('total_outstanding', 0)}")
+        
+        if fetched.failures:
+            context.append(f"\n(Not available right now: {', '.join(fetched.failed_sources)}. Do not guess these figures.)")
         
         return "\n".join(context) if context else "I've checked your Zoho Books account. Please ask specific questions about invoices, customers, payments, or outstanding amounts."
         
@@ -114,19 +167,14 @@ async def fetch_zoho_data_for_query(user_id: str, query: str) -> str:
         print(f"Error fetching Zoho data: {str(e)}")
         return f"Error fetching data from Zoho Books: {str(e)}"
 
-async def generate_ai_response(user_message: str, user_id: str, chat_history: list = None) -> str:
-    """Generate AI response using OpenAI GPT-5 Nano with Zoho Books context"""
+async def build_system_prompt(user_message: str, user_id: str) -> str:
+    """Build the assistant's system prompt with the user's Zoho Books context"""
     
-    # Get integration context
-    zoho_context = await get_zoho_context(user_id)
+    # Load the integration once for this turn and pass it through
+    integration = await get_user_zoho_credentials(user_id)
     
-    # Check if user has any Zoho Books integration (demo or production)
-    db = init_db()
-    integration = await db.integrations.find_one({
-        "user_id": user_id,
-        "type": "zohobooks",
-        "status": "active"
-    })
+    # Get integration context
+    zoho_context = get_zoho_context(integration)
     
     is_connected = integration is not None
     is_production_mode = integration and integration.get("mode") == "production"
@@ -134,7 +182,7 @@ async def generate_ai_response(user_message: str, user_id: str, chat_history: li
     # Fetch actual Zoho data if connected in production mode
     zoho_data_context = ""
     if is_production_mode:
-        zoho_data_context = await fetch_zoho_data_for_query(user_id, user_message)
+        zoho_data_context = await fetch_zoho_data_for_query(user_id, user_message, integration)
     
     dummy_data_instruction = ""
     if not is_connected:
@@ -174,6 +222,10 @@ When the user has Zoho Books connected, you can help them:
 
 Be professional, empathetic, and provide actionable insights. Keep responses concise and focused on collections management."""
 
+    return system_prompt
+
+async def complete_ai_response(system_prompt: str, user_message: str, user_id: str) -> str:
+    """Get the full completion for a prompt in one call"""
     try:
         # Initialize LlmChat with GPT-5 Nano
         api_key = os.environ.get('OPENAI_API_KEY')
@@ -181,7 +233,7 @@ Be professional, empathetic, and provide actionable insights. Keep responses con
             api_key=api_key,
             session_id=user_id,  # Use user_id as session for now
             system_message=system_prompt
-        ).with_model("openai", "gpt-5-nano")
+        ).with_model("openai", CHAT_MODEL)
         
         # Create user message
         user_msg = UserMessage(text=user_message)
@@ -193,28 +245,57 @@ Be professional, empathetic, and provide actionable insights. Keep responses con
     except Exception as e:
         print(f"GPT-5 Nano API Error: {str(e)}")
         # Fallback to basic response
-        return "I'm here to help you with collections management. Could you please rephrase your question or provide more details?"
+        return FALLBACK_RESPONSE
+
+async def generate_ai_response(user_message: str, user_id: str, chat_history: list = None) -> str:
+    """Generate AI response using OpenAI GPT-5 Nano with Zoho Books context"""
+    system_prompt = await build_system_prompt(user_message, user_id)
+    return await complete_ai_response(system_prompt, user_message, user_id)
+
+async def stream_ai_response(user_message: str, user_id: str) -> AsyncIterator[str]:
+    """Yield the AI response as text deltas while the model generates it
+    
+    Falls back to a single full completion when streaming cannot be started.
+    """
+    system_prompt = await build_system_prompt(user_message, user_id)
+    
+    try:
+        stream = await get_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            stream=True
+        )
+    except Exception as e:
+        print(f"GPT-5 Nano streaming error: {str(e)}")
+        yield await complete_ai_response(system_prompt, user_message, user_id)
+        return
+    
+    # Closing hands the connection back to the pool even when the client disconnects mid-stream
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     chat_msg: ChatMessage,
     current_user: dict = Depends(get_current_user)
 ):
-    db = init_db()
-    
     # Generate or use existing session_id
     session_id = chat_msg.session_id if chat_msg.session_id else str(uuid.uuid4())
     user_id = current_user["user_id"]
     
-    # Get existing chat history for context
+    # Get recent chat history for context
     chat_history = []
-    if session_id:
-        existing_session = await db.chat_sessions.find_one({
-            "user_id": user_id,
-            "session_id": session_id
-        })
-        if existing_session and "messages" in existing_session:
-            chat_history = existing_session["messages"]
+    if chat_msg.session_id:
+        chat_history, _ = await get_messages(user_id, session_id, limit=CHAT_CONTEXT_MESSAGES)
     
     # Create user message
     user_msg = {
@@ -231,16 +312,8 @@ async def send_message(
         "timestamp": datetime.utcnow()
     }
     
-    # Update or create chat session
-    await db.chat_sessions.update_one(
-        {"user_id": user_id, "session_id": session_id},
-        {
-            "$push": {"messages": {"$each": [user_msg, ai_msg]}},
-            "$set": {"updated_at": datetime.utcnow()},
-            "$setOnInsert": {"created_at": datetime.utcnow()}
-        },
-        upsert=True
-    )
+    # Append both messages to the session's current bucket
+    await append_messages(user_id, session_id, [user_msg, ai_msg])
     
     return ChatResponse(
         response=ai_response_text,
@@ -248,33 +321,82 @@ async def send_message(
         timestamp=ai_msg["timestamp"]
     )
 
+@router.post("/stream")
+async def stream_message(
+    chat_msg: ChatMessage,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the assistant's reply as Server-Sent Events
+    
+    Emits `start` (session_id), one `token` event per text delta, then `done` once the
+    turn has been saved. The saved messages match what POST /message would store.
+    """
+    session_id = chat_msg.session_id if chat_msg.session_id else str(uuid.uuid4())
+    user_id = current_user["user_id"]
+    
+    user_msg = {
+        "sender": "user",
+        "message": chat_msg.message,
+        "timestamp": datetime.utcnow()
+    }
+    
+    async def event_stream():
+        yield sse_event("start", {"session_id": session_id})
+        
+        parts = []
+        try:
+            async for delta in stream_ai_response(chat_msg.message, user_id):
+                parts.append(delta)
+                yield sse_event("token", {"token": delta})
+        except Exception as e:
+            print(f"GPT-5 Nano streaming error: {str(e)}")
+            if not parts:
+                parts.append(FALLBACK_RESPONSE)
+                yield sse_event("token", {"token": FALLBACK_RESPONSE})
+        
+        ai_msg = {
+            "sender": "assistant",
+            "message": "".join(parts) or FALLBACK_RESPONSE,
+            "timestamp": datetime.utcnow()
+        }
+        await append_messages(user_id, session_id, [user_msg, ai_msg])
+        
+        yield sse_event("done", {"session_id": session_id, "timestamp": ai_msg["timestamp"].isoformat()})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history", response_model=ChatHistory)
 async def get_chat_history(
     session_id: str = None,
+    before: Optional[int] = Query(None, ge=0, description="Return messages older than this message id"),
+    limit: int = Query(CHAT_HISTORY_DEFAULT_LIMIT, ge=1, le=CHAT_HISTORY_MAX_LIMIT),
     current_user: dict = Depends(get_current_user)
 ):
-    db = init_db()
     user_id = current_user["user_id"]
     
-    # Build query
-    query = {"user_id": user_id}
-    if session_id:
-        query["session_id"] = session_id
-    
-    # Get chat session(s)
+    # Get one page of the session's messages
     if session_id:
-        session = await db.chat_sessions.find_one(query)
-        if session and "messages" in session:
+        page, next_before = await get_messages(user_id, session_id, before=before, limit=limit)
+        if page:
             messages = [
                 MessageItem(
-                    id=str(i),
+                    id=str(msg["seq"]),
                     sender=msg["sender"],
                     message=msg["message"],
                     timestamp=msg["timestamp"]
                 )
-                for i, msg in enumerate(session["messages"])
+                for msg in page
             ]
-            return ChatHistory(messages=messages)
+            return ChatHistory(
+                messages=messages,
+                next_before=str(next_before) if next_before is not None else None
+            )
+        if before is not None:
+            return ChatHistory(messages=[])
     
     # Return empty or initial message
     return ChatHistory(messages=[
@@ -7,6 +7,20 @@ from datetime import datetime
 import os
 import secrets
 import httpx
+from zoho_client import get_zoho_client
+from cache_broadcast import broadcast_invalidation
+from zoho_mirror import clear_mirror
+from dso_engine import clear_dso
+from dashboard_views import clear_views
+from reconciliation_engine import clear_reconciliation
+from zoho_sync import schedule_mirror_sync
+from job_queue import PRIORITY_HIGH
+from zoho_api_helper import refresh_access_token, token_expiry
+from zoho_webhooks import (
+    ZOHO_WEBHOOK_SIGNATURE_HEADER, ZOHO_WEBHOOK_MAX_BYTES, WebhookError,
+    parse_payload, parse_event, verify_signature, find_webhook_integrations, webhook_secrets,
+    enqueue_event, schedule_webhook_processing, clear_webhook_events
+)
 
 router = APIRouter(prefix="/api/integrations", tags=["Integrations"])
 
@@ -35,6 +49,15 @@ class IntegrationStatus(BaseModel):
     zohobooks_connected: bool
     zohobooks_email: Optional[str] = None
     last_sync: Optional[str] = None
+    needs_reauth: bool = False
+
+class ZohoSyncRequest(BaseModel):
+    full: bool = False
+
+class ZohoWebhookConfig(BaseModel):
+    webhook_url: str
+    secret: str
+    signature_header: str
 
 class UserOAuthSetup(BaseModel):
     client_id: str
@@ -113,6 +136,8 @@ async def demo_connect_zoho(current_user: dict = Depends(get_current_user)):
         result = await db.integrations.insert_one(integration_data)
         integration_id = str(result.inserted_id)
     
+    await broadcast_invalidation(user_id)
+    
     return IntegrationResponse(
         success=True,
         message="Zoho Books connected in demo mode",
@@ -198,69 +223,85 @@ async def zoho_oauth_callback(
     
     # Exchange authorization code for access token
     try:
-        async with httpx.AsyncClient() as http_client:
-            token_response = await http_client.post(
-                ZOHO_TOKEN_URL,
-                data={
-                    "code": callback_data.code,
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "redirect_uri": redirect_uri,
-                    "grant_type": "authorization_code"
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            
-            if token_response.status_code != 200:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Failed to exchange code for token: {token_response.text}"
-                )
-            
-            token_data = token_response.json()
-            
-            # Store access token and refresh token securely
-            integration_data = {
-                "user_id": user_id,
-                "type": "zohobooks",
-                "email": current_user.get("email"),
-                "organization_id": user_oauth.get("organization_id"),
-                "connected_at": datetime.utcnow(),
-                "status": "active",
-                "last_sync": datetime.utcnow(),
-                "access_token": token_data.get("access_token"),  # Should be encrypted in production
-                "refresh_token": token_data.get("refresh_token"),  # Should be encrypted in production
-                "token_expires_in": token_data.get("expires_in"),
+        http_client = get_zoho_client()
+        token_response = await http_client.post(
+            ZOHO_TOKEN_URL,
+            data={
+                "code": callback_data.code,
                 "client_id": client_id,
-                "client_secret": client_secret,  # Should be encrypted in production
-                "mode": "production"
-            }
-            
-            # Check if integration exists
-            existing = await db.integrations.find_one({
-                "user_id": user_id,
-                "type": "zohobooks"
-            })
-            
-            if existing:
-                await db.integrations.update_one(
-                    {"user_id": user_id, "type": "zohobooks"},
-                    {"$set": integration_data}
-                )
-                integration_id = str(existing["_id"])
-            else:
-                result = await db.integrations.insert_one(integration_data)
-                integration_id = str(result.inserted_id)
-            
-            # Clean up OAuth credentials document
-            await db.user_oauth_credentials.delete_one({"_id": user_oauth["_id"]})
-            
-            return IntegrationResponse(
-                success=True,
-                message="Zoho Books connected successfully",
-                integration_id=integration_id
+                "client_secret": client_secret,
+                "redirect_uri": redirect_uri,
+                "grant_type": "authorization_code"
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        
+        if token_response.status_code != 200:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Failed to exchange code for token: {token_response.text}"
+            )
+        
+        token_data = token_response.json()
+        issued_at = datetime.utcnow()
+        
+        # Store access token and refresh token securely
+        integration_data = {
+            "user_id": user_id,
+            "type": "zohobooks",
+            "email": current_user.get("email"),
+            "organization_id": user_oauth.get("organization_id"),
+            "connected_at": datetime.utcnow(),
+            "status": "active",
+            "last_sync": datetime.utcnow(),
+            "access_token": token_data.get("access_token"),  # Should be encrypted in production
+            "refresh_token": token_data.get("refresh_token"),  # Should be encrypted in production
+            "token_expires_in": token_data.get("expires_in"),
+            "token_expires_at": token_expiry(issued_at, token_data.get("expires_in")),
+            "client_id": client_id,
+            "client_secret": client_secret,  # Should be encrypted in production
+            "mode": "production"
+        }
+        
+        # Check if integration exists
+        existing = await db.integrations.find_one({
+            "user_id": user_id,
+            "type": "zohobooks"
+        })
+        
+        if existing:
+            # A new consent gives a new refresh token, so earlier refresh failures no longer apply
+            await db.integrations.update_one(
+                {"user_id": user_id, "type": "zohobooks"},
+                {"$set": integration_data, "$unset": {
+                    "token_refresh_failures": "",
+                    "token_refresh_revocations": "",
+                    "token_refresh_error": "",
+                    "token_refresh_failed_at": "",
+                    "token_refresh_retry_at": "",
+                    "needs_reauth": "",
+                }}
             )
-            
+            integration_id = str(existing["_id"])
+        else:
+            result = await db.integrations.insert_one(integration_data)
+            integration_id = str(result.inserted_id)
+        
+        # Clean up OAuth credentials document
+        await db.user_oauth_credentials.delete_one({"_id": user_oauth["_id"]})
+        
+        # Integration and responses cached for a previous connection are no longer valid
+        await broadcast_invalidation(user_id)
+        
+        # Populate the local mirror in the background
+        await schedule_mirror_sync(user_id, full=True, priority=PRIORITY_HIGH)
+        
+        return IntegrationResponse(
+            success=True,
+            message="Zoho Books connected successfully",
+            integration_id=integration_id
+        )
+        
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Network error: {str(e)}")
 
@@ -282,7 +323,8 @@ async def get_integration_status(
         return IntegrationStatus(
             zohobooks_connected=True,
             zohobooks_email=zoho_integration.get("email"),
-            last_sync=zoho_integration.get("last_sync").isoformat() if zoho_integration.get("last_sync") else None
+            last_sync=zoho_integration.get("last_sync").isoformat() if zoho_integration.get("last_sync") else None,
+            needs_reauth=bool(zoho_integration.get("needs_reauth"))
         )
     
     return IntegrationStatus(
@@ -308,11 +350,126 @@ async def disconnect_zoho(
         "user_id": user_id
     })
     
+    # Drop mirrored Zoho records and cached integration/responses
+    await clear_mirror(user_id)
+    await clear_dso(user_id)
+    await clear_views(user_id)
+    await clear_reconciliation(user_id)
+    await clear_webhook_events(user_id)
+    await broadcast_invalidation(user_id)
+    
     return {
         "success": True, 
         "message": f"Zoho Books disconnected successfully. Cleared {result.deleted_count} integration(s)."
     }
 
+@router.post("/zoho/sync")
+async def sync_zoho_data(
+    sync_request: ZohoSyncRequest = ZohoSyncRequest(),
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue a sync of invoices, payments and contacts into the local mirror"""
+    db = init_db()
+    user_id = current_user["user_id"]
+    
+    integration = await db.integrations.find_one({
+        "user_id": user_id,
+        "type": "zohobooks",
+        "status": "active",
+        "mode": "production"
+    })
+    
+    if not integration:
+        raise HTTPException(status_code=404, detail="No active production Zoho Books integration found")
+    
+    job_id = await schedule_mirror_sync(user_id, full=sync_request.full, priority=PRIORITY_HIGH)
+    
+    return {
+        "success": True,
+        "message": "Sync queued",
+        "job_id": job_id,
+        "mirror_synced_at": integration.get("mirror_synced_at").isoformat() if integration.get("mirror_synced_at") else None
+    }
+
+@router.post("/zoho/webhook-secret", response_model=ZohoWebhookConfig)
+async def rotate_zoho_webhook_secret(
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Generate (or rotate) the secret Zoho Books signs this user's webhooks with"""
+    db = init_db()
+    user_id = current_user["user_id"]
+    
+    integration = await db.integrations.find_one({
+        "user_id": user_id,
+        "type": "zohobooks",
+        "status": "active",
+        "mode": "production"
+    })
+    
+    if not integration or not integration.get("organization_id"):
+        raise HTTPException(status_code=404, detail="No active production Zoho Books integration found")
+    
+    secret = secrets.token_urlsafe(32)
+    await db.integrations.update_one({"_id": integration["_id"]}, {"$set": {"webhook_secret": secret}})
+    await broadcast_invalidation(user_id)
+    
+    webhook_url = request.url_for("receive_zoho_webhook").include_query_params(
+        organization_id=integration["organization_id"]
+    )
+    return ZohoWebhookConfig(
+        webhook_url=str(webhook_url),
+        secret=secret,
+        signature_header=ZOHO_WEBHOOK_SIGNATURE_HEADER
+    )
+
+async def read_body_limited(request: Request, max_bytes: int) -> bytes:
+    """Read a request body, stopping with 413 as soon as it exceeds max_bytes"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail="Request body too large")
+    
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail="Request body too large")
+    return bytes(body)
+
+@router.post("/zoho/webhook")
+async def receive_zoho_webhook(request: Request, organization_id: Optional[str] = None):
+    """Receive a signed Zoho Books change event and queue it for the organization's users"""
+    body = await read_body_limited(request, ZOHO_WEBHOOK_MAX_BYTES)
+    
+    try:
+        payload = parse_payload(body, request.headers.get("content-type", ""))
+        event = parse_event(payload, request.query_params.get("event_type"))
+    except WebhookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    organization_id = organization_id or payload.get("organization_id")
+    if not organization_id:
+        raise HTTPException(status_code=400, detail="organization_id is required")
+    
+    # Only the integrations whose secret signed this body receive the event
+    signature = request.headers.get(ZOHO_WEBHOOK_SIGNATURE_HEADER)
+    integrations = [
+        integration for integration in await find_webhook_integrations(str(organization_id))
+        if verify_signature(body, signature, webhook_secrets(integration))
+    ]
+    if not integrations:
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    
+    if event is None:
+        # Signed but not an invoice, payment or contact event: acknowledge so Zoho does not retry
+        return {"success": True, "queued": 0}
+    
+    for integration in integrations:
+        await enqueue_event(integration, event)
+        await schedule_webhook_processing(integration["user_id"])
+    
+    return {"success": True, "queued": len(integrations)}
+
 @router.post("/zoho/force-refresh")
 async def force_refresh_token(
     current_user: dict = Depends(get_current_user)
@@ -341,11 +498,12 @@ async def force_refresh_token(
             detail="Missing credentials for token refresh. Please reconnect Zoho Books."
         )
     
-    # Attempt token refresh
-    from zoho_api_helper import refresh_zoho_token
-    new_token = await refresh_zoho_token(user_id, refresh_token, client_id, client_secret)
+    # Attempt token refresh (serialized with any refresh already in progress); an explicit
+    # request skips the backoff left by earlier failures
+    new_token = await refresh_access_token(user_id, force=True)
     
     if new_token:
+        await broadcast_invalidation(user_id)
         return {
             "success": True,
             "message": "Token refreshed successfully"
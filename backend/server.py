@@ -1,26 +1,41 @@
-from fastapi import FastAPI, APIRouter, Request
+from fastapi import FastAPI, APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
 
-# Import route modules
-from routes import auth, chat, demo_contact, dashboard, integrations
-
+# Load environment before importing modules that read their settings at import time
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Import route modules
+from routes import auth, chat, demo_contact, dashboard, integrations
+from zoho_client import init_zoho_client, close_zoho_client, get_pool_metrics
+from zoho_cache import zoho_cache
+from zoho_api_helper import zoho_inflight
+from zoho_rate_limiter import get_rate_limit_metrics
+from zoho_token_scheduler import start_token_scheduler, stop_token_scheduler
+from integration_cache import IntegrationScopeMiddleware, get_integration_cache_metrics
+from auth_utils import get_password_pool_metrics, require_metrics_token
+from database import init_db, close_db, get_pool_metrics as get_mongo_pool_metrics
+from db_indexes import ensure_indexes, verify_required_indexes
+from fast_response import FastJSONResponse, FAST_JSON_RESPONSES, get_serialization_metrics
+from job_queue import get_queue_metrics
+from cache_broadcast import start_cache_broadcast, stop_cache_broadcast, get_cache_broadcast_metrics
+from worker import start_job_worker, stop_job_worker, get_worker_metrics
+
+# MongoDB connection (the single per-process client every route shares)
+db = init_db()
 
 # Create the main app without a prefix
-app = FastAPI(title="Vasool API", version="1.0.0")
+app = FastAPI(
+    title="Vasool API",
+    version="1.0.0",
+    default_response_class=FastJSONResponse if FAST_JSON_RESPONSES else JSONResponse
+)
 
 # Custom exception handler for validation errors
 @app.exception_handler(RequestValidationError)
@@ -61,6 +76,23 @@ api_router = APIRouter(prefix="/api")
 async def root():
     return {"message": "Vasool API is running"}
 
+# Internal runtime metrics (scrapers send METRICS_TOKEN as a bearer token)
+@api_router.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    return {
+        "mongo_pool": get_mongo_pool_metrics(),
+        "zoho_http": get_pool_metrics(),
+        "zoho_cache": zoho_cache.metrics(),
+        "zoho_inflight": zoho_inflight.metrics(),
+        "zoho_rate_limits": get_rate_limit_metrics(),
+        "integration_cache": get_integration_cache_metrics(),
+        "cache_broadcast": get_cache_broadcast_metrics(),
+        "password_hashing": get_password_pool_metrics(),
+        "jobs": await get_queue_metrics(),
+        "job_worker": get_worker_metrics(),
+        "serialization": get_serialization_metrics()
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -71,6 +103,8 @@ app.include_router(demo_contact.router)
 app.include_router(dashboard.router)
 app.include_router(integrations.router)
 
+app.add_middleware(IntegrationScopeMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -86,6 +120,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_indexes():
+    if os.environ.get('MONGO_ENSURE_INDEXES', 'true').lower() in ('1', 'true', 'yes'):
+        await ensure_indexes(db)
+    # Checked even when index creation is skipped or failed above
+    await verify_required_indexes(db)
+
+@app.on_event("startup")
+async def startup_zoho_client():
+    init_zoho_client()
+    start_token_scheduler()
+    start_cache_broadcast()
+    start_job_worker()
+
 @app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def shutdown_clients():
+    # Stopping the worker, poller and scheduler still writes to Mongo (releasing leased
+    # jobs), so the database client is closed last
+    await stop_job_worker()
+    await stop_cache_broadcast()
+    await stop_token_scheduler()
+    await close_zoho_client()
+    await chat.close_openai_client()
+    close_db()
\ No newline at end of file
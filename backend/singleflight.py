@@ -0,0 +1,63 @@
+"""
+Single-flight call registry
+Concurrent callers asking for the same key await one shared in-flight task
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key
+
+    The shared call runs as its own task, so a caller that is cancelled (client
+    disconnect, timeout) does not cancel the work other callers are awaiting.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def get(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._calls.get(key)
+
+    def start(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Start a call for key unconditionally and register it until it finishes"""
+        future = asyncio.ensure_future(factory())
+        self._calls[key] = future
+        self._stats["calls"] += 1
+
+        def unregister(done: asyncio.Future):
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            # Mark the error as retrieved; every waiter still gets it through the shield
+            if not done.cancelled():
+                done.exception()
+
+        future.add_done_callback(unregister)
+        return future
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight call for key, starting it if there is none"""
+        future = self._calls.get(key)
+        if future is None:
+            future = self.start(key, factory)
+        else:
+            self._stats["coalesced"] += 1
+        return await asyncio.shield(future)
+
+    def forget(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Detach in-flight calls matching predicate so later callers start fresh ones"""
+        keys = [key for key in self._calls if predicate(key)]
+        for key in keys:
+            del self._calls[key]
+        return len(keys)
+
+    def metrics(self) -> Dict:
+        return {**self._stats, "in_flight": len(self._calls)}
@@ -0,0 +1,303 @@
+"""
+Multi-tenant sync orchestrator
+Mirror-syncs every active production integration in one run. A run snapshots its
+tenants into sync_run_tenants; coroutines claim them one at a time (at most
+SYNC_CONCURRENCY at once overall and SYNC_PER_ORG_CONCURRENCY per Zoho
+organization) and checkpoint each tenant's outcome, so a crashed or timed-out run
+resumes with the tenants it had not finished.
+
+Each tenant is synced through a mirror_sync job under the same key every other sync
+of that user uses, so a run never overlaps a webhook- or read-triggered sync. The
+orchestrator claims and runs that job itself rather than waiting for a worker slot:
+a sync_all job holds one slot, and waiting on the pool from there would leave the
+run only the remaining slots (none with JOB_WORKER_CONCURRENCY=1). The per-organization cap counts the run's running tenants in Mongo, so it holds
+across orchestrators (concurrent claims in different processes can briefly exceed
+it, as with JOB_TENANT_CONCURRENCY); the shared Zoho rate windows still keep every
+organization inside its quota.
+
+    python sync_orchestrator.py run [--full] [--concurrency N] [--per-org N] [--deadline SECONDS]
+    python sync_orchestrator.py resume [RUN_ID] [--concurrency N] [--per-org N] [--deadline SECONDS]
+    python sync_orchestrator.py status [RUN_ID]
+
+The sync_all job type runs the same thing from the job worker.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment before importing modules that read their settings at import time
+load_dotenv(Path(__file__).parent / '.env')
+
+from pymongo import InsertOne, ReturnDocument
+from database import init_db
+from job_queue import run_job_inline, PRIORITY_LOW
+from zoho_sync import run_mirror_sync, schedule_mirror_sync
+
+logger = logging.getLogger(__name__)
+
+# Tenants synced at once by one orchestrator, and per Zoho organization (whose API quota they share)
+SYNC_CONCURRENCY = int(os.environ.get('SYNC_CONCURRENCY', '20'))
+SYNC_PER_ORG_CONCURRENCY = int(os.environ.get('SYNC_PER_ORG_CONCURRENCY', '1'))
+# A claimed tenant is handed to another orchestrator once its lease lapses (seconds)
+SYNC_TENANT_LEASE = 15 * 60
+SYNC_TENANT_MAX_ATTEMPTS = 3
+# A tenant whose sync job has not finished after this long is retried later in the run
+# (the queued job is reused); it bounds waiting on a sync of the same user running elsewhere
+SYNC_TENANT_TIMEOUT = 60 * 60
+
+
+async def start_run(full: bool = False, job_id=None) -> str:
+    """Record a run and snapshot the tenants it will sync; returns the run id"""
+    db = init_db()
+    run_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+
+    operations = []
+    async for integration in db.integrations.find(
+        {"type": "zohobooks", "status": "active", "mode": "production"},
+        {"_id": 0, "user_id": 1, "organization_id": 1}
+    ):
+        operations.append(InsertOne({
+            "run_id": run_id,
+            "user_id": integration["user_id"],
+            "organization_id": integration.get("organization_id"),
+            "status": "pending",
+            "attempts": 0,
+        }))
+    if operations:
+        await db.sync_run_tenants.bulk_write(operations, ordered=False)
+
+    await db.sync_runs.insert_one({
+        "_id": run_id,
+        "job_id": job_id,
+        "full": full,
+        "status": "running",
+        "tenants": len(operations),
+        "started_at": now,
+    })
+    logger.info(f"Sync run {run_id} started for {len(operations)} tenant(s) ({'full' if full else 'incremental'})")
+    return run_id
+
+
+async def _claim_tenant(run_id: str, owner: str, full_orgs: List) -> Optional[Dict]:
+    db = init_db()
+    now = datetime.utcnow()
+    query = {
+        "run_id": run_id,
+        "$or": [
+            {"status": "pending"},
+            # Left behind by an orchestrator that crashed
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ],
+    }
+    if full_orgs:
+        query["organization_id"] = {"$nin": full_orgs}
+    return await db.sync_run_tenants.find_one_and_update(
+        query,
+        {"$set": {
+            "status": "running",
+            "owner": owner,
+            "started_at": now,
+            "lease_expires_at": now + timedelta(seconds=SYNC_TENANT_LEASE),
+        }, "$inc": {"attempts": 1}},
+        # Retried tenants go after the ones not tried yet
+        sort=[("attempts", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _full_orgs(run_id: str, per_org: int) -> List:
+    """Organizations with per_org of the run's tenants already running (in any orchestrator)
+
+    Tenants without an organization id are not one organization and are never capped.
+    """
+    db = init_db()
+    rows = await db.sync_run_tenants.aggregate([
+        {"$match": {
+            "run_id": run_id,
+            "status": "running",
+            "lease_expires_at": {"$gte": datetime.utcnow()},
+            "organization_id": {"$ne": None},
+        }},
+        {"$group": {"_id": "$organization_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gte": per_org}}},
+    ]).to_list(length=None)
+    return [row["_id"] for row in rows]
+
+
+async def _checkpoint(tenant: Dict, update: Dict):
+    db = init_db()
+    await db.sync_run_tenants.update_one(
+        {"_id": tenant["_id"]},
+        {"$set": {**update, "finished_at": datetime.utcnow()}, "$unset": {"owner": "", "lease_expires_at": ""}}
+    )
+
+
+async def _sync_tenant(tenant: Dict, full: bool, owner: str):
+    """Sync one tenant and checkpoint the outcome; failures are retried later in the run"""
+    db = init_db()
+
+    async def keep_lease():
+        while True:
+            await asyncio.sleep(SYNC_TENANT_LEASE / 3)
+            await db.sync_run_tenants.update_one(
+                {"_id": tenant["_id"]},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=SYNC_TENANT_LEASE)}}
+            )
+
+    heartbeat = asyncio.create_task(keep_lease())
+    try:
+        job_id = await schedule_mirror_sync(tenant["user_id"], full=full, priority=PRIORITY_LOW)
+        job = await run_job_inline(job_id, run_mirror_sync, owner, timeout=SYNC_TENANT_TIMEOUT)
+        if job is None:
+            raise TimeoutError(f"Sync job {job_id} did not finish within {SYNC_TENANT_TIMEOUT}s")
+        if job["status"] != "done":
+            raise RuntimeError(job.get("last_error") or f"Sync job {job_id} ended {job['status']}")
+        outcome = job.get("result") or {}
+        if outcome.get("synced"):
+            await _checkpoint(tenant, {"status": "done", "job_id": job["_id"], "entities": outcome.get("entities"), "error": None})
+        else:
+            await _checkpoint(tenant, {"status": "skipped", "job_id": job["_id"], "error": outcome.get("reason")})
+    except Exception as e:
+        retry = tenant["attempts"] < SYNC_TENANT_MAX_ATTEMPTS
+        logger.error(f"Sync of user {tenant['user_id']} failed (attempt {tenant['attempts']}): {str(e)}")
+        await _checkpoint(tenant, {"status": "pending" if retry else "failed", "error": str(e)})
+    finally:
+        heartbeat.cancel()
+
+
+async def run_progress(run_id: str) -> Dict[str, int]:
+    db = init_db()
+    counts = {"pending": 0, "running": 0, "done": 0, "skipped": 0, "failed": 0}
+    async for row in db.sync_run_tenants.aggregate([
+        {"$match": {"run_id": run_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+async def execute_run(
+    run_id: str,
+    concurrency: int = SYNC_CONCURRENCY,
+    per_org: int = SYNC_PER_ORG_CONCURRENCY,
+    deadline: Optional[float] = None,
+) -> Dict:
+    """Work through a run's remaining tenants; stops claiming after `deadline` seconds
+
+    Safe to call on a run another orchestrator is also executing: tenants are
+    claimed atomically. Returns the run's final (or paused) progress.
+    """
+    db = init_db()
+    run = await db.sync_runs.find_one({"_id": run_id})
+    if run is None:
+        raise ValueError(f"Unknown sync run {run_id}")
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    stop_at = time.monotonic() + deadline if deadline else None
+    # Claims in this process are serialized so each sees the ones before it
+    claiming = asyncio.Lock()
+
+    async def shard():
+        while stop_at is None or time.monotonic() < stop_at:
+            async with claiming:
+                tenant = await _claim_tenant(run_id, owner, await _full_orgs(run_id, per_org))
+            if tenant is None:
+                return
+            await _sync_tenant(tenant, run["full"], owner)
+
+    await db.sync_runs.update_one({"_id": run_id}, {"$set": {"status": "running", "resumed_at": datetime.utcnow()}})
+    await asyncio.gather(*(shard() for _ in range(concurrency)))
+
+    progress = await run_progress(run_id)
+    # Tenants still pending here were left by the deadline (or are being synced
+    # by another orchestrator) and are picked up by a resume
+    finished = not progress["pending"] and not progress["running"]
+    now = datetime.utcnow()
+    await db.sync_runs.update_one(
+        {"_id": run_id},
+        {"$set": {
+            "status": "done" if finished else "paused",
+            "progress": progress,
+            **({"finished_at": now} if finished else {}),
+        }}
+    )
+    if finished:
+        # Lets the run's tenant rows expire with it (TTL index)
+        await db.sync_run_tenants.update_many({"run_id": run_id}, {"$set": {"run_finished_at": now}})
+    logger.info(f"Sync run {run_id} {'finished' if finished else 'paused'}: {progress}")
+    return progress
+
+
+async def run_sync_job(job: Dict) -> Dict:
+    """sync_all job handler; a retried job resumes the run it started"""
+    payload = job.get("payload") or {}
+    db = init_db()
+    run = await db.sync_runs.find_one({"job_id": job["_id"]}, {"_id": 1})
+    run_id = run["_id"] if run else await start_run(full=payload.get("full", False), job_id=job["_id"])
+    progress = await execute_run(run_id, deadline=payload.get("deadline"))
+    return {"run_id": run_id, **progress}
+
+
+async def latest_run_id(unfinished: bool = False) -> Optional[str]:
+    db = init_db()
+    query = {"status": {"$ne": "done"}} if unfinished else {}
+    run = await db.sync_runs.find_one(query, {"_id": 1}, sort=[("started_at", -1)])
+    return run["_id"] if run else None
+
+
+def _print_progress(run_id: str, progress: Dict[str, int]):
+    print(f"Sync run {run_id}")
+    for status, count in progress.items():
+        print(f"  {status:<8} {count}")
+
+
+async def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="sync_orchestrator.py")
+    parser.add_argument("command", choices=("run", "resume", "status"))
+    parser.add_argument("run_id", nargs="?")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=SYNC_CONCURRENCY)
+    parser.add_argument("--per-org", type=int, default=SYNC_PER_ORG_CONCURRENCY)
+    parser.add_argument("--deadline", type=float, help="stop claiming tenants after this many seconds")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        run_id = args.run_id or await latest_run_id()
+        if run_id is None:
+            print("No sync runs yet")
+            return 1
+        _print_progress(run_id, await run_progress(run_id))
+        return 0
+
+    if args.command == "run":
+        run_id = await start_run(full=args.full)
+    else:
+        run_id = args.run_id or await latest_run_id(unfinished=True)
+        if run_id is None:
+            print("✅ No unfinished sync run to resume")
+            return 0
+
+    progress = await execute_run(run_id, args.concurrency, args.per_org, args.deadline)
+    _print_progress(run_id, progress)
+    return 0 if not progress["pending"] and not progress["failed"] else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,153 @@
+"""
+Background job worker
+Runs queued jobs (mirror syncs, webhook event drains, statement reconciliation,
+all-tenant sync runs) off the API event loop:
+
+    python worker.py
+
+Run it as its own process in every deployment. For local development the API
+process can run an embedded worker instead (JOB_WORKER_EMBEDDED=true); it shares the
+API's event loop, so long syncs and reconciliations slow requests down.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+# Load environment before importing modules that read their settings at import time
+load_dotenv(Path(__file__).parent / '.env')
+
+from cache_broadcast import start_cache_broadcast, stop_cache_broadcast
+from dashboard_views import refresh_view
+from job_queue import (
+    JobWorker, ensure_schedule, drop_schedule, MIRROR_SYNC, WEBHOOK_EVENTS, RECONCILE, SYNC_ALL
+)
+from reconciliation_engine import reconcile_user
+from sync_orchestrator import run_sync_job
+from zoho_sync import run_mirror_sync
+from zoho_webhooks import process_webhook_events
+
+logger = logging.getLogger(__name__)
+
+# Development only: run jobs inside the API process instead of a separate worker
+JOB_WORKER_EMBEDDED = os.environ.get('JOB_WORKER_EMBEDDED', 'false').lower() in ('1', 'true', 'yes')
+
+# Sync every production tenant this often (seconds; 0 disables), stopping new tenant
+# syncs after SYNC_ALL_DEADLINE so the run stays inside its window
+SYNC_ALL_INTERVAL = int(os.environ.get('SYNC_ALL_INTERVAL', '0'))
+SYNC_ALL_DEADLINE = int(os.environ.get('SYNC_ALL_DEADLINE', str(6 * 60 * 60)))
+# Fully re-pull every production tenant this often (seconds; 0 disables). Incremental
+# syncs only see records whose last_modified_time moved, so this drops records deleted
+# in Zoho and picks up changes that did not bump the timestamp
+SYNC_FULL_INTERVAL = int(os.environ.get('SYNC_FULL_INTERVAL', str(24 * 60 * 60)))
+
+# Recurring jobs every worker declares on start: name -> (job type, interval seconds, payload)
+WORKER_SCHEDULES: Dict[str, tuple] = {
+    SYNC_ALL: (SYNC_ALL, SYNC_ALL_INTERVAL, {"deadline": SYNC_ALL_DEADLINE}),
+    f"{SYNC_ALL}:full": (SYNC_ALL, SYNC_FULL_INTERVAL, {"full": True, "deadline": SYNC_ALL_DEADLINE}),
+}
+
+
+async def run_webhook_events(job: Dict) -> Dict:
+    return {"processed": await process_webhook_events(job["user_id"])}
+
+
+async def run_reconcile(job: Dict) -> Dict:
+    user_id = job["user_id"]
+    outcome = await reconcile_user(user_id, job["payload"].get("organization_id"))
+    await refresh_view(user_id, "reconciliation")
+    return outcome
+
+
+JOB_HANDLERS = {
+    MIRROR_SYNC: run_mirror_sync,
+    WEBHOOK_EVENTS: run_webhook_events,
+    RECONCILE: run_reconcile,
+    SYNC_ALL: run_sync_job,
+}
+
+_embedded: Optional[JobWorker] = None
+_embedded_task: Optional[asyncio.Task] = None
+
+
+async def _declare_schedules():
+    for name, (job_type, interval, payload) in WORKER_SCHEDULES.items():
+        if interval > 0:
+            await ensure_schedule(name, job_type, interval, payload)
+        else:
+            await drop_schedule(name)
+
+
+def start_job_worker():
+    """Run a worker inside the API process (FastAPI startup hook)"""
+    global _embedded, _embedded_task
+    if not JOB_WORKER_EMBEDDED or _embedded_task is not None:
+        return
+    _embedded = JobWorker(JOB_HANDLERS)
+
+    async def run():
+        await _declare_schedules()
+        await _embedded.run()
+
+    _embedded_task = asyncio.create_task(run())
+
+
+async def stop_job_worker():
+    """Hand running jobs back and stop the embedded worker (FastAPI shutdown hook)"""
+    global _embedded, _embedded_task
+    if _embedded is not None:
+        await _embedded.stop(grace=10.0)
+    if _embedded_task is not None:
+        _embedded_task.cancel()
+        try:
+            await _embedded_task
+        except asyncio.CancelledError:
+            pass
+    _embedded, _embedded_task = None, None
+
+
+def get_worker_metrics() -> Optional[Dict]:
+    return _embedded.metrics() if _embedded is not None else None
+
+
+async def _main():
+    from database import close_db, init_db
+    from db_indexes import verify_required_indexes
+    from zoho_client import init_zoho_client, close_zoho_client
+
+    await verify_required_indexes(init_db())
+    init_zoho_client()
+    # Jobs read through the same caches the API uses, so they follow its invalidations too
+    start_cache_broadcast()
+    worker = JobWorker(JOB_HANDLERS)
+    await _declare_schedules()
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    runner = asyncio.create_task(worker.run())
+    logger.info(f"Job worker {worker.worker_id} started ({', '.join(JOB_HANDLERS)})")
+    await stopping.wait()
+
+    logger.info(f"Job worker {worker.worker_id} stopping")
+    await worker.stop()
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    await stop_cache_broadcast()
+    await close_zoho_client()
+    close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(_main())
@@ -3,139 +3,529 @@ Zoho Books API Helper Functions
 Fetches real data from connected Zoho Books accounts
 """
 
+import asyncio
+import heapq
+import os
+import random
 import httpx
-from typing import Optional, Dict, List
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Optional, Dict, List
 from database import init_db
-from datetime import datetime
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from zoho_client import get_zoho_client
+from zoho_mirror import is_mirror_fresh, iter_mirror_records, find_mirror_records
+from zoho_cache import zoho_cache
+from singleflight import SingleFlight
+from cache_broadcast import broadcast_invalidation, register_invalidator
+from integration_cache import get_integration, invalidate_integration
+from invoice_snapshot import InvoiceSnapshot, invoice_balance, is_overdue
+from zoho_rate_limiter import acquire_zoho_quota, get_org_limiter, RateLimitExceeded
 
 ZOHO_BOOKS_API_BASE = "https://books.zoho.com/api/v3"
 
-async def get_user_zoho_credentials(user_id: str) -> Optional[Dict]:
-    """Get user's Zoho Books integration details including access token"""
+# Per-call deadline for concurrent dashboard fetches (seconds)
+ZOHO_FETCH_TIMEOUT = float(os.environ.get('ZOHO_FETCH_TIMEOUT', '20'))
+
+# Deadline for aggregations that walk every page of a list endpoint (seconds)
+ZOHO_LEDGER_TIMEOUT = float(os.environ.get('ZOHO_LEDGER_TIMEOUT', '120'))
+
+# Zoho Books caps list endpoints at 200 rows per page
+ZOHO_PAGE_SIZE = 200
+
+# Retries for throttled (429), failing (5xx) and unreachable Zoho calls
+ZOHO_MAX_RETRIES = int(os.environ.get('ZOHO_MAX_RETRIES', '3'))
+ZOHO_RETRY_BASE_DELAY = 0.5
+ZOHO_RETRY_MAX_DELAY = 30.0
+ZOHO_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Refresh a token this long before its recorded expiry (seconds)
+ZOHO_TOKEN_EXPIRY_SKEW = int(os.environ.get('ZOHO_TOKEN_EXPIRY_SKEW', '60'))
+
+# Zoho access tokens last an hour; assumed when a token response omits expires_in
+ZOHO_ACCESS_TOKEN_LIFETIME = 3600
+
+# Failed refreshes are retried after exponential backoff (seconds) instead of on every
+# call; after this many revoked-token answers the integration is marked needs_reauth
+ZOHO_TOKEN_RETRY_BASE_DELAY = 60
+ZOHO_TOKEN_RETRY_MAX_DELAY = 6 * 60 * 60
+ZOHO_TOKEN_REAUTH_AFTER = 3
+# Zoho answers a revoked or expired refresh token with one of these
+ZOHO_REVOKED_TOKEN_ERRORS = {"invalid_grant", "invalid_code"}
+
+# One refresh at a time per integration (one Zoho Books integration per user); entries
+# are dropped when the refresh finishes
+_refreshes = SingleFlight()
+
+# In-flight upstream requests keyed by (user_id, endpoint, normalized params), so
+# concurrent identical fetches (cached or not) share one call to Zoho
+zoho_inflight = SingleFlight()
+
+class ZohoAPIError(Exception):
+    """A Zoho Books call failed (network error, non-200 response or missing credentials)"""
+    
+    def __init__(self, endpoint: str, message: str, status_code: Optional[int] = None):
+        self.endpoint = endpoint
+        self.status_code = status_code
+        prefix = f"{endpoint}: HTTP {status_code}" if status_code else endpoint
+        super().__init__(f"{prefix} - {message}")
+
+class FanOutResult:
+    """Outcome of fetch_concurrently: results for calls that succeeded, reasons for those that did not"""
+    
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.failures: Dict[str, str] = {}
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.results.get(name, default)
+    
+    @property
+    def failed_sources(self) -> List[str]:
+        return list(self.failures.keys())
+    
+    @property
+    def all_failed(self) -> bool:
+        return bool(self.failures) and not self.results
+
+async def get_user_zoho_credentials(user_id: str, fresh: bool = False) -> Optional[Dict]:
+    """Get user's Zoho Books integration details including access token
+    
+    Served from the request/process integration cache unless fresh is set.
+    """
+    return await get_integration(user_id, fresh=fresh)
+
+async def _record_refresh_failure(user_id: str, error: str, revoked: bool):
+    """Back off further refreshes of this integration; flag it for re-auth once the token is clearly revoked"""
     db = init_db()
-    integration = await db.integrations.find_one({
-        "user_id": user_id,
-        "type": "zohobooks",
-        "status": "active"
-    })
-    return integration
+    now = datetime.utcnow()
+    inc = {"token_refresh_failures": 1}
+    if revoked:
+        inc["token_refresh_revocations"] = 1
+    integration = await db.integrations.find_one_and_update(
+        {"user_id": user_id, "type": "zohobooks"},
+        {"$inc": inc, "$set": {"token_refresh_error": error, "token_refresh_failed_at": now}},
+        projection={"token_refresh_failures": 1, "token_refresh_revocations": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if integration is None:
+        return
+    
+    failures = integration.get("token_refresh_failures", 1)
+    delay = min(ZOHO_TOKEN_RETRY_MAX_DELAY, ZOHO_TOKEN_RETRY_BASE_DELAY * (2 ** (failures - 1)))
+    update = {"token_refresh_retry_at": now + timedelta(seconds=delay)}
+    if integration.get("token_refresh_revocations", 0) >= ZOHO_TOKEN_REAUTH_AFTER:
+        update["needs_reauth"] = True
+        print(f"Zoho refresh token for user {user_id} was revoked; the user must reconnect Zoho Books")
+    await db.integrations.update_one({"_id": integration["_id"]}, {"$set": update})
+    # Every process must stop using the revoked token, not just this one
+    await broadcast_invalidation(user_id)
 
 async def refresh_zoho_token(user_id: str, refresh_token: str, client_id: str, client_secret: str) -> Optional[str]:
     """Refresh expired Zoho access token"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://accounts.zoho.com/oauth/v2/token",
-                data={
-                    "refresh_token": refresh_token,
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "grant_type": "refresh_token"
-                }
+        client = get_zoho_client()
+        response = await client.post(
+            "https://accounts.zoho.com/oauth/v2/token",
+            data={
+                "refresh_token": refresh_token,
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "grant_type": "refresh_token"
+            }
+        )
+        
+        token_data = response.json() if response.status_code in (200, 400) else {}
+        new_access_token = token_data.get("access_token")
+        if response.status_code == 200 and new_access_token:
+            expires_in = token_data.get("expires_in")
+            now = datetime.utcnow()
+            
+            # Update token in database
+            db = init_db()
+            await db.integrations.update_one(
+                {"user_id": user_id, "type": "zohobooks"},
+                {"$set": {
+                    "access_token": new_access_token,
+                    "token_refreshed_at": now,
+                    "token_expires_in": expires_in,
+                    "token_expires_at": token_expiry(now, expires_in)
+                }, "$unset": {
+                    "token_refresh_failures": "",
+                    "token_refresh_revocations": "",
+                    "token_refresh_error": "",
+                    "token_refresh_failed_at": "",
+                    "token_refresh_retry_at": "",
+                    "needs_reauth": "",
+                }}
             )
+            invalidate_integration(user_id)
             
-            if response.status_code == 200:
-                token_data = response.json()
-                new_access_token = token_data.get("access_token")
-                
-                # Update token in database
-                db = init_db()
-                await db.integrations.update_one(
-                    {"user_id": user_id, "type": "zohobooks"},
-                    {"$set": {
-                        "access_token": new_access_token,
-                        "last_sync": datetime.utcnow()
-                    }}
-                )
-                
-                return new_access_token
+            return new_access_token
+        
+        # Zoho reports a revoked refresh token as 200 {"error": "invalid_code"} (or 400 invalid_grant)
+        error = token_data.get("error") or f"HTTP {response.status_code}"
+        print(f"Token refresh error: {response.status_code} - {response.text}")
+        await _record_refresh_failure(user_id, str(error), revoked=error in ZOHO_REVOKED_TOKEN_ERRORS)
     except Exception as e:
         print(f"Token refresh error: {str(e)}")
+        await _record_refresh_failure(user_id, str(e), revoked=False)
     
     return None
 
-async def fetch_zoho_data(user_id: str, endpoint: str, params: Dict = None) -> Optional[Dict]:
-    """Generic function to fetch data from Zoho Books API"""
-    integration = await get_user_zoho_credentials(user_id)
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def retry_backoff(attempt: int) -> float:
+    """Exponential backoff with ±50% jitter so throttled callers do not retry in lockstep"""
+    return min(ZOHO_RETRY_MAX_DELAY, ZOHO_RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+def token_expiry(issued_at: datetime, expires_in) -> datetime:
+    """Absolute expiry for a token issued at issued_at with Zoho's expires_in (seconds)"""
+    try:
+        return issued_at + timedelta(seconds=int(expires_in))
+    except (TypeError, ValueError):
+        # Stored either way, so the token scheduler never sees this token as unknown
+        return issued_at + timedelta(seconds=ZOHO_ACCESS_TOKEN_LIFETIME)
+
+def integration_token_expiry(integration: Dict) -> Optional[datetime]:
+    """Best known expiry of the integration's access token"""
+    if integration.get("token_expires_at"):
+        return integration["token_expires_at"]
+    # Integrations stored before token_expires_at existed
+    issued_at = integration.get("token_refreshed_at") or integration.get("connected_at")
+    if issued_at and integration.get("token_expires_in"):
+        return token_expiry(issued_at, integration["token_expires_in"])
+    return None
+
+async def refresh_access_token(user_id: str, stale_token: Optional[str] = None, force: bool = False) -> Optional[str]:
+    """Refresh the user's Zoho access token, allowing only one refresh per integration at a time
+    
+    When stale_token is given and the stored token no longer matches it, another caller
+    already refreshed and its token is returned as is. Integrations backing off after
+    failed refreshes, or waiting for the user to reconnect, are not refreshed unless
+    force is set (an explicit user request).
+    """
+    async def refresh() -> Optional[str]:
+        integration = await get_user_zoho_credentials(user_id, fresh=True)
+        if not integration:
+            return None
+        
+        current_token = integration.get("access_token")
+        if stale_token and current_token and current_token != stale_token:
+            return current_token
+        
+        if not force:
+            if integration.get("needs_reauth"):
+                return None
+            retry_at = integration.get("token_refresh_retry_at")
+            if retry_at and retry_at > datetime.utcnow():
+                return None
+        
+        refresh_token = integration.get("refresh_token")
+        client_id = integration.get("client_id")
+        client_secret = integration.get("client_secret")
+        if not (refresh_token and client_id and client_secret):
+            return None
+        
+        return await refresh_zoho_token(user_id, refresh_token, client_id, client_secret)
+    
+    return await _refreshes.do(user_id, refresh)
+
+async def _request_zoho(user_id: str, endpoint: str, params: Dict = None, integration: Optional[Dict] = None) -> Dict:
+    """Call the Zoho Books API, raising ZohoAPIError on any failure"""
+    if integration is None:
+        integration = await get_user_zoho_credentials(user_id)
     
     if not integration:
-        return None
+        raise ZohoAPIError(endpoint, "Zoho Books is not connected")
     
     access_token = integration.get("access_token")
     organization_id = integration.get("organization_id")
     
     if not access_token:
-        return None
+        raise ZohoAPIError(endpoint, "Missing access token")
     
-    headers = {
-        "Authorization": f"Zoho-oauthtoken {access_token}"
-    }
+    # Refresh up front when the token is known to be (nearly) expired
+    expires_at = integration_token_expiry(integration)
+    if expires_at and datetime.utcnow() >= expires_at - timedelta(seconds=ZOHO_TOKEN_EXPIRY_SKEW):
+        access_token = await refresh_access_token(user_id, stale_token=access_token) or access_token
     
     # Add organization_id to params if available
+    params = dict(params) if params else {}
     if organization_id:
-        if params is None:
-            params = {}
         params["organization_id"] = organization_id
     
+    limiter_key = organization_id or user_id
+    client = get_zoho_client()
+    
+    async def send(token: str):
+        await acquire_zoho_quota(limiter_key)
+        response = await client.get(
+            f"{ZOHO_BOOKS_API_BASE}/{endpoint}",
+            headers={"Authorization": f"Zoho-oauthtoken {token}"},
+            params=params,
+            timeout=30.0
+        )
+        await get_org_limiter(limiter_key).observe(response.headers)
+        return response
+    
+    token_refreshed = False
+    attempt = 0
+    while True:
+        try:
+            response = await send(access_token)
+            if response.status_code == 401 and not token_refreshed:
+                # Token expired, refresh once for all concurrent callers
+                token_refreshed = True
+                new_token = await refresh_access_token(user_id, stale_token=access_token)
+                if new_token and new_token != access_token:
+                    # Retry with new token
+                    access_token = new_token
+                    response = await send(access_token)
+        except RateLimitExceeded as e:
+            raise ZohoAPIError(endpoint, str(e), status_code=429) from e
+        except httpx.TransportError as e:
+            if attempt < ZOHO_MAX_RETRIES:
+                await asyncio.sleep(retry_backoff(attempt))
+                attempt += 1
+                continue
+            raise ZohoAPIError(endpoint, str(e)) from e
+        except Exception as e:
+            raise ZohoAPIError(endpoint, str(e)) from e
+        
+        if response.status_code in ZOHO_RETRY_STATUSES and attempt < ZOHO_MAX_RETRIES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                # The pause holds back every call for this org; send() waits it out
+                # (or gives up if an interactive caller would wait too long)
+                await get_org_limiter(limiter_key).pause(retry_after if retry_after is not None else retry_backoff(attempt))
+            else:
+                await asyncio.sleep(retry_after if retry_after is not None else retry_backoff(attempt))
+            attempt += 1
+            continue
+        break
+    
+    if response.status_code != 200:
+        raise ZohoAPIError(endpoint, response.text, status_code=response.status_code)
+    
+    return response.json()
+
+async def fetch_zoho_data(
+    user_id: str,
+    endpoint: str,
+    params: Dict = None,
+    raise_errors: bool = False,
+    use_cache: bool = True,
+    integration: Optional[Dict] = None
+) -> Optional[Dict]:
+    """Generic function to fetch data from Zoho Books API
+    
+    Responses are served from the per-tenant cache unless use_cache is False.
+    Pass the already-loaded integration document to skip looking it up again.
+    Returns None on failure unless raise_errors is set, in which case ZohoAPIError propagates.
+    """
+    key = zoho_cache.make_key(user_id, endpoint, params)
+    
+    def request():
+        return zoho_inflight.do(key, lambda: _request_zoho(user_id, endpoint, params, integration))
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{ZOHO_BOOKS_API_BASE}/{endpoint}",
-                headers=headers,
-                params=params,
-                timeout=30.0
-            )
+        if use_cache:
+            return await zoho_cache.get_or_load(user_id, endpoint, params, request)
+        return await request()
+    except ZohoAPIError as e:
+        if raise_errors:
+            raise
+        print(f"Zoho API Error: {e}")
+        return None
+
+def invalidate_zoho_cache(user_id: str):
+    """Forget cached and in-flight Zoho responses for a user"""
+    zoho_cache.invalidate_user(user_id)
+    zoho_inflight.forget(lambda key: key[0] == user_id)
+
+# Invalidations made by other processes (webhook drains, syncs in the worker) reach this cache too
+register_invalidator(invalidate_zoho_cache)
+
+async def fetch_concurrently(calls: Dict[str, Awaitable], timeout: float = ZOHO_FETCH_TIMEOUT) -> FanOutResult:
+    """Run named Zoho calls concurrently, each bounded by its own timeout
+    
+    A failing or timed-out call does not cancel the others; it is recorded in
+    FanOutResult.failures so callers can report exactly which source is missing.
+    """
+    names = list(calls.keys())
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(calls[name], timeout=timeout) for name in names),
+        return_exceptions=True
+    )
+    
+    result = FanOutResult()
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            result.failures[name] = f"timed out after {timeout:g}s"
+        elif isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            result.failures[name] = str(outcome) or outcome.__class__.__name__
+        else:
+            result.results[name] = outcome
+    
+    for name, reason in result.failures.items():
+        print(f"Zoho fetch '{name}' failed: {reason}")
+    
+    return result
+
+async def iter_zoho_records(
+    user_id: str,
+    endpoint: str,
+    key: str,
+    params: Dict = None,
+    prefetch: bool = True,
+    raise_errors: bool = False,
+    use_cache: bool = True
+) -> AsyncIterator[Dict]:
+    """Stream every record of a paginated Zoho list endpoint
+    
+    Follows page_context.has_more_page with per_page=200. With prefetch enabled the
+    next page is requested while the current one is being consumed, so only about
+    two pages are ever held in memory.
+    """
+    base_params = dict(params) if params else {}
+    
+    async def load_page(page: int) -> Optional[Dict]:
+        page_params = {**base_params, "page": page, "per_page": ZOHO_PAGE_SIZE}
+        return await fetch_zoho_data(user_id, endpoint, page_params, raise_errors=raise_errors, use_cache=use_cache)
+    
+    page = 1
+    pending = asyncio.ensure_future(load_page(page))
+    try:
+        while pending is not None:
+            data = await pending
+            pending = None
+            if not data:
+                return
             
-            if response.status_code == 401:
-                # Token expired, try to refresh
-                refresh_token = integration.get("refresh_token")
-                client_id = integration.get("client_id")
-                client_secret = integration.get("client_secret")
-                
-                if refresh_token and client_id and client_secret:
-                    new_token = await refresh_zoho_token(user_id, refresh_token, client_id, client_secret)
-                    if new_token:
-                        # Retry with new token
-                        headers["Authorization"] = f"Zoho-oauthtoken {new_token}"
-                        response = await client.get(
-                            f"{ZOHO_BOOKS_API_BASE}/{endpoint}",
-                            headers=headers,
-                            params=params,
-                            timeout=30.0
-                        )
+            has_more = data.get("page_context", {}).get("has_more_page", False)
+            if has_more and prefetch:
+                pending = asyncio.ensure_future(load_page(page + 1))
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Zoho API Error: {response.status_code} - {response.text}")
-                return None
-                
-    except Exception as e:
-        print(f"Error fetching Zoho data: {str(e)}")
+            for record in data.get(key, []):
+                yield record
+            
+            page += 1
+            if has_more and pending is None:
+                pending = asyncio.ensure_future(load_page(page))
+    finally:
+        # Consumer stopped early (break/exception): drop the prefetched page
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+async def get_mirror_integration(user_id: str) -> Optional[Dict]:
+    """Integration whose local mirror is fresh enough to serve reads, or None to go live to Zoho
+    
+    A missing or stale mirror queues a background sync so later reads can use it.
+    """
+    integration = await get_user_zoho_credentials(user_id)
+    if not integration or integration.get("mode") != "production":
         return None
+    if is_mirror_fresh(integration):
+        return integration
+    
+    from zoho_sync import request_mirror_sync  # zoho_sync imports this module
+    await request_mirror_sync(user_id)
+    return None
+
+async def iter_invoices(user_id: str, status: str = None, **kwargs) -> AsyncIterator[Dict]:
+    """Stream all invoices, optionally filtered by status"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        async for inv in iter_mirror_records("invoices", user_id, integration.get("organization_id"), status):
+            yield inv
+        return
+    
+    params = {"status": status} if status else {}
+    async for inv in iter_zoho_records(user_id, "invoices", "invoices", params, **kwargs):
+        yield inv
 
-async def get_invoices(user_id: str, status: str = None) -> Optional[List[Dict]]:
-    """Get invoices from Zoho Books"""
+async def iter_customers(user_id: str, **kwargs) -> AsyncIterator[Dict]:
+    """Stream all customer contacts"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        async for cust in iter_mirror_records("contacts", user_id, integration.get("organization_id")):
+            yield cust
+        return
+    
+    async for cust in iter_zoho_records(user_id, "contacts", "contacts", {"contact_type": "customer"}, **kwargs):
+        yield cust
+
+async def iter_payments(user_id: str, **kwargs) -> AsyncIterator[Dict]:
+    """Stream all customer payments"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        async for pay in iter_mirror_records("payments", user_id, integration.get("organization_id")):
+            yield pay
+        return
+    
+    async for pay in iter_zoho_records(user_id, "customerpayments", "customerpayments", **kwargs):
+        yield pay
+
+async def get_invoices(user_id: str, status: str = None, raise_errors: bool = False, all_pages: bool = False) -> Optional[List[Dict]]:
+    """Get invoices from the local mirror, or from Zoho Books (first page only unless all_pages is set)"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        # Same page the live path returns unless every record was asked for
+        return await find_mirror_records("invoices", user_id, integration.get("organization_id"), status, limit=None if all_pages else ZOHO_PAGE_SIZE)
+    
+    if all_pages:
+        params = {"status": status} if status else {}
+        return [inv async for inv in iter_zoho_records(user_id, "invoices", "invoices", params, raise_errors=raise_errors)]
+    
     params = {}
     if status:
         params["status"] = status  # "overdue", "unpaid", "paid", etc.
     
-    data = await fetch_zoho_data(user_id, "invoices", params)
+    data = await fetch_zoho_data(user_id, "invoices", params, raise_errors=raise_errors)
     return data.get("invoices", []) if data else []
 
-async def get_customers(user_id: str) -> Optional[List[Dict]]:
-    """Get customers from Zoho Books"""
-    data = await fetch_zoho_data(user_id, "contacts", {"contact_type": "customer"})
+async def get_customers(user_id: str, raise_errors: bool = False, all_pages: bool = False) -> Optional[List[Dict]]:
+    """Get customers from the local mirror, or from Zoho Books (first page only unless all_pages is set)"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        return await find_mirror_records("contacts", user_id, integration.get("organization_id"), limit=None if all_pages else ZOHO_PAGE_SIZE)
+    
+    if all_pages:
+        return [cust async for cust in iter_zoho_records(user_id, "contacts", "contacts", {"contact_type": "customer"}, raise_errors=raise_errors)]
+    
+    data = await fetch_zoho_data(user_id, "contacts", {"contact_type": "customer"}, raise_errors=raise_errors)
     return data.get("contacts", []) if data else []
 
-async def get_payments(user_id: str) -> Optional[List[Dict]]:
-    """Get payments from Zoho Books"""
-    data = await fetch_zoho_data(user_id, "customerpayments")
+async def get_payments(user_id: str, raise_errors: bool = False, all_pages: bool = False) -> Optional[List[Dict]]:
+    """Get payments from the local mirror, or from Zoho Books (first page only unless all_pages is set)"""
+    integration = await get_mirror_integration(user_id)
+    if integration:
+        return await find_mirror_records("payments", user_id, integration.get("organization_id"), limit=None if all_pages else ZOHO_PAGE_SIZE)
+    
+    if all_pages:
+        return [pay async for pay in iter_zoho_records(user_id, "customerpayments", "customerpayments", raise_errors=raise_errors)]
+    
+    data = await fetch_zoho_data(user_id, "customerpayments", raise_errors=raise_errors)
     return data.get("customerpayments", []) if data else []
 
-async def get_outstanding_receivables(user_id: str) -> Optional[Dict]:
+async def get_outstanding_receivables(user_id: str, raise_errors: bool = False) -> Optional[Dict]:
     """Get outstanding receivables summary"""
-    data = await fetch_zoho_data(user_id, "reports/receivables")
+    data = await fetch_zoho_data(user_id, "reports/receivables", raise_errors=raise_errors)
     return data if data else None
 
 async def get_aged_receivables(user_id: str) -> Optional[Dict]:
@@ -156,27 +546,66 @@ async def search_invoices_by_customer(user_id: str, customer_name: str) -> Optio
     data = await fetch_zoho_data(user_id, "invoices", params)
     return data.get("invoices", []) if data else []
 
+async def load_invoice_snapshot(user_id: str, status: str = None, raise_errors: bool = False, limit: Optional[int] = None) -> InvoiceSnapshot:
+    """Pull every invoice (optionally pre-filtered by status, or only the newest `limit`) into an indexed snapshot
+    
+    Narrower views are derived locally: an "unpaid" snapshot also answers overdue,
+    per-customer and due-date questions.
+    """
+    invoices = []
+    # A bounded pull must not prefetch a page it will not read
+    async with aclosing(iter_invoices(user_id, status=status, raise_errors=raise_errors, prefetch=not limit)) as records:
+        async for inv in records:
+            invoices.append(inv)
+            if limit and len(invoices) >= limit:
+                break
+    return InvoiceSnapshot(invoices, status=status)
+
+async def _summarize_invoices(user_id: str, top_n: int = 0) -> Dict:
+    """Stream unpaid invoices once, keeping only counts, balance totals and the top_n overdue by balance"""
+    summary = {"count": 0, "total_balance": 0.0, "overdue_count": 0, "overdue_balance": 0.0}
+    top = []
+    today = datetime.utcnow().date()
+    async for inv in iter_invoices(user_id, status="unpaid", raise_errors=True):
+        balance = invoice_balance(inv)
+        summary["count"] += 1
+        summary["total_balance"] += balance
+        if not is_overdue(inv, today):
+            continue
+        summary["overdue_count"] += 1
+        summary["overdue_balance"] += balance
+        if top_n:
+            entry = (balance, summary["count"], inv)
+            if len(top) < top_n:
+                heapq.heappush(top, entry)
+            else:
+                heapq.heappushpop(top, entry)
+    
+    summary["top_overdue"] = [inv for _, _, inv in sorted(top, key=lambda e: e[0], reverse=True)]
+    return summary
+
 async def get_dashboard_summary(user_id: str) -> Dict:
     """Get comprehensive dashboard data from Zoho Books"""
     
-    # Fetch key data in parallel would be ideal, but let's do sequential for now
-    invoices = await get_invoices(user_id, status="unpaid") or []
-    overdue_invoices = await get_invoices(user_id, status="overdue") or []
-    recent_payments = await get_payments(user_id) or []
+    # Overdue invoices are a subset of unpaid ones, so one streamed pass totals both
+    # without holding the ledger; recent payments only need the first page
+    fetched = await fetch_concurrently({
+        "unpaid_invoices": _summarize_invoices(user_id, top_n=10),
+        "payments": get_payments(user_id, raise_errors=True),
+    }, timeout=ZOHO_LEDGER_TIMEOUT)
+    if fetched.all_failed:
+        raise ZohoAPIError("dashboard", f"All Zoho fetches failed: {', '.join(fetched.failed_sources)}")
     
-    # Calculate metrics
-    total_outstanding = sum(float(inv.get("balance", 0)) for inv in invoices)
-    total_overdue = sum(float(inv.get("balance", 0)) for inv in overdue_invoices)
+    empty = {"count": 0, "total_balance": 0.0, "overdue_count": 0, "overdue_balance": 0.0, "top_overdue": []}
+    unpaid = fetched.get("unpaid_invoices", empty)
+    recent_payments = fetched.get("payments", [])
     
     return {
-        "total_outstanding": total_outstanding,
-        "total_invoices": len(invoices),
-        "overdue_invoices": len(overdue_invoices),
-        "overdue_amount": total_overdue,
+        "total_outstanding": unpaid["total_balance"],
+        "total_invoices": unpaid["count"],
+        "overdue_invoices": unpaid["overdue_count"],
+        "overdue_amount": unpaid["overdue_balance"],
         "recent_payments": recent_payments[:5],  # Last 5 payments
-        "top_overdue_invoices": sorted(
-            overdue_invoices, 
-            key=lambda x: float(x.get("balance", 0)), 
-            reverse=True
-        )[:10]
+        "top_overdue_invoices": unpaid["top_overdue"],
+        "failed_sources": fetched.failed_sources
     }
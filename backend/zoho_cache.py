@@ -0,0 +1,201 @@
+"""
+Per-tenant response cache for Zoho Books API calls
+TTL per endpoint, LRU eviction bounded by memory, stale-while-revalidate and
+single-flight loading of concurrent identical requests
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+ZOHO_CACHE_ENABLED = os.environ.get('ZOHO_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ZOHO_CACHE_MAX_BYTES = int(os.environ.get('ZOHO_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+ZOHO_CACHE_DEFAULT_TTL = float(os.environ.get('ZOHO_CACHE_DEFAULT_TTL', '60'))
+# How long past its TTL an entry may still be served while a refresh runs in the background
+ZOHO_CACHE_STALE_TTL = float(os.environ.get('ZOHO_CACHE_STALE_TTL', '300'))
+# Per-endpoint TTLs in seconds, e.g. "invoices=60,contacts=300"
+ZOHO_CACHE_TTLS = os.environ.get(
+    'ZOHO_CACHE_TTLS',
+    'invoices=60,customerpayments=60,contacts=300,reports/receivables=120,reports/agedreceivables=300,organizations=3600'
+)
+
+CacheKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    ttls = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        endpoint, ttl = item.split('=', 1)
+        ttls[endpoint.strip()] = float(ttl)
+    return ttls
+
+
+class CacheEntry:
+    __slots__ = ("value", "size", "fresh_until", "stale_until")
+
+    def __init__(self, value: Any, size: int, ttl: float, stale_ttl: float):
+        now = time.monotonic()
+        self.value = value
+        self.size = size
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class ZohoResponseCache:
+    """LRU cache of Zoho responses keyed on (user_id, endpoint, normalized params)
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = ZOHO_CACHE_MAX_BYTES,
+        default_ttl: float = ZOHO_CACHE_DEFAULT_TTL,
+        stale_ttl: float = ZOHO_CACHE_STALE_TTL,
+        ttls: Optional[Dict[str, float]] = None,
+        enabled: bool = ZOHO_CACHE_ENABLED,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.ttls = ttls if ttls is not None else parse_ttls(ZOHO_CACHE_TTLS)
+        self.enabled = enabled
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._inflight = SingleFlight()
+        # Bumped on invalidation so loads started before it are not stored
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def make_key(user_id: str, endpoint: str, params: Optional[Dict]) -> CacheKey:
+        normalized = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None))
+        return (user_id, endpoint.strip('/'), normalized)
+
+    def ttl_for(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint.strip('/'), self.default_ttl)
+
+    async def get_or_load(
+        self,
+        user_id: str,
+        endpoint: str,
+        params: Optional[Dict],
+        loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Return a cached response, loading it once for all concurrent callers on a miss"""
+        ttl = self.ttl_for(endpoint)
+        if not self.enabled or ttl <= 0:
+            return await loader()
+
+        key = self.make_key(user_id, endpoint, params)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            if now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry.value
+            if now < entry.stale_until:
+                # Serve stale, refresh in the background (at most one refresh per key)
+                self._entries.move_to_end(key)
+                self._stats["stale_hits"] += 1
+                if key not in self._inflight:
+                    self._stats["refreshes"] += 1
+                    future = self._start_load(key, ttl, loader)
+                    future.add_done_callback(self._consume_background_error)
+                return entry.value
+            self._remove(key)
+
+        self._stats["misses"] += 1
+        return await self._inflight.do(key, self._loader_for(key, ttl, loader))
+
+    def _start_load(self, key: CacheKey, ttl: float, loader: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        return self._inflight.start(key, self._loader_for(key, ttl, loader))
+
+    def _loader_for(self, key: CacheKey, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        generation = self._generations.get(key[0], 0)
+
+        async def load():
+            value = await loader()
+            if self._generations.get(key[0], 0) == generation:
+                self._store(key, value, ttl)
+            return value
+
+        return load
+
+    @staticmethod
+    def _consume_background_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Background Zoho cache refresh failed: {future.exception()}")
+
+    def _store(self, key: CacheKey, value: Any, ttl: float):
+        if value is None:
+            return
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = CacheEntry(value, size, ttl, self.stale_ttl)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate_user(self, user_id: str) -> int:
+        """Drop every cached response for a user (disconnect, token refresh, new data)"""
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        keys = [key for key in self._entries if key[0] == user_id]
+        for key in keys:
+            self._remove(key)
+        # Later callers must not coalesce onto loads that started with the old credentials
+        self._inflight.forget(lambda key: key[0] == user_id)
+        self._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def metrics(self) -> Dict:
+        inflight = self._inflight.metrics()
+        lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+        served = self._stats["hits"] + self._stats["stale_hits"]
+        # "coalesced" counts misses that shared another caller's in-flight load
+        return {
+            **self._stats,
+            "coalesced": inflight["coalesced"],
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            "in_flight": inflight["in_flight"],
+        }
+
+
+zoho_cache = ZohoResponseCache()
@@ -0,0 +1,136 @@
+"""
+Shared HTTP client for Zoho traffic
+One pooled httpx.AsyncClient per process, created on app startup and closed on shutdown
+"""
+
+import os
+import time
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (overridable from environment)
+ZOHO_HTTP_MAX_CONNECTIONS = int(os.environ.get('ZOHO_HTTP_MAX_CONNECTIONS', '100'))
+ZOHO_HTTP_MAX_KEEPALIVE = int(os.environ.get('ZOHO_HTTP_MAX_KEEPALIVE', '20'))
+ZOHO_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('ZOHO_HTTP_KEEPALIVE_EXPIRY', '60'))
+ZOHO_HTTP_TIMEOUT = float(os.environ.get('ZOHO_HTTP_TIMEOUT', '30'))
+ZOHO_HTTP_CONNECT_TIMEOUT = float(os.environ.get('ZOHO_HTTP_CONNECT_TIMEOUT', '10'))
+ZOHO_HTTP2 = os.environ.get('ZOHO_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+_client: Optional[httpx.AsyncClient] = None
+
+# Per-host request metrics, filled by the client's event hooks
+_host_metrics: Dict[str, Dict[str, float]] = defaultdict(lambda: {
+    "requests": 0,
+    "responses": 0,
+    "errors": 0,
+    "total_time_ms": 0.0,
+})
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions["vasool_started_at"] = time.perf_counter()
+    metrics = _host_metrics[request.url.host]
+    metrics["requests"] += 1
+
+
+async def _on_response(response: httpx.Response):
+    request = response.request
+    metrics = _host_metrics[request.url.host]
+    metrics["responses"] += 1
+    if response.status_code >= 400:
+        metrics["errors"] += 1
+    started_at = request.extensions.get("vasool_started_at")
+    if started_at is not None:
+        metrics["total_time_ms"] += (time.perf_counter() - started_at) * 1000
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = ZOHO_HTTP2 and _http2_available()
+    if ZOHO_HTTP2 and not http2:
+        logger.warning("ZOHO_HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=ZOHO_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ZOHO_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=ZOHO_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(ZOHO_HTTP_TIMEOUT, connect=ZOHO_HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+
+def init_zoho_client() -> httpx.AsyncClient:
+    """Create the shared client (called from the FastAPI startup hook)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def get_zoho_client() -> httpx.AsyncClient:
+    """Get the shared client, creating it lazily for scripts that skip app startup"""
+    return init_zoho_client()
+
+
+async def close_zoho_client():
+    """Close the shared client and release its pooled connections"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def get_pool_metrics() -> Dict:
+    """Snapshot of per-host request counters and pooled connection state"""
+    hosts = {}
+    for host, metrics in _host_metrics.items():
+        responses = metrics["responses"]
+        hosts[host] = {
+            "requests": int(metrics["requests"]),
+            "responses": int(responses),
+            "errors": int(metrics["errors"]),
+            "avg_latency_ms": round(metrics["total_time_ms"] / responses, 2) if responses else 0.0,
+        }
+
+    connections = {}
+    if _client is not None and not _client.is_closed:
+        # httpcore exposes the live connections on the transport's pool
+        pool = getattr(_client._transport, "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            origin = getattr(conn, "_origin", None)
+            host = origin.host.decode() if origin is not None else "unknown"
+            stats = connections.setdefault(host, {"open": 0, "idle": 0, "http2": 0})
+            stats["open"] += 1
+            if conn.is_idle():
+                stats["idle"] += 1
+            if "HTTP/2" in conn.info():
+                stats["http2"] += 1
+
+    for host, stats in connections.items():
+        hosts.setdefault(host, {}).update({"connections": stats})
+
+    return {
+        "http2_enabled": bool(_client is not None and ZOHO_HTTP2 and _http2_available()),
+        "limits": {
+            "max_connections": ZOHO_HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": ZOHO_HTTP_MAX_KEEPALIVE,
+            "keepalive_expiry": ZOHO_HTTP_KEEPALIVE_EXPIRY,
+        },
+        "hosts": hosts,
+    }
@@ -0,0 +1,196 @@
+"""
+Local MongoDB mirror of Zoho Books records
+Invoices, customer payments and contacts keyed by (user_id, organization_id, zoho_id)
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional
+
+from pymongo import UpdateOne
+from database import init_db
+
+# Mirror is used for reads only while its last completed sync is younger than this (seconds)
+ZOHO_MIRROR_MAX_AGE = int(os.environ.get('ZOHO_MIRROR_MAX_AGE', '900'))
+
+# Mirrored entities: Zoho endpoint, list key in the response, id field and Mongo collection
+MIRROR_ENTITIES = {
+    "invoices": {
+        "endpoint": "invoices",
+        "key": "invoices",
+        "id_field": "invoice_id",
+        "collection": "zoho_invoices",
+        "params": {},
+        "sort": [("date", -1), ("zoho_id", -1)],
+    },
+    "payments": {
+        "endpoint": "customerpayments",
+        "key": "customerpayments",
+        "id_field": "payment_id",
+        "collection": "zoho_payments",
+        "params": {},
+        "sort": [("date", -1), ("zoho_id", -1)],
+    },
+    "contacts": {
+        "endpoint": "contacts",
+        "key": "contacts",
+        "id_field": "contact_id",
+        "collection": "zoho_contacts",
+        "params": {"contact_type": "customer"},
+        "sort": [("contact_name", 1), ("zoho_id", 1)],
+    },
+}
+
+# Zoho's "unpaid" list filter covers every issued invoice that still carries a balance
+UNPAID_INVOICE_FILTER = {"balance": {"$gt": 0}, "status": {"$nin": ["draft", "void", "paid"]}}
+
+
+def overdue_invoice_filter(today: Optional[date] = None) -> Dict:
+    """Unpaid invoices that Zoho marked overdue or whose due date has passed
+
+    An invoice that goes overdue between syncs keeps the status it was mirrored with
+    (Zoho does not bump last_modified_time for it), so the due date is checked too.
+    """
+    today = (today or datetime.utcnow().date()).isoformat()
+    return {**UNPAID_INVOICE_FILTER, "$or": [
+        {"status": "overdue"},
+        {"due_date": {"$lt": today, "$gt": ""}},
+    ]}
+
+
+def overdue_invoice_expr(today: Optional[date] = None) -> Dict:
+    """overdue_invoice_filter as an aggregation expression, for records already matched as unpaid"""
+    today = (today or datetime.utcnow().date()).isoformat()
+    return {"$or": [
+        {"$eq": ["$status", "overdue"]},
+        {"$and": [
+            # Missing or null due dates sort below every string
+            {"$eq": [{"$type": "$due_date"}, "string"]},
+            {"$gt": ["$due_date", ""]},
+            {"$lt": ["$due_date", today]},
+        ]},
+    ]}
+
+
+# Keys added by the mirror on top of the raw Zoho record
+MIRROR_FIELDS = {"_id": 0, "user_id": 0, "organization_id": 0, "zoho_id": 0, "synced_at": 0, "modified_at": 0}
+
+
+def parse_zoho_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse Zoho's "2024-10-01T18:55:45+0530" timestamps into naive UTC datetimes"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None) - parsed.utcoffset()
+
+
+def is_mirror_fresh(integration: Optional[Dict]) -> bool:
+    """Whether the mirror for this integration finished a sync recently enough to serve reads"""
+    if not integration:
+        return False
+    synced_at = integration.get("mirror_synced_at")
+    if not synced_at:
+        return False
+    return datetime.utcnow() - synced_at < timedelta(seconds=ZOHO_MIRROR_MAX_AGE)
+
+
+def mirror_collection(entity: str):
+    return init_db()[MIRROR_ENTITIES[entity]["collection"]]
+
+
+def mirror_query(entity: str, user_id: str, organization_id: Optional[str], status: Optional[str] = None) -> Dict:
+    """Build the Mongo filter for one tenant's mirrored records"""
+    query = {"user_id": user_id, "organization_id": organization_id}
+    if entity == "invoices" and status:
+        if status == "unpaid":
+            query.update(UNPAID_INVOICE_FILTER)
+        elif status == "overdue":
+            query.update(overdue_invoice_filter())
+        else:
+            query["status"] = status
+    return query
+
+
+async def upsert_records(entity: str, user_id: str, organization_id: Optional[str], records: List[Dict]) -> int:
+    """Write a batch of Zoho records into the mirror, returning how many were written"""
+    if not records:
+        return 0
+
+    id_field = MIRROR_ENTITIES[entity]["id_field"]
+    now = datetime.utcnow()
+    operations = []
+    for record in records:
+        zoho_id = record.get(id_field)
+        if not zoho_id:
+            continue
+        key = {"user_id": user_id, "organization_id": organization_id, "zoho_id": zoho_id}
+        operations.append(UpdateOne(
+            key,
+            {"$set": {
+                **record,
+                **key,
+                "modified_at": parse_zoho_timestamp(record.get("last_modified_time")),
+                "synced_at": now,
+            }},
+            upsert=True
+        ))
+
+    if not operations:
+        return 0
+    await mirror_collection(entity).bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def delete_records(entity: str, user_id: str, organization_id: Optional[str], zoho_ids: List[str]) -> int:
+    """Remove records that no longer exist in Zoho"""
+    if not zoho_ids:
+        return 0
+    result = await mirror_collection(entity).delete_many({
+        "user_id": user_id,
+        "organization_id": organization_id,
+        "zoho_id": {"$in": zoho_ids},
+    })
+    return result.deleted_count
+
+
+async def delete_unseen_records(entity: str, user_id: str, organization_id: Optional[str], seen_since: datetime) -> int:
+    """After a full sync, drop records that were not touched by it (deleted in Zoho)"""
+    result = await mirror_collection(entity).delete_many({
+        "user_id": user_id,
+        "organization_id": organization_id,
+        "synced_at": {"$lt": seen_since},
+    })
+    return result.deleted_count
+
+
+async def clear_mirror(user_id: str):
+    """Drop every mirrored record for a user (on disconnect)"""
+    for entity in MIRROR_ENTITIES:
+        await mirror_collection(entity).delete_many({"user_id": user_id})
+
+
+def iter_mirror_records(
+    entity: str,
+    user_id: str,
+    organization_id: Optional[str],
+    status: Optional[str] = None,
+    limit: Optional[int] = None
+) -> AsyncIterator[Dict]:
+    """Stream mirrored records in Zoho's raw shape (only the first `limit` in list order when given)"""
+    query = mirror_query(entity, user_id, organization_id, status)
+    cursor = mirror_collection(entity).find(query, MIRROR_FIELDS).sort(MIRROR_ENTITIES[entity]["sort"])
+    return cursor.limit(limit) if limit else cursor
+
+
+async def find_mirror_records(
+    entity: str,
+    user_id: str,
+    organization_id: Optional[str],
+    status: Optional[str] = None,
+    limit: Optional[int] = None
+) -> List[Dict]:
+    """Load mirrored records in Zoho's raw shape"""
+    return [record async for record in iter_mirror_records(entity, user_id, organization_id, status, limit)]
@@ -0,0 +1,294 @@
+"""
+Zoho Books outbound rate limiting
+Per-organization minute and day windows for Zoho's API limits, counted in MongoDB so
+every process shares them, with a per-process priority queue in front: interactive
+(dashboard/chat) calls are released before background sync calls, and background
+work stops short of the daily limit so users keep some quota. 429 Retry-After
+pauses the organization for every process.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import init_db
+
+# Zoho Books allows 100 requests per minute per organization; the daily limit depends on the plan
+ZOHO_RATE_PER_MINUTE = int(os.environ.get('ZOHO_RATE_PER_MINUTE', '100'))
+ZOHO_RATE_PER_DAY = int(os.environ.get('ZOHO_RATE_PER_DAY', '5000'))
+# Share of the daily quota background work may use (the rest is kept for interactive calls)
+ZOHO_BACKGROUND_DAILY_SHARE = float(os.environ.get('ZOHO_BACKGROUND_DAILY_SHARE', '0.8'))
+# Longest an interactive call waits in the queue before failing (seconds)
+ZOHO_RATE_MAX_WAIT = float(os.environ.get('ZOHO_RATE_MAX_WAIT', '15'))
+# A process forgets an organization's limiter after this long without calls (seconds)
+ZOHO_LIMITER_IDLE_SECONDS = 10 * 60
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+zoho_priority: ContextVar[int] = ContextVar('zoho_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def background_priority():
+    """Run the enclosed Zoho calls at background priority (mirror sync, batch jobs)"""
+    token = zoho_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        zoho_priority.reset(token)
+
+
+class RateLimitExceeded(Exception):
+    """No quota will be available for this call in time"""
+
+    def __init__(self, organization_id: str, reason: str, retry_after: Optional[float] = None):
+        self.organization_id = organization_id
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+def _next_utc_midnight(now: datetime) -> datetime:
+    return datetime(now.year, now.month, now.day) + timedelta(days=1)
+
+
+def _day_window(organization_id: str, now: datetime) -> str:
+    return f"{organization_id}:day:{now:%Y%m%d}"
+
+
+def _minute_window(organization_id: str, now: datetime) -> str:
+    return f"{organization_id}:minute:{now:%Y%m%d%H%M}"
+
+
+class OrgRateLimiter:
+    """One process's queue in front of an organization's shared minute and day windows
+
+    The counters live in zoho_rate_windows and are taken with a conditional $inc, so
+    every API and worker process draws from the same quota. Locally the limiter only
+    orders this process's waiters by priority and remembers how long the windows
+    said to back off, so a throttled organization does not cost a round trip per call.
+    """
+
+    def __init__(self, organization_id: str, per_minute: int = ZOHO_RATE_PER_MINUTE, per_day: int = ZOHO_RATE_PER_DAY):
+        self.organization_id = organization_id
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.day_used = 0  # as of the last reservation or Zoho response
+        self.blocked_until = {INTERACTIVE: 0.0, BACKGROUND: 0.0}  # monotonic
+        self.last_used = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.stats = {"granted": 0, "queued": 0, "rejected": 0, "throttled": 0}
+
+    def _day_limit(self, priority: int) -> int:
+        return self.per_day if priority == INTERACTIVE else int(self.per_day * ZOHO_BACKGROUND_DAILY_SHARE)
+
+    def _blocked_for(self, priority: int) -> float:
+        return max(0.0, self.blocked_until[priority] - time.monotonic())
+
+    def _block(self, priority: int, seconds: float):
+        until = time.monotonic() + seconds
+        self.blocked_until[priority] = until
+        if priority == INTERACTIVE:
+            # Whatever stops interactive calls stops background ones too
+            self.blocked_until[BACKGROUND] = max(self.blocked_until[BACKGROUND], until)
+
+    async def _reserve(self, priority: int) -> float:
+        """Take one call from the shared windows; returns 0, or seconds until one may be free"""
+        db = init_db()
+        now = datetime.utcnow()
+        day_id = _day_window(self.organization_id, now)
+        try:
+            # A full or paused window fails the filter, so the upsert collides on _id
+            day = await db.zoho_rate_windows.find_one_and_update(
+                {"_id": day_id, "count": {"$lt": self._day_limit(priority)},
+                 "$or": [{"paused_until": {"$exists": False}}, {"paused_until": {"$lte": now}}]},
+                {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": _next_utc_midnight(now) + timedelta(days=1)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            day = await db.zoho_rate_windows.find_one({"_id": day_id}) or {}
+            self.day_used = day.get("count", self.day_used)
+            wait = 0.0
+            if day.get("paused_until") and day["paused_until"] > now:
+                wait = (day["paused_until"] - now).total_seconds()
+            if day.get("count", 0) >= self._day_limit(priority):
+                wait = max(wait, (_next_utc_midnight(now) - now).total_seconds())
+            # Neither: the window changed under us, so try again shortly
+            return max(wait, 0.05)
+        self.day_used = day["count"]
+
+        minute_start = now.replace(second=0, microsecond=0)
+        try:
+            await db.zoho_rate_windows.update_one(
+                {"_id": _minute_window(self.organization_id, now), "count": {"$lt": self.per_minute}},
+                {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": minute_start + timedelta(minutes=2)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Give the day slot back and wait for the next minute
+            await db.zoho_rate_windows.update_one({"_id": day_id}, {"$inc": {"count": -1}})
+            return max(0.05, (minute_start + timedelta(minutes=1) - now).total_seconds())
+        return 0.0
+
+    async def _take(self, priority: int) -> float:
+        wait = await self._reserve(priority)
+        if wait > 0:
+            self._block(priority, wait)
+        else:
+            self.stats["granted"] += 1
+        return wait
+
+    async def acquire(self, priority: int = INTERACTIVE, max_wait: Optional[float] = None):
+        """Wait for quota; raises RateLimitExceeded if it will not come within max_wait"""
+        self.last_used = time.monotonic()
+        delay = self._blocked_for(priority)
+        if delay == 0 and not self._waiters:
+            delay = await self._take(priority)
+            if delay == 0:
+                return
+        if max_wait is not None and delay > max_wait:
+            self.stats["rejected"] += 1
+            raise RateLimitExceeded(self.organization_id, "Zoho Books API quota exhausted", retry_after=delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.stats["queued"] += 1
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        # A higher-priority arrival may be grantable sooner than what the pump is sleeping on
+        self._wakeup.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.stats["rejected"] += 1
+            raise RateLimitExceeded(self.organization_id, "Timed out waiting for Zoho Books API quota")
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def _run_pump(self):
+        """Release queued callers in priority order as the shared windows allow"""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._blocked_for(priority)
+            if delay == 0:
+                delay = await self._take(priority)
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, 60.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._waiters)
+            if future.done():
+                # Gave up while the reservation was in flight; the call is simply not made
+                continue
+            future.set_result(None)
+
+    async def pause(self, seconds: float):
+        """Zoho said 429: stop every process granting calls for `seconds`"""
+        now = datetime.utcnow()
+        db = init_db()
+        await db.zoho_rate_windows.update_one(
+            {"_id": _day_window(self.organization_id, now)},
+            {"$max": {"paused_until": now + timedelta(seconds=seconds)},
+             "$setOnInsert": {"count": 0, "expires_at": _next_utc_midnight(now) + timedelta(days=1)}},
+            upsert=True
+        )
+        self._block(INTERACTIVE, seconds)
+        self.stats["throttled"] += 1
+
+    async def observe(self, headers):
+        """Adopt Zoho's own view of the daily quota when it reports more use than the window"""
+        limit = headers.get("X-Rate-Limit-Limit")
+        remaining = headers.get("X-Rate-Limit-Remaining")
+        try:
+            if limit is not None:
+                self.per_day = int(limit)
+            if remaining is None:
+                return
+            used = max(0, self.per_day - int(remaining))
+        except ValueError:
+            return
+        # Calls made outside this deployment (other apps on the organization) count too
+        if used > self.day_used:
+            self.day_used = used
+            db = init_db()
+            now = datetime.utcnow()
+            await db.zoho_rate_windows.update_one(
+                {"_id": _day_window(self.organization_id, now)},
+                {"$max": {"count": used}, "$setOnInsert": {"expires_at": _next_utc_midnight(now) + timedelta(days=1)}},
+                upsert=True
+            )
+
+    def idle(self) -> bool:
+        return not self._waiters and time.monotonic() - self.last_used > ZOHO_LIMITER_IDLE_SECONDS
+
+    def metrics(self) -> Dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            **self.stats,
+            "minute_limit": self.per_minute,
+            "day_used": self.day_used,
+            "day_remaining": max(0, self.per_day - self.day_used),
+            "day_limit": self.per_day,
+            "blocked_for": round(self._blocked_for(INTERACTIVE), 1),
+            "waiting": queued,
+        }
+
+
+_limiters: Dict[str, OrgRateLimiter] = {}
+_pruned_at = time.monotonic()
+
+
+def get_org_limiter(organization_id: str) -> OrgRateLimiter:
+    global _pruned_at
+    if time.monotonic() - _pruned_at > ZOHO_LIMITER_IDLE_SECONDS:
+        # Forget organizations this process has not called lately (their counters stay in Mongo)
+        for org in [org for org, limiter in _limiters.items() if limiter.idle()]:
+            del _limiters[org]
+        _pruned_at = time.monotonic()
+    limiter = _limiters.get(organization_id)
+    if limiter is None:
+        limiter = _limiters[organization_id] = OrgRateLimiter(organization_id)
+    return limiter
+
+
+async def acquire_zoho_quota(organization_id: str):
+    """Wait for a request slot at the caller's priority (see background_priority)"""
+    priority = zoho_priority.get()
+    max_wait = ZOHO_RATE_MAX_WAIT if priority == INTERACTIVE else None
+    await get_org_limiter(organization_id).acquire(priority, max_wait=max_wait)
+
+
+def metrics_label(organization_id: str) -> str:
+    """Stable opaque label for an organization in metrics (ids are not exposed)"""
+    return "org-" + hashlib.sha256(organization_id.encode()).hexdigest()[:12]
+
+
+def get_rate_limit_metrics() -> Dict:
+    return {metrics_label(org): limiter.metrics() for org, limiter in _limiters.items()}
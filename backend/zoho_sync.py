@@ -0,0 +1,165 @@
+"""
+Zoho Books -> MongoDB sync engine
+Pulls invoices, customer payments and contacts into the local mirror, incrementally
+by last_modified_time once a first full sync has completed
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from cache_broadcast import broadcast_invalidation
+from dashboard_views import refresh_all_views
+from database import init_db
+from dso_engine import apply_payments, prune_payments
+from job_queue import enqueue_job, merge_queued_payload, MIRROR_SYNC, PRIORITY_NORMAL
+from zoho_api_helper import get_user_zoho_credentials, iter_zoho_records
+from zoho_rate_limiter import background_priority
+from zoho_mirror import (
+    MIRROR_ENTITIES, upsert_records, delete_unseen_records, parse_zoho_timestamp
+)
+
+logger = logging.getLogger(__name__)
+
+# Records are written to Mongo in batches of this size while pages stream in
+SYNC_BATCH_SIZE = 500
+
+# Reads that find the mirror stale queue a sync at most this often per user (seconds)
+MIRROR_SYNC_REQUEST_INTERVAL = 60
+
+_sync_requested_at: Dict[str, float] = {}
+_sync_requests_pruned_at = 0.0
+
+
+async def _write_batch(entity: str, user_id: str, organization_id: Optional[str], batch: list) -> int:
+    written = await upsert_records(entity, user_id, organization_id, batch)
+    if entity == "payments":
+        # Invoices sync first, so the mirror can date the invoices these payments settle
+        await apply_payments(user_id, organization_id, batch)
+    return written
+
+
+async def sync_entity(user_id: str, integration: Dict, entity: str, full: bool = False) -> Dict:
+    """Sync one entity for one tenant
+
+    Incremental runs walk the list newest-modified first and stop at the stored
+    cursor; full runs walk everything and sweep records that disappeared from Zoho.
+    """
+    spec = MIRROR_ENTITIES[entity]
+    organization_id = integration.get("organization_id")
+    cursor = None if full else (integration.get("sync_cursors") or {}).get(entity)
+    started_at = datetime.utcnow()
+
+    params = dict(spec["params"])
+    params.update({"sort_column": "last_modified_time", "sort_order": "D"})
+
+    newest_seen: Optional[datetime] = None
+    batch = []
+    written = 0
+    # Sync must see Zoho's current state, never a cached page
+    records = iter_zoho_records(user_id, spec["endpoint"], spec["key"], params, raise_errors=True, use_cache=False)
+    try:
+        async for record in records:
+            modified = parse_zoho_timestamp(record.get("last_modified_time"))
+            if cursor and modified and modified < cursor:
+                # Sorted by last_modified_time desc: everything after this is already mirrored
+                break
+            if modified and (newest_seen is None or modified > newest_seen):
+                newest_seen = modified
+
+            batch.append(record)
+            if len(batch) >= SYNC_BATCH_SIZE:
+                written += await _write_batch(entity, user_id, organization_id, batch)
+                batch = []
+    finally:
+        await records.aclose()
+
+    written += await _write_batch(entity, user_id, organization_id, batch)
+
+    deleted = 0
+    if full:
+        deleted = await delete_unseen_records(entity, user_id, organization_id, started_at)
+        if entity == "payments":
+            await prune_payments(user_id, organization_id, started_at)
+
+    return {
+        "written": written,
+        "deleted": deleted,
+        "cursor": newest_seen or cursor,
+    }
+
+
+async def sync_zoho_mirror(user_id: str, full: bool = False) -> Dict:
+    """Sync every mirrored entity for a user and record the new cursors on the integration"""
+    integration = await get_user_zoho_credentials(user_id, fresh=True)
+    if not integration or integration.get("mode") != "production":
+        return {"synced": False, "reason": "No production Zoho Books integration"}
+
+    # Without a completed sync there is nothing to be incremental against
+    full = full or not integration.get("mirror_synced_at")
+
+    results = {}
+    cursors = dict(integration.get("sync_cursors") or {})
+    # Sync calls queue behind dashboard and chat calls for the org's Zoho quota
+    with background_priority():
+        for entity in MIRROR_ENTITIES:
+            outcome = await sync_entity(user_id, integration, entity, full=full)
+            results[entity] = {"written": outcome["written"], "deleted": outcome["deleted"]}
+            if outcome["cursor"]:
+                cursors[entity] = outcome["cursor"]
+
+    now = datetime.utcnow()
+    db = init_db()
+    await db.integrations.update_one(
+        {"_id": integration["_id"]},
+        {"$set": {
+            "sync_cursors": cursors,
+            "mirror_synced_at": now,
+            "last_sync": now,
+        }}
+    )
+
+    # Cached integration and live responses may now disagree with the mirror, in
+    # every process (this usually runs in the worker)
+    await broadcast_invalidation(user_id)
+
+    # Dashboard views are rebuilt from the fresh mirror
+    with background_priority():
+        views = await refresh_all_views(user_id)
+
+    logger.info(f"Zoho mirror sync for user {user_id} ({'full' if full else 'incremental'}): {results}")
+    return {"synced": True, "full": full, "entities": results, "views": views, "synced_at": now}
+
+
+async def run_mirror_sync(job: Dict) -> Dict:
+    """mirror_sync job handler"""
+    outcome = await sync_zoho_mirror(job["user_id"], full=job["payload"].get("full", False))
+    return {key: outcome.get(key) for key in ("synced", "full", "entities", "views", "reason")}
+
+
+async def schedule_mirror_sync(user_id: str, full: bool = False, priority: int = PRIORITY_NORMAL) -> str:
+    """Queue a sync for a user; returns the job id (an already queued sync is reused)"""
+    job_id = await enqueue_job(MIRROR_SYNC, user_id, {"full": full}, priority=priority, key=f"{MIRROR_SYNC}:{user_id}")
+    if full:
+        # The queued sync may have been an incremental one
+        await merge_queued_payload(job_id, {"full": True})
+    return job_id
+
+
+async def request_mirror_sync(user_id: str):
+    """Queue a sync for a stale mirror, at most once per MIRROR_SYNC_REQUEST_INTERVAL per user"""
+    global _sync_requests_pruned_at
+    now = time.monotonic()
+    if now - _sync_requests_pruned_at >= MIRROR_SYNC_REQUEST_INTERVAL:
+        # Requests older than the interval no longer suppress anything
+        for stale_user in [uid for uid, at in _sync_requested_at.items() if now - at >= MIRROR_SYNC_REQUEST_INTERVAL]:
+            del _sync_requested_at[stale_user]
+        _sync_requests_pruned_at = now
+    if now - _sync_requested_at.get(user_id, float("-inf")) < MIRROR_SYNC_REQUEST_INTERVAL:
+        return
+    _sync_requested_at[user_id] = now
+    try:
+        await schedule_mirror_sync(user_id)
+    except Exception as e:
+        logger.error(f"Could not queue Zoho mirror sync for user {user_id}: {str(e)}")
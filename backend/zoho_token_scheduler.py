@@ -0,0 +1,129 @@
+"""
+Proactive Zoho OAuth token refresh
+Background loop that refreshes access tokens shortly before they expire, so user
+requests never pay the 401 -> refresh -> retry round trip
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import init_db
+from zoho_api_helper import refresh_access_token, integration_token_expiry
+
+logger = logging.getLogger(__name__)
+
+ZOHO_TOKEN_SCHEDULER_ENABLED = os.environ.get('ZOHO_TOKEN_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# How often to look for expiring tokens (seconds)
+ZOHO_TOKEN_REFRESH_INTERVAL = int(os.environ.get('ZOHO_TOKEN_REFRESH_INTERVAL', '60'))
+# Refresh tokens that expire within this window (seconds)
+ZOHO_TOKEN_REFRESH_MARGIN = int(os.environ.get('ZOHO_TOKEN_REFRESH_MARGIN', '300'))
+ZOHO_TOKEN_REFRESH_CONCURRENCY = int(os.environ.get('ZOHO_TOKEN_REFRESH_CONCURRENCY', '5'))
+# A worker that claimed an integration owns its refresh for this long (seconds)
+ZOHO_TOKEN_REFRESH_LEASE = 120
+
+_scheduler_task: Optional[asyncio.Task] = None
+
+
+async def _claim(integration_id, now: datetime) -> bool:
+    """Claim an integration so only one process refreshes it (multi-worker deployments)"""
+    db = init_db()
+    result = await db.integrations.update_one(
+        {
+            "_id": integration_id,
+            "$or": [
+                {"token_refresh_lease_until": {"$exists": False}},
+                {"token_refresh_lease_until": {"$lt": now}},
+            ]
+        },
+        {"$set": {"token_refresh_lease_until": now + timedelta(seconds=ZOHO_TOKEN_REFRESH_LEASE)}}
+    )
+    return result.modified_count == 1
+
+
+async def refresh_expiring_tokens() -> int:
+    """Refresh every production token expiring within the margin; returns how many were refreshed"""
+    db = init_db()
+    now = datetime.utcnow()
+    horizon = now + timedelta(seconds=ZOHO_TOKEN_REFRESH_MARGIN)
+
+    cursor = db.integrations.find(
+        {
+            "type": "zohobooks",
+            "status": "active",
+            "mode": "production",
+            "refresh_token": {"$exists": True},
+            # Revoked tokens wait for the user to reconnect; failed ones for their backoff
+            "needs_reauth": {"$ne": True},
+            "token_refresh_retry_at": {"$not": {"$gt": now}},
+            "$or": [
+                {"token_expires_at": {"$lte": horizon}},
+                # Integrations stored before token_expires_at existed: backfilled or refreshed once below
+                {"token_expires_at": None},
+            ]
+        },
+        {"user_id": 1, "token_expires_at": 1, "token_expires_in": 1, "token_refreshed_at": 1, "connected_at": 1}
+    )
+
+    semaphore = asyncio.Semaphore(ZOHO_TOKEN_REFRESH_CONCURRENCY)
+    refreshed = 0
+
+    async def refresh(integration):
+        nonlocal refreshed
+        async with semaphore:
+            if not await _claim(integration["_id"], now):
+                return
+            if await refresh_access_token(integration["user_id"]):
+                refreshed += 1
+            else:
+                logger.warning(f"Proactive Zoho token refresh failed for user {integration['user_id']}")
+
+    tasks = []
+    async for integration in cursor:
+        expires_at = integration_token_expiry(integration)
+        if expires_at is not None and expires_at > horizon:
+            # Expiry derived from older fields: store it so later ticks skip this integration
+            await db.integrations.update_one({"_id": integration["_id"]}, {"$set": {"token_expires_at": expires_at}})
+        else:
+            # A refresh always stores token_expires_at
+            tasks.append(refresh(integration))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return refreshed
+
+
+async def _run_scheduler():
+    while True:
+        try:
+            refreshed = await refresh_expiring_tokens()
+            if refreshed:
+                logger.info(f"Proactively refreshed {refreshed} Zoho token(s)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Zoho token scheduler error: {str(e)}")
+        await asyncio.sleep(ZOHO_TOKEN_REFRESH_INTERVAL)
+
+
+def start_token_scheduler():
+    """Start the background refresh loop (FastAPI startup hook)"""
+    global _scheduler_task
+    if not ZOHO_TOKEN_SCHEDULER_ENABLED:
+        return
+    if _scheduler_task is None or _scheduler_task.done():
+        _scheduler_task = asyncio.create_task(_run_scheduler())
+
+
+async def stop_token_scheduler():
+    """Cancel the background refresh loop (FastAPI shutdown hook)"""
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+    _scheduler_task = None
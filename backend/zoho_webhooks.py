@@ -0,0 +1,221 @@
+"""
+Zoho Books webhook ingestion
+Signed invoice, customer payment and contact change events are queued per tenant in
+zoho_webhook_events and applied to the local mirror in order by a webhook_events job. Afterwards the
+tenant's cached Zoho responses are dropped in every process and its dashboard view versions bumped,
+so reads keep being served from cache and views until a real change arrives.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from cache_broadcast import broadcast_invalidation
+from dashboard_views import mark_views_stale
+from database import init_db
+from dso_engine import apply_payments, remove_payments
+from job_queue import enqueue_job, WEBHOOK_EVENTS, PRIORITY_HIGH
+from zoho_mirror import (
+    MIRROR_ENTITIES, mirror_collection, upsert_records, delete_records, parse_zoho_timestamp
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared signing secret for deployments that configure one webhook for every tenant;
+# integrations with their own webhook_secret are verified against that instead
+ZOHO_WEBHOOK_SECRET = os.environ.get('ZOHO_WEBHOOK_SECRET', '')
+ZOHO_WEBHOOK_SIGNATURE_HEADER = os.environ.get('ZOHO_WEBHOOK_SIGNATURE_HEADER', 'X-Zoho-Webhook-Signature')
+
+# Largest webhook body accepted (bytes)
+ZOHO_WEBHOOK_MAX_BYTES = 1024 * 1024
+
+# Events applied per pass while draining a tenant's queue
+WEBHOOK_BATCH_SIZE = 200
+
+# Payload key -> mirrored entity
+WEBHOOK_ENTITIES = {
+    "invoice": "invoices",
+    "customerpayment": "payments",
+    "payment": "payments",
+    "contact": "contacts",
+}
+
+class WebhookError(ValueError):
+    """The webhook body is not a Zoho Books event we can read"""
+
+
+def verify_signature(body: bytes, signature: Optional[str], secrets: List[str]) -> bool:
+    """HMAC-SHA256 of the raw body, sent hex or base64 encoded (optionally "sha256=" prefixed)"""
+    if not signature:
+        return False
+    signature = signature.strip()
+    if signature.lower().startswith("sha256="):
+        signature = signature[7:]
+    for secret in secrets:
+        if not secret:
+            continue
+        digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+        if hmac.compare_digest(signature.lower(), digest.hex()):
+            return True
+        if hmac.compare_digest(signature, base64.b64encode(digest).decode()):
+            return True
+    return False
+
+
+def parse_payload(body: bytes, content_type: str) -> Dict:
+    """JSON body, or the form-encoded JSONString Zoho sends for form-style webhooks"""
+    try:
+        if "application/x-www-form-urlencoded" in (content_type or ""):
+            form = parse_qs(body.decode())
+            payload = json.loads((form.get("JSONString") or ["{}"])[0])
+        else:
+            payload = json.loads(body or b"{}")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise WebhookError(f"Invalid webhook body: {e}")
+    if not isinstance(payload, dict):
+        raise WebhookError("Webhook body must be a JSON object")
+    return payload
+
+
+def parse_event(payload: Dict, event_type: Optional[str] = None) -> Optional[Dict]:
+    """{entity, action, zoho_id, record} for a supported event, None for anything else"""
+    for key, entity in WEBHOOK_ENTITIES.items():
+        record = payload.get(key)
+        if isinstance(record, dict):
+            break
+    else:
+        return None
+
+    zoho_id = record.get(MIRROR_ENTITIES[entity]["id_field"])
+    if not zoho_id:
+        raise WebhookError(f"{key} event without {MIRROR_ENTITIES[entity]['id_field']}")
+
+    event_type = (event_type or payload.get("event_type") or payload.get("action") or "").lower()
+    return {
+        "entity": entity,
+        "action": "delete" if "delet" in event_type else "upsert",
+        "zoho_id": str(zoho_id),
+        "record": record,
+    }
+
+
+async def find_webhook_integrations(organization_id: str) -> List[Dict]:
+    """Active production integrations for a Zoho organization (one per connected user)"""
+    db = init_db()
+    return await db.integrations.find({
+        "type": "zohobooks",
+        "status": "active",
+        "mode": "production",
+        "organization_id": organization_id,
+    }).to_list(length=100)
+
+
+def webhook_secrets(integration: Dict) -> List[str]:
+    secret = integration.get("webhook_secret")
+    return [secret] if secret else [ZOHO_WEBHOOK_SECRET]
+
+
+async def enqueue_event(integration: Dict, event: Dict):
+    db = init_db()
+    now = datetime.utcnow()
+    user_id = integration["user_id"]
+    await db.zoho_webhook_events.insert_one({
+        **event,
+        "user_id": user_id,
+        "organization_id": integration.get("organization_id"),
+        "received_at": now,
+        "processed_at": None,
+    })
+    if not integration.get("webhook_received_at"):
+        # Every process must see the push-fed view max age from now on
+        await broadcast_invalidation(user_id)
+    await db.integrations.update_one({"_id": integration["_id"]}, {"$set": {"webhook_received_at": now}})
+
+
+async def _newer_in_mirror(entity: str, user_id: str, organization_id: Optional[str], records: List[Dict]) -> set:
+    """zoho_ids whose mirrored copy is newer than the event (webhooks can arrive out of order)"""
+    modified = {
+        record[MIRROR_ENTITIES[entity]["id_field"]]: parse_zoho_timestamp(record.get("last_modified_time"))
+        for record in records
+    }
+    newer = set()
+    async for doc in mirror_collection(entity).find(
+        {"user_id": user_id, "organization_id": organization_id, "zoho_id": {"$in": list(modified)}},
+        {"_id": 0, "zoho_id": 1, "modified_at": 1}
+    ):
+        event_modified = modified.get(doc["zoho_id"])
+        if event_modified and doc.get("modified_at") and doc["modified_at"] > event_modified:
+            newer.add(doc["zoho_id"])
+    return newer
+
+
+async def apply_events(user_id: str, organization_id: Optional[str], events: List[Dict]) -> Dict[str, int]:
+    """Apply one tenant's events to the mirror and DSO statistics; the last event per record wins"""
+    latest: Dict[tuple, Dict] = {}
+    for event in events:
+        latest[(event["entity"], event["zoho_id"])] = event
+
+    applied = {}
+    for entity in MIRROR_ENTITIES:
+        upserts = [e["record"] for (name, _), e in latest.items() if name == entity and e["action"] == "upsert"]
+        deletes = [zoho_id for (name, zoho_id), e in latest.items() if name == entity and e["action"] == "delete"]
+        if upserts:
+            newer = await _newer_in_mirror(entity, user_id, organization_id, upserts)
+            id_field = MIRROR_ENTITIES[entity]["id_field"]
+            upserts = [record for record in upserts if record[id_field] not in newer]
+        written = await upsert_records(entity, user_id, organization_id, upserts)
+        deleted = await delete_records(entity, user_id, organization_id, deletes)
+        if entity == "payments":
+            await apply_payments(user_id, organization_id, upserts)
+            await remove_payments(user_id, organization_id, deletes)
+        if written or deleted:
+            applied[entity] = written + deleted
+    return applied
+
+
+async def process_webhook_events(user_id: str) -> int:
+    """Drain a tenant's queued events; returns how many were processed"""
+    db = init_db()
+    processed = 0
+    while True:
+        events = await db.zoho_webhook_events.find(
+            {"user_id": user_id, "processed_at": None}
+        ).sort("received_at", 1).to_list(length=WEBHOOK_BATCH_SIZE)
+        if not events:
+            break
+
+        by_org: Dict[Optional[str], List[Dict]] = {}
+        for event in events:
+            by_org.setdefault(event.get("organization_id"), []).append(event)
+        for organization_id, org_events in by_org.items():
+            await apply_events(user_id, organization_id, org_events)
+
+        await db.zoho_webhook_events.update_many(
+            {"_id": {"$in": [event["_id"] for event in events]}},
+            {"$set": {"processed_at": datetime.utcnow()}}
+        )
+        processed += len(events)
+
+    if processed:
+        # The drain runs in the worker; API processes drop their cached responses too
+        await broadcast_invalidation(user_id)
+        await mark_views_stale(user_id)
+        logger.info(f"Applied {processed} Zoho webhook event(s) for user {user_id}")
+    return processed
+
+
+async def schedule_webhook_processing(user_id: str) -> str:
+    """Queue a drain of the tenant's events (one queued drain covers every event before it runs)"""
+    return await enqueue_job(WEBHOOK_EVENTS, user_id, priority=PRIORITY_HIGH, key=f"{WEBHOOK_EVENTS}:{user_id}")
+
+
+async def clear_webhook_events(user_id: str):
+    """Drop a user's queued events (on disconnect)"""
+    db = init_db()
+    await db.zoho_webhook_events.delete_many({"user_id": user_id})
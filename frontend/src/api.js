@@ -43,8 +43,12 @@ export const chatAPI = {
     return response.data;
   },
   
-  getHistory: async (sessionId = null) => {
+  // Newest page of a session's messages, or the page older than `before` (a page's next_before)
+  getHistory: async (sessionId = null, before = null) => {
     const params = sessionId ? { session_id: sessionId } : {};
+    if (sessionId && before !== null) {
+      params.before = before;
+    }
     const response = await axios.get(`${API}/chat/history`, {
       ...createAuthConfig(),
       params
@@ -73,8 +77,8 @@ export const dashboardAPI = {
     return response.data;
   },
   
-  getCollections: async () => {
-    const response = await axios.get(`${API}/dashboard/collections`, createAuthConfig());
+  getCollections: async (params = {}) => {
+    const response = await axios.get(`${API}/dashboard/collections`, { ...createAuthConfig(), params });
     return response.data;
   },
   
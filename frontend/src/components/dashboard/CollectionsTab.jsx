@@ -14,7 +14,7 @@ const CollectionsTab = () => {
 
   const loadCollectionsData = async () => {
     try {
-      const data = await dashboardAPI.getCollections();
+      const data = await dashboardAPI.getCollections({ limit: 5 });
       setCollectionsData(data);
     } catch (error) {
       console.error('Failed to load collections data:', error);
@@ -64,14 +64,14 @@ const CollectionsTab = () => {
     },
     {
       title: 'Unpaid Invoices',
-      value: collectionsData.unpaid_invoices.length.toString(),
+      value: collectionsData.unpaid_count.toString(),
       change: '+8',
       icon: CheckCircle2,
       color: 'blue'
     },
     {
       title: 'Overdue Invoices',
-      value: collectionsData.overdue_invoices.length.toString(),
+      value: collectionsData.overdue_count.toString(),
       change: '-3',
       icon: AlertTriangle,
       color: 'orange'
@@ -28,6 +28,9 @@ const Dashboard = () => {
   const [integrationsModalOpen, setIntegrationsModalOpen] = useState(false);
   const [integrationStatus, setIntegrationStatus] = useState({ zohobooks_connected: false });
   const messagesEndRef = useRef(null);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const keepScrollRef = useRef(false);
   const [sidebarCollapsed, setSidebarCollapsed] = useState(false);
 
   const dashboardTabs = [
@@ -69,6 +72,11 @@ const Dashboard = () => {
   };
 
   useEffect(() => {
+    // Older pages are prepended; stay where the user is reading
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -76,11 +84,27 @@ const Dashboard = () => {
     try {
       const response = await chatAPI.getHistory(sessionId);
       setMessages(response.messages);
+      setHistoryCursor(response.next_before || null);
     } catch (error) {
       console.error('Failed to load chat history:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!historyCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const response = await chatAPI.getHistory(sessionId, historyCursor);
+      keepScrollRef.current = true;
+      setMessages(prev => [...response.messages, ...prev]);
+      setHistoryCursor(response.next_before || null);
+    } catch (error) {
+      console.error('Failed to load earlier messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const loadAnalytics = async () => {
     try {
       const data = await dashboardAPI.getAnalytics();
@@ -274,6 +298,18 @@ const Dashboard = () => {
             {/* Messages */}
             <div className="flex-1 overflow-y-auto p-6">
               <div className="max-w-4xl mx-auto space-y-6">
+                {historyCursor && (
+                  <div className="flex justify-center">
+                    <Button
+                      variant="outline"
+                      size="sm"
+                      onClick={loadOlderMessages}
+                      disabled={loadingOlder}
+                    >
+                      {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                    </Button>
+                  </div>
+                )}
                 {messages.map((msg) => (
                   <div
                     key={msg.id}
@@ -0,0 +1,108 @@
+"""
+Collections keyset cursors and ordering
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import collections_query  # noqa: E402
+from collections_query import CollectionsQuery, InvalidCursor, decode_cursor, encode_cursor  # noqa: E402
+
+
+def _invoices():
+    return [
+        {
+            "invoice_id": f"i{i:02d}",
+            "balance": float(i % 4 + 1),
+            "due_date": None if i % 3 == 0 else f"2024-01-{i % 5 + 1:02d}",
+            "status": "sent",
+        }
+        for i in range(20)
+    ]
+
+
+def _walk(sort: str, order: str):
+    params = CollectionsQuery(limit=3, sort=sort, order=order)
+    ordered = sorted(_invoices(), key=params.sort_key, reverse=params.descending)
+    seen, cursor = [], None
+    while True:
+        rows, cursor = CollectionsQuery(limit=3, sort=sort, order=order, cursor=cursor).page(ordered, "unpaid")
+        seen.extend(rows)
+        if cursor is None:
+            return seen
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(12.5, "inv-1")) == (12.5, "inv-1")
+    assert decode_cursor(encode_cursor(None, "inv-2")) == (None, "inv-2")
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor")
+
+
+def test_cursor_must_match_the_sort():
+    balance_cursor = encode_cursor(10.0, "inv-1")
+    with pytest.raises(InvalidCursor):
+        CollectionsQuery(sort="due_date", cursor=balance_cursor)
+    with pytest.raises(InvalidCursor):
+        CollectionsQuery(sort="balance", cursor=encode_cursor(None, "inv-1"))
+
+
+@pytest.mark.parametrize("sort,order", [("due_date", "asc"), ("due_date", "desc"), ("balance", "desc"), ("balance", "asc")])
+def test_pages_cover_every_invoice_once(sort, order):
+    seen = _walk(sort, order)
+    assert sorted(inv["invoice_id"] for inv in seen) == [f"i{i:02d}" for i in range(20)]
+
+
+def test_missing_due_dates_sort_like_mongo_nulls():
+    ascending = _walk("due_date", "asc")
+    descending = _walk("due_date", "desc")
+    nulls = sum(1 for inv in ascending if inv["due_date"] is None)
+    assert all(inv["due_date"] is None for inv in ascending[:nulls])
+    assert all(inv["due_date"] is None for inv in descending[-nulls:])
+
+
+class _RecordingCollection:
+    def __init__(self):
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        return self
+
+    def sort(self, keys):
+        return self
+
+    def limit(self, count):
+        return self
+
+    async def to_list(self, length):
+        return []
+
+
+@pytest.mark.parametrize("order,expected", [
+    ("asc", [{"due_date": None, "zoho_id": {"$gt": "i03"}}, {"due_date": {"$ne": None}}]),
+    ("desc", [{"due_date": None, "zoho_id": {"$lt": "i03"}}]),
+])
+def test_mirror_keyset_after_a_null_row(monkeypatch, order, expected):
+    collection = _RecordingCollection()
+    monkeypatch.setattr(collections_query, "mirror_collection", lambda entity: collection)
+    params = CollectionsQuery(sort="due_date", order=order, cursor=encode_cursor(None, "i03"))
+    asyncio.run(params.mongo_page({"user_id": "u"}, "unpaid"))
+    assert collection.queries[0] == {"$and": [{"user_id": "u"}, {"$or": expected}]}
+
+
+def test_mirror_keyset_descending_keeps_null_rows_after_values(monkeypatch):
+    collection = _RecordingCollection()
+    monkeypatch.setattr(collections_query, "mirror_collection", lambda entity: collection)
+    params = CollectionsQuery(sort="due_date", order="desc", cursor=encode_cursor("2024-01-03", "i07"))
+    asyncio.run(params.mongo_page({"user_id": "u"}, "unpaid"))
+    assert collection.queries[0]["$and"][1] == {"$or": [
+        {"due_date": {"$lt": "2024-01-03"}},
+        {"due_date": "2024-01-03", "zoho_id": {"$lt": "i07"}},
+        {"due_date": None},
+    ]}
@@ -0,0 +1,59 @@
+"""
+DSO contributions and histogram percentiles
+"""
+
+import sys
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from dso_engine import (  # noqa: E402
+    DSO_HISTOGRAM_MAX_DAYS, _add_increments, histogram_percentile, payment_contribution
+)
+
+INVOICE_DATES = {"inv-1": date(2024, 1, 1), "INV-0002": date(2024, 1, 11)}
+
+
+def test_percentile_walks_bins_in_day_order():
+    histogram = {"30": 1, "5": 2, "10": 1, "90": 0}
+    assert histogram_percentile(histogram, 0.5) == 5
+    assert histogram_percentile(histogram, 0.75) == 10
+    assert histogram_percentile(histogram, 0.9) == 30
+    assert histogram_percentile(histogram, 1.0) == 30
+
+
+def test_percentile_of_an_empty_histogram_is_none():
+    assert histogram_percentile({}, 0.5) is None
+    assert histogram_percentile({"3": 0}, 0.5) is None
+
+
+def test_contribution_uses_applied_amounts():
+    payment = {
+        "date": "2024-01-31",
+        "amount": 300,
+        "invoices": [
+            {"invoice_id": "inv-1", "amount_applied": 100},
+            {"invoice_id": "unknown", "amount_applied": 200},
+        ],
+    }
+    assert payment_contribution(payment, INVOICE_DATES) == [[30, 100.0]]
+
+
+def test_contribution_splits_list_records_evenly_and_never_goes_negative():
+    payment = {"date": "2024-01-06", "amount": 50, "invoice_numbers": "inv-1, INV-0002"}
+    assert payment_contribution(payment, INVOICE_DATES) == [[5, 25.0], [0, 25.0]]
+    assert payment_contribution({"amount": 50, "invoice_numbers": "inv-1"}, INVOICE_DATES) == []
+
+
+def test_increments_cancel_out_when_a_contribution_is_replaced_by_itself():
+    inc = defaultdict(float)
+    applications = [[12, 40.0], [DSO_HISTOGRAM_MAX_DAYS + 30, 10.0]]
+    _add_increments(inc, "cust", applications, 1)
+    assert inc["totals.amount"] == 50.0
+    assert inc["customers.cust.weighted_days"] == 12 * 40.0 + (DSO_HISTOGRAM_MAX_DAYS + 30) * 10.0
+    assert inc[f"totals.histogram.{DSO_HISTOGRAM_MAX_DAYS}"] == 1
+
+    _add_increments(inc, "cust", applications, -1)
+    assert all(value == 0 for value in inc.values())
@@ -0,0 +1,151 @@
+"""
+Job queue requeue and merge semantics
+Runs _requeue and its callers against a small in-memory stand-in for the jobs
+collection that enforces the queued_key unique index.
+"""
+
+import asyncio
+import copy
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import job_queue  # noqa: E402
+from job_queue import PRIORITY_HIGH, PRIORITY_LOW, fail_job, release_job  # noqa: E402
+
+
+class FakeJobs:
+    """Equality filters and the update operators job_queue uses"""
+
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def _find(self, query):
+        for doc in self.docs.values():
+            if all(doc.get(field) == value for field, value in query.items()):
+                return doc
+        return None
+
+    def _apply(self, doc, change):
+        doc = copy.deepcopy(doc)
+        for path, value in change.get("$set", {}).items():
+            target = doc
+            *parents, leaf = path.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = value
+        for field in change.get("$unset", {}):
+            doc.pop(field, None)
+        for field, amount in change.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        for field, value in change.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+        key = doc.get("queued_key")
+        if isinstance(key, str) and any(
+            other.get("queued_key") == key for other in self.docs.values() if other["_id"] != doc["_id"]
+        ):
+            raise DuplicateKeyError("queued_key_unique")
+        return doc
+
+    async def update_one(self, query, change):
+        doc = self._find(query)
+        if doc is not None:
+            self.docs[doc["_id"]] = self._apply(doc, change)
+        return SimpleNamespace(modified_count=int(doc is not None))
+
+    async def find_one_and_update(self, query, change, projection=None):
+        doc = self._find(query)
+        if doc is not None:
+            self.docs[doc["_id"]] = self._apply(doc, change)
+        return doc
+
+    async def find_one(self, query, projection=None):
+        return self._find(query)
+
+
+def _running(job_id, **fields):
+    return {
+        "_id": job_id,
+        "type": "mirror_sync",
+        "key": "mirror_sync:u1",
+        "status": "running",
+        "lease_owner": "w1",
+        "lease_expires_at": "later",
+        "attempts": 1,
+        "max_attempts": 5,
+        "priority": PRIORITY_LOW,
+        "payload": {"full": False},
+        **fields,
+    }
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    def install(*docs):
+        collection = FakeJobs(docs)
+        monkeypatch.setattr(job_queue, "init_db", lambda: SimpleNamespace(jobs=collection))
+        return collection
+    return install
+
+
+def test_release_takes_the_queued_key_back(jobs):
+    collection = jobs(_running("a"))
+    asyncio.run(release_job(collection.docs["a"], "w1"))
+
+    job = collection.docs["a"]
+    assert job["status"] == "queued"
+    assert job["queued_key"] == "mirror_sync:u1"
+    assert job["attempts"] == 0
+    assert "lease_owner" not in job and "lease_expires_at" not in job
+
+
+def test_retry_merges_into_a_duplicate_queued_meanwhile(jobs):
+    collection = jobs(
+        _running("a", payload={"full": True}, priority=PRIORITY_HIGH),
+        {"_id": "b", "key": "mirror_sync:u1", "queued_key": "mirror_sync:u1", "status": "queued",
+         "priority": PRIORITY_LOW, "payload": {"full": False}},
+    )
+    asyncio.run(fail_job(collection.docs["a"], "w1", "boom"))
+
+    failed, queued = collection.docs["a"], collection.docs["b"]
+    assert failed["status"] == "merged"
+    assert failed["merged_into"] == "b"
+    assert "queued_key" not in failed
+    # The queued run widens to cover the merged one
+    assert queued["payload"] == {"full": True}
+    assert queued["priority"] == PRIORITY_HIGH
+
+
+def test_merge_never_narrows_the_queued_payload(jobs):
+    collection = jobs(
+        _running("a", payload={"full": False}),
+        {"_id": "b", "key": "mirror_sync:u1", "queued_key": "mirror_sync:u1", "status": "queued",
+         "priority": PRIORITY_HIGH, "payload": {"full": True}},
+    )
+    asyncio.run(release_job(collection.docs["a"], "w1"))
+
+    assert collection.docs["b"]["payload"] == {"full": True}
+    assert collection.docs["b"]["priority"] == PRIORITY_HIGH
+
+
+def test_last_attempt_fails_instead_of_requeueing(jobs):
+    collection = jobs(_running("a", attempts=5))
+    asyncio.run(fail_job(collection.docs["a"], "w1", "boom"))
+
+    job = collection.docs["a"]
+    assert job["status"] == "failed"
+    assert job["last_error"] == "boom"
+    assert "queued_key" not in job
+
+
+def test_requeue_ignores_a_job_this_worker_no_longer_holds(jobs):
+    collection = jobs(_running("a", lease_owner="w2"))
+    asyncio.run(release_job(collection.docs["a"], "w1"))
+
+    assert collection.docs["a"]["status"] == "running"
+    assert collection.docs["a"]["lease_owner"] == "w2"
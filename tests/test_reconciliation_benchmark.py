@@ -0,0 +1,75 @@
+"""
+Reconciliation matching benchmark
+Statement lines and candidates that all share one amount used to make every line
+scan every candidate; matching must stay near-linear however often an amount repeats.
+"""
+
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from reconciliation_engine import match_lines  # noqa: E402
+
+START = date(2024, 1, 1)
+
+
+def _day(offset: int) -> str:
+    return (START + timedelta(days=offset)).isoformat()
+
+
+def _payments(count: int):
+    return [
+        {"payment_id": f"p{i}", "payment_number": f"PAY-{i:06d}", "amount": 100.0, "date": _day(i % 365)}
+        for i in range(count)
+    ]
+
+
+def _invoices(count: int):
+    return [
+        {"invoice_id": f"i{i}", "invoice_number": f"INV-{i:06d}", "balance": 100.0, "date": _day(i % 365)}
+        for i in range(count)
+    ]
+
+
+def _lines(count: int):
+    return [
+        {"line_id": f"l{i}", "amount": 100.0, "date": _day(i % 365), "description": "NEFT CREDIT"}
+        for i in range(count)
+    ]
+
+
+def test_repeated_amounts_match_in_near_linear_time():
+    lines = _lines(10_000)
+    started = time.perf_counter()
+    matches = match_lines(lines, _payments(10_000), _invoices(10_000))
+    elapsed = time.perf_counter() - started
+
+    assert all(match is not None for match in matches.values())
+    claimed = [(match["kind"], match["id"]) for match in matches.values()]
+    assert len(set(claimed)) == len(claimed)
+    # The quadratic scan took over a minute here
+    assert elapsed < 10, f"matching 10k lines took {elapsed:.1f}s"
+
+
+def test_exact_match_prefers_reference_then_payment_then_closest_date():
+    payments = [
+        {"payment_id": "far", "payment_number": "PAY-1", "amount": 50.0, "date": "2024-03-01"},
+        {"payment_id": "near", "payment_number": "PAY-2", "amount": 50.0, "date": "2024-03-09"},
+    ]
+    invoices = [
+        {"invoice_id": "old", "invoice_number": "INV-000777", "balance": 50.0, "date": "2023-11-01"},
+        {"invoice_id": "recent", "invoice_number": "INV-000778", "balance": 50.0, "date": "2024-02-25"},
+    ]
+    lines = [
+        {"line_id": "ref", "amount": 50.0, "date": "2024-03-08", "description": "INV000777"},
+        {"line_id": "a", "amount": 50.0, "date": "2024-03-08", "description": "CREDIT"},
+        {"line_id": "b", "amount": 50.0, "date": "2024-03-08", "description": "CREDIT"},
+        {"line_id": "c", "amount": 50.0, "date": "2024-03-08", "description": "CREDIT"},
+    ]
+    matches = match_lines(lines, payments, invoices)
+
+    assert (matches["ref"]["id"], matches["ref"]["method"]) == ("old", "amount+reference")
+    assert [matches[line_id]["id"] for line_id in ("a", "b", "c")] == ["near", "far", "recent"]
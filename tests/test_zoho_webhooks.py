@@ -0,0 +1,63 @@
+"""
+Zoho webhook signature checks and event parsing
+"""
+
+import base64
+import hashlib
+import hmac
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from zoho_webhooks import WebhookError, parse_event, parse_payload, verify_signature  # noqa: E402
+
+BODY = b'{"invoice": {"invoice_id": "42"}}'
+
+
+def _digest(secret: str) -> bytes:
+    return hmac.new(secret.encode(), BODY, hashlib.sha256).digest()
+
+
+def test_signature_accepts_hex_base64_and_prefixed_forms():
+    digest = _digest("s3cret")
+    assert verify_signature(BODY, digest.hex(), ["s3cret"])
+    assert verify_signature(BODY, digest.hex().upper(), ["s3cret"])
+    assert verify_signature(BODY, f"sha256={digest.hex()}", ["s3cret"])
+    assert verify_signature(BODY, base64.b64encode(digest).decode(), ["s3cret"])
+
+
+def test_signature_tries_every_secret_and_rejects_the_rest():
+    signature = _digest("rotated").hex()
+    assert verify_signature(BODY, signature, ["", "old", "rotated"])
+    assert not verify_signature(BODY, signature, ["old"])
+    assert not verify_signature(BODY + b" ", signature, ["rotated"])
+    assert not verify_signature(BODY, None, ["rotated"])
+    assert not verify_signature(BODY, signature, [])
+
+
+def test_parse_event_reads_entity_action_and_id():
+    event = parse_event({"customerpayment": {"payment_id": 7, "amount": 10}, "event_type": "customerpayment_deleted"})
+    assert event == {
+        "entity": "payments",
+        "action": "delete",
+        "zoho_id": "7",
+        "record": {"payment_id": 7, "amount": 10},
+    }
+    assert parse_event({"invoice": {"invoice_id": "42"}})["action"] == "upsert"
+    assert parse_event({"invoice": {"invoice_id": "42"}}, event_type="Invoice_Deleted")["action"] == "delete"
+
+
+def test_parse_event_ignores_unknown_entities_and_rejects_missing_ids():
+    assert parse_event({"salesorder": {"salesorder_id": "1"}}) is None
+    with pytest.raises(WebhookError):
+        parse_event({"contact": {"contact_name": "Acme"}})
+
+
+def test_parse_payload_reads_form_encoded_json_string():
+    body = b"JSONString=%7B%22contact%22%3A%7B%22contact_id%22%3A%229%22%7D%7D"
+    assert parse_payload(body, "application/x-www-form-urlencoded") == {"contact": {"contact_id": "9"}}
+    with pytest.raises(WebhookError):
+        parse_payload(b"[1, 2]", "application/json")